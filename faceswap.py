@@ -28,6 +28,9 @@ if __name__ == "__main__":
     CONVERT = cli.ConvertArgs(SUBPARSER,
                               "convert",
                               "Convert a source image to a new one with the face swapped")
+    SWAP = cli.SwapArgs(SUBPARSER,
+                        "swap",
+                        "Swap the faces in raw video frames streamed through stdin and stdout")
     GUI = cli.GuiArgs(SUBPARSER,
                       "gui",
                       "Launch the Faceswap Graphical User Interface")
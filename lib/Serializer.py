@@ -2,8 +2,11 @@
 """
 Library providing convenient classes and methods for writing data to files.
 """
+import gzip
 import logging
 import json
+import lzma
+import os
 import pickle
 
 try:
@@ -13,6 +16,9 @@ except ImportError:
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+# Compression modules selected by a trailing filename extension
+COMPRESSION = {".gz": gzip, ".xz": lzma}
+
 
 class Serializer():
     """ Parent Serializer class """
@@ -30,6 +36,19 @@ class Serializer():
         """ Override for unmarshalling """
         raise NotImplementedError()
 
+    @classmethod
+    def marshal_stream(cls, input_data, out_file,
+                       compact=False):  # pylint: disable=unused-argument
+        """ Write marshalled data to an open file object.
+            Override for serializers that can write incrementally """
+        out_file.write(cls.marshal(input_data))
+
+    @classmethod
+    def unmarshal_stream(cls, in_file):
+        """ Read unmarshalled data from an open file object.
+            Override for serializers that can read incrementally """
+        return cls.unmarshal(in_file.read())
+
 
 class YAMLSerializer(Serializer):
     """ YAML Serializer """
@@ -45,6 +64,14 @@ class YAMLSerializer(Serializer):
     def unmarshal(cls, input_string):
         return yaml.load(input_string)
 
+    @classmethod
+    def marshal_stream(cls, input_data, out_file, compact=False):
+        yaml.dump(input_data, out_file, default_flow_style=compact)
+
+    @classmethod
+    def unmarshal_stream(cls, in_file):
+        return yaml.load(in_file)
+
 
 class JSONSerializer(Serializer):
     """ JSON Serializer """
@@ -60,6 +87,116 @@ class JSONSerializer(Serializer):
     def unmarshal(cls, input_string):
         return json.loads(input_string)
 
+    @classmethod
+    def marshal_stream(cls, input_data, out_file, compact=False):
+        """ Write a dictionary one top level item at a time so that the full
+            serialized string is never held in memory.
+
+            compact: Write without indentation or whitespace """
+        if not isinstance(input_data, dict):
+            json.dump(input_data, out_file, **cls.dump_kwargs(compact))
+            return
+        kwargs = cls.dump_kwargs(compact)
+        key_sep = ":" if compact else ": "
+        item_sep = "," if compact else ",\n  "
+        out_file.write("{" if compact or not input_data else "{\n  ")
+        for idx, (key, val) in enumerate(input_data.items()):
+            if idx != 0:
+                out_file.write(item_sep)
+            key = key if isinstance(key, str) else json.dumps(key)
+            val = json.dumps(val, **kwargs)
+            if not compact:
+                val = val.replace("\n", "\n  ")
+            out_file.write(json.dumps(key) + key_sep + val)
+        out_file.write("}" if compact or not input_data else "\n}")
+
+    @classmethod
+    def unmarshal_stream(cls, in_file):
+        """ Read a dictionary one top level item at a time so that only a
+            single item, rather than the full file, is held as a string """
+        return JSONStreamReader(in_file).read()
+
+    @staticmethod
+    def dump_kwargs(compact):
+        """ Return the json.dump keyword arguments for compact or indented output """
+        return {"separators": (",", ":")} if compact else {"indent": 2}
+
+
+class JSONStreamReader():
+    """ Incrementally decode a json file containing a dictionary from an open
+        file object. The file is read in chunks and decoded one top level item
+        at a time. Files that do not contain a dictionary are read in one go """
+    chunk_size = 1 << 20
+
+    def __init__(self, in_file):
+        self.file = in_file
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def read(self):
+        """ Return the decoded contents of the file """
+        if self.peek() != "{":
+            return json.loads(self.buffer[self.pos:] + self.file.read())
+        self.pos += 1
+        data = dict()
+        if self.peek() == "}":
+            self.pos += 1
+            return data
+        while True:
+            key = self.decode()
+            self.expect(":")
+            data[key] = self.decode()
+            if self.expect(",}") == "}":
+                break
+        if self.peek():
+            raise ValueError("Extra data after the end of the json object")
+        return data
+
+    def fill(self, size=None):
+        """ Read the next chunk from file, dropping what has already been
+            decoded. Returns False at the end of the file """
+        chunk = self.file.read(size or self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return not self.eof
+
+    def peek(self):
+        """ Skip whitespace and return the next character, or an empty string
+            at the end of the file """
+        while True:
+            self.pos = json.decoder.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        """ Consume and return the next character, which must be in chars """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expecting one of '{}' in json file, found "
+                             "'{}'".format(chars, char))
+        self.pos += 1
+        return char
+
+    def decode(self):
+        """ Decode the next value. A value is only complete when something
+            follows it, as the end of a chunk can fall inside a number """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Double the undecoded data each time, so a value larger than a
+            # chunk is not decoded from the start too many times
+            self.fill(max(self.chunk_size, len(self.buffer) - self.pos))
+
 
 class PickleSerializer(Serializer):
     """ Picke Serializer """
@@ -75,6 +212,14 @@ class PickleSerializer(Serializer):
     def unmarshal(cls, input_bytes):  # pylint: disable=arguments-differ
         return pickle.loads(input_bytes)
 
+    @classmethod
+    def marshal_stream(cls, input_data, out_file, compact=False):
+        pickle.dump(input_data, out_file)
+
+    @classmethod
+    def unmarshal_stream(cls, in_file):
+        return pickle.load(in_file)
+
 
 def get_serializer(serializer):
     """ Return requested serializer """
@@ -102,3 +247,37 @@ def get_serializer_from_ext(ext):
         logger.warning("You must have PyYAML installed to use YAML as the serializer.\n"
                        "Switching to JSON as the serializer.")
     return JSONSerializer
+
+
+def get_serializer_ext(filename):
+    """ Return the serializer extension of a filename, ignoring any
+        trailing compression extension """
+    base, ext = os.path.splitext(filename)
+    if ext.lower() in COMPRESSION:
+        ext = os.path.splitext(base)[1]
+    return ext
+
+
+def get_compression_ext(filename):
+    """ Return the compression extension of a filename or an empty
+        string if the file is not compressed """
+    ext = os.path.splitext(filename)[1]
+    return ext if ext.lower() in COMPRESSION else ""
+
+
+def open_file(filename, mode, compression_ext=None):
+    """ Open a file for reading or writing, transparently compressing or
+        decompressing with gzip or lzma.
+
+        compression_ext: The compression extension ('.gz' or '.xz') to use.
+                         If not provided, this is taken from the filename """
+    if compression_ext is None:
+        compression_ext = get_compression_ext(filename)
+    compression = COMPRESSION.get(compression_ext.lower(), None)
+    logger.trace("Opening file: (filename: '%s', mode: '%s', compression: %s)",
+                 filename, mode, compression)
+    if compression is None:
+        return open(filename, mode)
+    if "b" not in mode:
+        mode += "t"
+    return compression.open(filename, mode)
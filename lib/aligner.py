@@ -147,7 +147,7 @@ class Extract():
 def get_align_mat(face, size, should_align_eyes):
     """ Return the alignment Matrix """
     logger.trace("size: %s, should_align_eyes: %s", size, should_align_eyes)
-    mat_umeyama = umeyama(np.array(face.landmarks_as_xy[17:]),
+    mat_umeyama = umeyama(np.array(face.landmarks_as_xy[17:], dtype="float64"),
                           LANDMARKS_2D,
                           True)[0:2]
 
@@ -156,8 +156,8 @@ def get_align_mat(face, size, should_align_eyes):
 
     mat_umeyama = mat_umeyama * size
 
-    # Convert to matrix
-    landmarks = np.matrix(face.landmarks_as_xy)
+    # Convert to matrix of integer points
+    landmarks = np.matrix(np.rint(face.landmarks_as_xy).astype("int32"))
 
     # cv2 expects points to be in the form
     # np.array([ [[x1, y1]], [[x2, y2]], ... ]), we'll expand the dim
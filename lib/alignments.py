@@ -2,9 +2,16 @@
 """ Alignments file functions for reading, writing and manipulating
     a serialized alignments file """
 
+import json
 import logging
 import os
+import pickle
+import shutil
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import MutableMapping
 from datetime import datetime
+from hashlib import sha1
 
 import cv2
 
@@ -13,6 +20,8 @@ from lib.utils import rotate_landmarks
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+SHARDS_EXT = ".shards"
+
 
 class Alignments():
     """ Holds processes pertaining to the alignments file.
@@ -25,13 +34,23 @@ class Alignments():
         serializer: If provided, this will be the format that the data is
                     saved in (if data is to be saved). Can be 'json', 'pickle'
                     or 'yaml'
+        compact:    Save json alignments without indentation
+
+        A filename ending in '.gz' or '.xz' (e.g. 'alignments.json.gz') will
+        be compressed with gzip or lzma respectively.
+
+        A filename ending in '.shards' (e.g. 'alignments.shards') is a folder
+        of alignments shards (see ShardedData). Shards are loaded as frames
+        are accessed and only modified shards are rewritten on save.
     """
     # pylint: disable=too-many-public-methods
-    def __init__(self, folder, filename="alignments", serializer="json"):
-        logger.debug("Initializing %s: (folder: '%s', filename: '%s', serializer: '%s')",
-                     self.__class__.__name__, folder, filename, serializer)
+    def __init__(self, folder, filename="alignments", serializer="json", compact=False):
+        logger.debug("Initializing %s: (folder: '%s', filename: '%s', serializer: '%s', "
+                     "compact: %s)", self.__class__.__name__, folder, filename, serializer,
+                     compact)
         self.serializer = self.get_serializer(filename, serializer)
         self.file = self.get_location(folder, filename)
+        self.compact = compact
 
         self.data = self.load()
         logger.debug("Initialized %s", self.__class__.__name__)
@@ -55,7 +74,17 @@ class Alignments():
     @property
     def have_alignments_file(self):
         """ Return whether an alignments file exists """
-        retval = os.path.exists(self.file)
+        if self.is_sharded:
+            retval = os.path.exists(os.path.join(self.file, ShardedData.manifest_name))
+        else:
+            retval = os.path.exists(self.file)
+        logger.trace(retval)
+        return retval
+
+    @property
+    def is_sharded(self):
+        """ Return whether the alignments are held in a sharded folder """
+        retval = os.path.splitext(self.file)[1] == SHARDS_EXT
         logger.trace(retval)
         return retval
 
@@ -82,7 +111,7 @@ class Alignments():
             specified serializer will be used """
         logger.debug("Getting serializer: (filename: '%s', serializer: '%s')",
                      filename, serializer)
-        extension = os.path.splitext(filename)[1]
+        extension = Serializer.get_serializer_ext(filename)
         if extension in (".json", ".p", ".yaml", ".yml"):
             logger.debug("Serializer set from file extension: '%s'", extension)
             retval = Serializer.get_serializer_from_ext(extension)
@@ -98,8 +127,8 @@ class Alignments():
     def get_location(self, folder, filename):
         """ Return the path to alignments file """
         logger.debug("Getting location: (folder: '%s', filename: '%s')", folder, filename)
-        extension = os.path.splitext(filename)[1]
-        if extension in (".json", ".p", ".yaml", ".yml"):
+        extension = Serializer.get_serializer_ext(filename)
+        if extension in (".json", ".p", ".yaml", ".yml", SHARDS_EXT):
             logger.debug("File extension set from filename: '%s'", extension)
             location = os.path.join(str(folder), filename)
         else:
@@ -120,14 +149,24 @@ class Alignments():
             raise ValueError("Error: Alignments file not found at "
                              "{}".format(self.file))
 
+        logger.info("Reading alignments from: '%s'", self.file)
+        data = self.read_file()
+        logger.debug("Loaded alignments")
+        return data
+
+    def read_file(self):
+        """ Stream the alignments data in from the (optionally compressed)
+            alignments file. Sharded alignments only read the manifest """
+        if self.is_sharded:
+            data = ShardedData(self.file, self.serializer)
+            self.serializer = data.serializer
+            return data
         try:
-            logger.info("Reading alignments from: '%s'", self.file)
-            with open(self.file, self.serializer.roptions) as align:
-                data = self.serializer.unmarshal(align.read())
+            with Serializer.open_file(self.file, self.serializer.roptions) as align:
+                data = self.serializer.unmarshal_stream(align)
         except IOError as err:
             logger.error("'%s' not read: %s", self.file, err.strerror)
             exit(1)
-        logger.debug("Loaded alignments")
         return data
 
     def reload(self):
@@ -137,26 +176,92 @@ class Alignments():
         logger.debug("Re-loaded alignments")
 
     def save(self):
-        """ Write the serialized alignments file """
+        """ Write the serialized alignments file
+
+            The data is streamed to a temporary file in the destination folder
+            which then replaces the alignments file in a single rename, so an
+            interrupted save never leaves a partially written file """
         logger.debug("Saving alignments")
+        if self.is_sharded:
+            self.save_shards()
+            return
+        tmp_file = "{}.tmp".format(self.file)
+        compression_ext = Serializer.get_compression_ext(self.file)
+        try:
+            logger.info("Writing alignments to: '%s'", self.file)
+            with Serializer.open_file(tmp_file,
+                                      self.serializer.woptions,
+                                      compression_ext=compression_ext) as align:
+                self.serializer.marshal_stream(self.data, align, compact=self.compact)
+            os.replace(tmp_file, self.file)
+            logger.debug("Saved alignments")
+        except IOError as err:
+            logger.error("'%s' not written: %s", self.file, err.strerror)
+        finally:
+            # Only left behind if the save did not complete
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def save_shards(self):
+        """ Write the modified shards of sharded alignments """
+        if not isinstance(self.data, ShardedData):
+            data = ShardedData(self.file, self.serializer)
+            data.clear()
+            data.update(self.data)
+            self.data = data
         try:
             logger.info("Writing alignments to: '%s'", self.file)
-            with open(self.file, self.serializer.woptions) as align:
-                align.write(self.serializer.marshal(self.data))
+            self.data.save(compact=self.compact)
             logger.debug("Saved alignments")
         except IOError as err:
             logger.error("'%s' not written: %s", self.file, err.strerror)
 
+    def set_sharded(self, shard_size=1000):
+        """ Switch to a sharded alignments folder alongside the current
+            alignments file. The shards are written on the next save """
+        compression_ext = Serializer.get_compression_ext(self.file)
+        filename = os.path.splitext(self.file[:len(self.file) - len(compression_ext)])[0]
+        location = filename + SHARDS_EXT
+        logger.debug("Setting sharded: (location: '%s', shard_size: %s)", location, shard_size)
+        data = ShardedData(location,
+                           self.serializer,
+                           compression_ext=compression_ext,
+                           shard_size=shard_size)
+        data.clear()
+        data.update(self.data)
+        self.file = location
+        self.data = data
+
+    def set_write_back(self):
+        """ For sharded alignments, write modified shards out as they are
+            released from memory, rather than holding them until the next
+            save. Use for jobs which save all of their changes, so memory
+            is bounded regardless of how many shards are modified """
+        if not self.is_sharded:
+            return
+        logger.debug("Enabling shard write back")
+        self.data.write_back = True
+
     def backup(self):
         """ Backup copy of old alignments """
         logger.debug("Backing up alignments")
+        if self.is_sharded and self.have_alignments_file:
+            # Shards are saved in place, so the folder must be copied rather than moved
+            dst = "{}_{}{}".format(os.path.splitext(self.file)[0],
+                                   datetime.now().strftime("%Y%m%d_%H%M%S"),
+                                   SHARDS_EXT)
+            logger.info("Backing up original alignments to '%s'", dst)
+            shutil.copytree(self.file, dst)
+            logger.debug("Backed up alignments")
+            return
         if not os.path.isfile(self.file):
             logger.debug("No alignments to back up")
             return
         now = datetime.now().strftime("%Y%m%d_%H%M%S")
         src = self.file
-        split = os.path.splitext(src)
-        dst = split[0] + "_" + now + split[1]
+        compression_ext = Serializer.get_compression_ext(src)
+        split = os.path.splitext(src[:len(src) - len(compression_ext)])
+        dst = split[0] + "_" + now + split[1] + compression_ext
         logger.info("Backing up original alignments to '%s'", dst)
         os.rename(src, dst)
         logger.debug("Backed up alignments")
@@ -386,3 +491,277 @@ class Alignments():
                            abs(count_match), msg, frame_name)
         for idx, i_hash in hashes.items():
             faces[idx]["hash"] = i_hash
+
+
+class ShardedData(MutableMapping):
+    """ Dictionary-like access to alignments held in a folder of shard files
+        with a small json manifest.
+
+        Each shard holds a contiguous range of frame names. The manifest
+        stores the lowest frame name bounding each shard, so a frame can be
+        located without reading any other shard. Shards are loaded on first
+        access and held in a small LRU cache. Unmodified shards are released
+        when they drop out of the cache. Modified shards are kept until saved,
+        unless write_back is set, in which case they are written out as they
+        are released. Only modified shards are rewritten on save.
+
+        Modified shards do not count towards max_cached, so jobs which change
+        every frame without saving as they go hold every shard in memory. Such
+        jobs should enable write_back, or filter faces as they are read.
+
+        folder:          The sharded alignments folder
+        serializer:      The serializer to use for a new sharded folder. For an
+                         existing folder the serializer in the manifest is used
+        compression_ext: '.gz' or '.xz' to compress a new folder's shards
+        shard_size:      The number of frames to hold in each shard
+        max_cached:      The maximum number of unmodified shards to hold in memory
+    """
+    manifest_name = "manifest.json"
+
+    def __init__(self, folder, serializer, compression_ext="", shard_size=1000, max_cached=4):
+        logger.debug("Initializing %s: (folder: '%s', serializer: '%s', compression_ext: '%s', "
+                     "shard_size: %s, max_cached: %s)", self.__class__.__name__, folder,
+                     serializer.ext, compression_ext, shard_size, max_cached)
+        self.folder = folder
+        self.serializer = serializer
+        self.compression_ext = compression_ext
+        self.shard_size = shard_size
+        self.max_cached = max_cached
+        self.write_back = False
+
+        self.shards = list()
+        self.next_id = 0
+        self.cache = OrderedDict()
+        self.checksums = dict()
+        self.dirty = set()
+        self.removed = set()
+        if os.path.exists(self.manifest):
+            self.load_manifest()
+        logger.debug("Initialized %s", self.__class__.__name__)
+
+    @property
+    def manifest(self):
+        """ Full path to the manifest file """
+        return os.path.join(self.folder, self.manifest_name)
+
+    # << MAPPING INTERFACE >> #
+
+    def __getitem__(self, key):
+        idx = self.shard_index(key)
+        if idx is None:
+            raise KeyError(key)
+        return self.get_shard(idx)[key]
+
+    def __setitem__(self, key, value):
+        if not self.shards:
+            self.add_shard(key, dict())
+        idx = self.shard_index(key)
+        if key < self.shards[idx]["first"]:
+            self.shards[idx]["first"] = key
+        self.get_shard(idx)[key] = value
+        self.dirty.add(self.shards[idx]["id"])
+
+    def __delitem__(self, key):
+        idx = self.shard_index(key)
+        if idx is None:
+            raise KeyError(key)
+        del self.get_shard(idx)[key]
+        self.dirty.add(self.shards[idx]["id"])
+
+    def __iter__(self):
+        for shard_id in [shard["id"] for shard in self.shards]:
+            idx = next((idx for idx, shard in enumerate(self.shards) if shard["id"] == shard_id),
+                       None)
+            if idx is None:
+                continue
+            yield from list(self.get_shard(idx).keys())
+
+    def __len__(self):
+        return sum(len(self.cache[shard["id"]]) if shard["id"] in self.cache else shard["count"]
+                   for shard in self.shards)
+
+    def clear(self):
+        """ Remove all frames without loading the existing shards """
+        logger.debug("Clearing sharded alignments")
+        self.removed.update(shard["id"] for shard in self.shards)
+        self.shards = list()
+        self.cache.clear()
+        self.checksums.clear()
+        self.dirty.clear()
+
+    # << SHARD HANDLING >> #
+
+    def shard_index(self, key):
+        """ Return the index of the shard that holds or should hold the given key """
+        if not self.shards:
+            return None
+        idx = bisect_right([shard["first"] for shard in self.shards], key) - 1
+        return max(idx, 0)
+
+    def shard_file(self, shard_id):
+        """ Return the full path to a shard file """
+        filename = "shard_{:06d}.{}{}".format(shard_id, self.serializer.ext, self.compression_ext)
+        return os.path.join(self.folder, filename)
+
+    def add_shard(self, first, data):
+        """ Add a new shard, holding the given data, to the end of the shard list """
+        shard = {"id": self.next_id, "first": first, "count": len(data)}
+        logger.trace("Adding shard: %s", shard)
+        self.next_id += 1
+        self.shards.append(shard)
+        self.cache[shard["id"]] = data
+        self.dirty.add(shard["id"])
+        return shard
+
+    def get_shard(self, idx):
+        """ Return the frames dictionary for the shard at the given index,
+            loading it from disk if it is not cached """
+        shard_id = self.shards[idx]["id"]
+        if shard_id in self.cache:
+            self.cache.move_to_end(shard_id)
+            return self.cache[shard_id]
+        logger.trace("Loading shard: %s", shard_id)
+        with Serializer.open_file(self.shard_file(shard_id),
+                                  self.serializer.roptions,
+                                  compression_ext=self.compression_ext) as shard:
+            data = self.serializer.unmarshal_stream(shard)
+        self.checksums[shard_id] = self.checksum(data)
+        self.cache[shard_id] = data
+        self.release_cached(keep=shard_id)
+        return data
+
+    def release_cached(self, keep=None):
+        """ Release the least recently used shards over the cache limit.
+            Shards already known to be modified are skipped without being
+            checked again unless write_back is enabled """
+        for shard_id in list(self.cache.keys()):
+            held = len(self.cache) if self.write_back else len(self.cache) - len(self.dirty)
+            if held <= self.max_cached:
+                break
+            if shard_id == keep or (shard_id in self.dirty and not self.write_back):
+                continue
+            self.release(shard_id)
+
+    def release(self, shard_id):
+        """ Release a shard from memory if it has not been modified, or
+            write it out first if write_back is enabled. Returns True if the
+            shard was released """
+        if self.is_modified(shard_id):
+            if not self.write_back:
+                return False
+            self.write_shard(shard_id)
+        logger.trace("Releasing shard: %s", shard_id)
+        del self.cache[shard_id]
+        del self.checksums[shard_id]
+        return True
+
+    def is_modified(self, shard_id):
+        """ Return whether a cached shard differs from its file on disk.
+            Catches changes made to the face lists in place as well as
+            through this mapping. A shard found to be modified is marked as
+            dirty, so it is only checksummed once """
+        if shard_id in self.dirty:
+            return True
+        if self.checksum(self.cache[shard_id]) == self.checksums.get(shard_id, None):
+            return False
+        self.dirty.add(shard_id)
+        return True
+
+    def checksum(self, data):
+        """ Return the checksum of a shard's serialized data """
+        return sha1(pickle.dumps(data)).hexdigest()
+
+    def split_shards(self):
+        """ Split any cached shards that have grown past twice the shard size
+            into sorted shards of shard_size frames """
+        for shard in list(self.shards):
+            data = self.cache.get(shard["id"], None)
+            if data is None or len(data) <= self.shard_size * 2:
+                continue
+            logger.debug("Splitting shard: %s (frames: %s)", shard["id"], len(data))
+            keys = sorted(data.keys())
+            chunks = [keys[i:i + self.shard_size] for i in range(0, len(keys), self.shard_size)]
+            position = self.shards.index(shard)
+            self.cache[shard["id"]] = {key: data[key] for key in chunks[0]}
+            self.dirty.add(shard["id"])
+            for chunk in chunks[1:]:
+                new_shard = self.add_shard(chunk[0], {key: data[key] for key in chunk})
+                self.shards.remove(new_shard)
+                position += 1
+                self.shards.insert(position, new_shard)
+
+    def remove_empty_shards(self):
+        """ Remove any cached shards that no longer hold any frames """
+        for shard in list(self.shards):
+            data = self.cache.get(shard["id"], None)
+            if data is None or data or len(self.shards) == 1:
+                continue
+            logger.debug("Removing empty shard: %s", shard["id"])
+            self.shards.remove(shard)
+            del self.cache[shard["id"]]
+            self.checksums.pop(shard["id"], None)
+            self.dirty.discard(shard["id"])
+            self.removed.add(shard["id"])
+
+    # << I/O >> #
+
+    def load_manifest(self):
+        """ Load the shard list from the manifest """
+        logger.debug("Loading manifest: '%s'", self.manifest)
+        with open(self.manifest, "r") as manifest:
+            data = json.load(manifest)
+        self.serializer = Serializer.get_serializer_from_ext(".{}".format(data["serializer"]))
+        self.compression_ext = data["compression"]
+        self.shard_size = data["shard_size"]
+        self.next_id = data["next_id"]
+        self.shards = data["shards"]
+        logger.debug("Loaded manifest: (shards: %s)", len(self.shards))
+
+    def write_shard(self, shard_id, compact=False):
+        """ Write a shard to a temporary file then move it into place """
+        data = self.cache[shard_id]
+        filename = self.shard_file(shard_id)
+        tmp_file = "{}.tmp".format(filename)
+        logger.trace("Writing shard: '%s'", filename)
+        try:
+            with Serializer.open_file(tmp_file,
+                                      self.serializer.woptions,
+                                      compression_ext=self.compression_ext) as shard:
+                self.serializer.marshal_stream(data, shard, compact=compact)
+            os.replace(tmp_file, filename)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        next(shard for shard in self.shards if shard["id"] == shard_id)["count"] = len(data)
+        self.checksums[shard_id] = self.checksum(data)
+        self.dirty.discard(shard_id)
+
+    def save(self, compact=False):
+        """ Write out modified shards, then the manifest """
+        logger.debug("Saving sharded alignments: '%s'", self.folder)
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self.split_shards()
+        self.remove_empty_shards()
+        written = 0
+        for shard_id in list(self.cache.keys()):
+            if not self.is_modified(shard_id):
+                continue
+            self.write_shard(shard_id, compact=compact)
+            written += 1
+        manifest = {"serializer": self.serializer.ext,
+                    "compression": self.compression_ext,
+                    "shard_size": self.shard_size,
+                    "next_id": self.next_id,
+                    "shards": self.shards}
+        tmp_file = "{}.tmp".format(self.manifest)
+        with open(tmp_file, "w") as out_file:
+            json.dump(manifest, out_file, indent=2)
+        os.replace(tmp_file, self.manifest)
+        for shard_id in self.removed:
+            if os.path.exists(self.shard_file(shard_id)):
+                os.remove(self.shard_file(shard_id))
+        self.removed = set()
+        self.release_cached()
+        logger.debug("Saved sharded alignments: (shards written: %s, total shards: %s)",
+                     written, len(self.shards))
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+""" Save model checkpoints on a background thread """
+
+import json
+import logging
+import os
+import queue
+
+import h5py
+from keras import __version__ as keras_version
+from keras import backend as K
+
+from lib.multithreading import FSThread
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class Checkpoint():
+    """ Save all of a model's files together without holding up training.
+
+        save takes a copy of the weights in memory on the calling thread and
+        returns. The files are written to temporary files on a background
+        thread and, once all of them are written, moved into place together.
+        A journal listing the files is written before any are moved, so if
+        the process dies part way through, the move is finished when the
+        model is next loaded. The model files therefore always come from the
+        same save.
+
+        The files of the previous keep saves are kept as backups, named with
+        .bk for the newest, then .bk2, .bk3 and so on.
+
+        model_dir: The folder holding the model files
+        keep:      The number of previous saves to keep as backups
+    """
+    journal_name = "checkpoint_journal.json"
+
+    def __init__(self, model_dir, keep=1):
+        logger.debug("Initializing %s: (model_dir: '%s', keep: %s)",
+                     self.__class__.__name__, model_dir, keep)
+        self.model_dir = str(model_dir)
+        self.keep = keep
+        self.journal = os.path.join(self.model_dir, self.journal_name)
+        # Holds the next save while the previous is written. A further save
+        # waits for the write to finish rather than falling further behind
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = None
+        self.recover()
+        logger.debug("Initialized %s", self.__class__.__name__)
+
+    def save(self, files):
+        """ Take a copy of the files' contents and queue them to be written.
+
+            files: A dict of filename to either a keras model, whose weights
+                   are saved, or the bytes to write """
+        self.check_thread()
+        snapshot = {filename: content if isinstance(content, bytes) else WeightsSnapshot(content)
+                    for filename, content in files.items()}
+        if self.thread is None:
+            self.thread = FSThread(target=self.write_queued, name="checkpoint")
+            self.thread.daemon = True
+            self.thread.start()
+        self.put(snapshot)
+
+    def close(self):
+        """ Finish writing any queued save and stop the background thread """
+        if self.thread is None:
+            return
+        logger.debug("Closing %s", self.__class__.__name__)
+        self.put(None)
+        self.thread.join()
+        self.check_thread()
+        self.thread = None
+
+    def put(self, item):
+        """ Queue an item for the background thread, waiting while it is
+            still writing the previous save """
+        while True:
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                self.check_thread()
+
+    def check_thread(self):
+        """ Re-raise any error from the background thread """
+        if self.thread is not None and self.thread.err:
+            logger.error("Caught exception in checkpoint thread")
+            err = self.thread.err
+            self.thread = None
+            raise err[1].with_traceback(err[2])
+
+    def write_queued(self):
+        """ Write the queued saves until told to stop """
+        while True:
+            files = self.queue.get()
+            if files is None:
+                break
+            self.write(files)
+
+    def write(self, files):
+        """ Write the files to temporary files then move them into place """
+        filenames = sorted(files)
+        for filename in filenames:
+            tmp_file = self.tmp_path(filename)
+            content = files[filename]
+            if isinstance(content, bytes):
+                with open(tmp_file, "wb") as handle:
+                    handle.write(content)
+            else:
+                content.write(tmp_file)
+            sync_file(tmp_file)
+        tmp_journal = "{}.tmp".format(self.journal)
+        with open(tmp_journal, "w") as handle:
+            json.dump(filenames, handle)
+        sync_file(tmp_journal)
+        os.replace(tmp_journal, self.journal)
+        self.commit(filenames)
+        logger.info("Saved model files: %s", ", ".join(filenames))
+
+    def commit(self, filenames):
+        """ Move the written files into place, backing up the current files,
+            then remove the journal. Files that have already been moved are
+            skipped, so an interrupted commit can be run again """
+        for filename in filenames:
+            tmp_file = self.tmp_path(filename)
+            if not os.path.exists(tmp_file):
+                continue
+            path = os.path.join(self.model_dir, filename)
+            if os.path.exists(path):
+                self.backup(path)
+            os.replace(tmp_file, path)
+        os.remove(self.journal)
+
+    def backup(self, path):
+        """ Make the file the newest backup, moving the older backups along
+            and dropping the oldest """
+        if self.keep < 1:
+            return
+        backups = [path + ".bk"] + ["{}.bk{}".format(path, idx) for idx in range(2, self.keep + 1)]
+        for newer, older in reversed(list(zip(backups[:-1], backups[1:]))):
+            if os.path.exists(newer):
+                os.replace(newer, older)
+        os.replace(path, backups[0])
+
+    def recover(self):
+        """ Finish moving the files of a save that was interrupted """
+        if not os.path.exists(self.journal):
+            return
+        with open(self.journal, "r") as handle:
+            filenames = json.load(handle)
+        logger.warning("Completing an interrupted save of the model files: %s",
+                       ", ".join(filenames))
+        self.commit(filenames)
+
+    def tmp_path(self, filename):
+        """ Return the path the file is written to before it is moved into place """
+        return os.path.join(self.model_dir, "{}.tmp".format(filename))
+
+
+class WeightsSnapshot():
+    """ A copy of a keras model's weights that can be written to a weights
+        file, in the format of keras' save_weights, from another thread.
+
+        The weights are read in one call when the snapshot is taken, so
+        training can carry on updating the model while they are written """
+    def __init__(self, model):
+        layers = model.layers
+        values = K.batch_get_value([weight for layer in layers for weight in layer.weights])
+        self.backend = K.backend()
+        self.layers = list()
+        start = 0
+        for layer in layers:
+            names = [str(weight.name) if getattr(weight, "name", None) else "param_{}".format(idx)
+                     for idx, weight in enumerate(layer.weights)]
+            self.layers.append((layer.name, names, values[start:start + len(names)]))
+            start += len(names)
+
+    def write(self, filename):
+        """ Write the weights to an hdf5 weights file """
+        with h5py.File(filename, "w") as handle:
+            handle.attrs["layer_names"] = [name.encode("utf8") for name, _, _ in self.layers]
+            handle.attrs["backend"] = self.backend.encode("utf8")
+            handle.attrs["keras_version"] = str(keras_version).encode("utf8")
+            for layer_name, names, values in self.layers:
+                group = handle.create_group(layer_name)
+                group.attrs["weight_names"] = [name.encode("utf8") for name in names]
+                for name, value in zip(names, values):
+                    dataset = group.create_dataset(name, value.shape, dtype=value.dtype)
+                    if not value.shape:
+                        dataset[()] = value
+                    else:
+                        dataset[:] = value
+            handle.flush()
+
+
+def sync_file(filename):
+    """ Flush a written file to disk, so that it is complete before it is
+        moved into place """
+    with open(filename, "rb+") as handle:
+        os.fsync(handle.fileno())
@@ -386,7 +386,18 @@ class ExtractArgs(ExtractConvertArgs):
                               "help": "Serializer for alignments file. If "
                                       "yaml is chosen and not available, then "
                                       "json will be used as the default "
-                                      "fallback."})
+                                      "fallback. Alignments files passed in "
+                                      "with a '.gz' or '.xz' extension (e.g. "
+                                      "'alignments.json.gz') will be "
+                                      "compressed."})
+        argument_list.append({"opts": ("--compact-alignments", ),
+                              "action": "store_true",
+                              "dest": "compact_alignments",
+                              "default": False,
+                              "help": "Write json alignments without "
+                                      "indentation. Creates significantly "
+                                      "smaller files which are harder to read "
+                                      "by eye."})
         argument_list.append({
             "opts": ("-D", "--detector"),
             "type": str,
@@ -603,6 +614,29 @@ class ConvertArgs(ExtractConvertArgs):
                               "type": int,
                               "default": 1,
                               "help": "Number of GPUs to use for conversion"})
+        argument_list.append({
+            "opts": ("-D", "--detector"),
+            "type": str,
+            "choices":  PluginLoader.get_available_extractors(
+                "detect"),
+            "default": "dlib-hog",
+            "help": "Detector to use when there is no alignments file and "
+                    "faces are extracted on the fly. Default is dlib-hog"})
+        argument_list.append({
+            "opts": ("-A", "--aligner"),
+            "type": str,
+            "choices": PluginLoader.get_available_extractors(
+                "align"),
+            "default": "dlib",
+            "help": "Aligner to use when there is no alignments file and "
+                    "faces are extracted on the fly. Default is dlib"})
+        argument_list.append({"opts": ("-fif", "--frames-in-flight"),
+                              "type": int,
+                              "dest": "frames_in_flight",
+                              "default": 8,
+                              "help": "The maximum number of frames being "
+                                      "detected and aligned at once when "
+                                      "extracting on the fly. Default is 8"})
         argument_list.append({"opts": ("-fr", "--frame-ranges"),
                               "nargs": "+",
                               "type": str,
@@ -630,6 +664,17 @@ class ConvertArgs(ExtractConvertArgs):
                               "default": False,
                               "help": "Use cv2's seamless clone. "
                                       "(Masked converter only)"})
+        argument_list.append({"opts": ("-Sd", "--seamless-downscale"),
+                              "type": int,
+                              "dest": "seamless_downscale",
+                              "default": 0,
+                              "help": "Solve seamless clone at this size "
+                                      "(in pixels) for faces that are "
+                                      "larger, then apply the correction at "
+                                      "full size. Much faster for large "
+                                      "faces at a small cost in accuracy. "
+                                      "0 to always clone at full size. "
+                                      "(Masked converter only)"})
         argument_list.append({"opts": ("-mh", "--match-histogram"),
                               "action": "store_true",
                               "dest": "match_histogram",
@@ -654,6 +699,73 @@ class ConvertArgs(ExtractConvertArgs):
                               "help": "Place the swapped face on a "
                                       "transparent layer rather than the "
                                       "original frame."})
+        argument_list.append({"opts": ("-bs", "--batch-size"),
+                              "type": int,
+                              "dest": "batch_size",
+                              "default": 16,
+                              "help": "The number of faces to feed through "
+                                      "the model at once. Frames are read "
+                                      "in groups of this size and their "
+                                      "faces predicted together. Higher "
+                                      "values are faster but use more VRAM. "
+                                      "Default is 16"})
+        argument_list.append({"opts": ("-j", "--jobs"),
+                              "type": int,
+                              "dest": "jobs",
+                              "default": 0,
+                              "help": "The number of processes to use for "
+                                      "blending the swapped faces onto the "
+                                      "frames. 0 uses one less than the "
+                                      "number of CPU cores. 1 blends in the "
+                                      "main process. Default is 0"})
+        argument_list.append({"opts": ("-pc", "--prediction-cache"),
+                              "action": DirFullPaths,
+                              "dest": "prediction_cache",
+                              "default": None,
+                              "help": "Store the model's predictions in this "
+                                      "folder and reuse them on later runs "
+                                      "with the same model. Re-running "
+                                      "convert with different blending "
+                                      "options then skips the model, and the "
+                                      "GPU, for every face already "
+                                      "predicted. Predictions are kept per "
+                                      "model checkpoint, so retraining the "
+                                      "model does not reuse stale faces."})
+        argument_list.append({"opts": ("-vo", "--video-output"),
+                              "dest": "video_output",
+                              "default": None,
+                              "help": "Write the converted frames straight "
+                                      "to this video file with ffmpeg "
+                                      "instead of saving an image per frame "
+                                      "into the output folder. ffmpeg must "
+                                      "be installed."})
+        argument_list.append({"opts": ("-vc", "--video-codec"),
+                              "dest": "video_codec",
+                              "default": "libx264",
+                              "help": "The ffmpeg video codec to use with "
+                                      "--video-output. Default is libx264"})
+        argument_list.append({"opts": ("-crf", "--video-crf"),
+                              "type": int,
+                              "dest": "video_crf",
+                              "default": 18,
+                              "help": "The constant rate factor to encode "
+                                      "--video-output with. Lower is better "
+                                      "quality and larger files. Default is "
+                                      "18"})
+        argument_list.append({"opts": ("-fps", "--video-fps"),
+                              "type": float,
+                              "dest": "video_fps",
+                              "default": None,
+                              "help": "The frame rate of --video-output. "
+                                      "Defaults to the frame rate of the "
+                                      "input video, or 25 for a folder of "
+                                      "frames."})
+        argument_list.append({"opts": ("-ca", "--copy-audio"),
+                              "action": "store_true",
+                              "dest": "copy_audio",
+                              "default": False,
+                              "help": "Copy the audio from the input video "
+                                      "into --video-output."})
         return argument_list
 
 
@@ -692,6 +804,16 @@ class TrainArgs(FaceSwapArgs):
                               "default": 100,
                               "help": "Sets the number of iterations before "
                                       "saving the model"})
+        argument_list.append({"opts": ("-kc", "--keep-checkpoints"),
+                              "type": int,
+                              "dest": "keep_checkpoints",
+                              "default": 1,
+                              "help": "The number of previous saves of the "
+                                      "model files to keep as backups, "
+                                      "named .bk, .bk2 and so on. Saves are "
+                                      "written in the background and all of "
+                                      "a model's files are replaced "
+                                      "together. Default is 1"})
         argument_list.append({"opts": ("-t", "--trainer"),
                               "type": str,
                               "choices": PluginLoader.get_available_models(),
@@ -704,6 +826,64 @@ class TrainArgs(FaceSwapArgs):
                               "default": 64,
                               "help": "Batch size, as a power of 2 "
                                       "(64, 128, 256, etc)"})
+        argument_list.append({"opts": ("-dw", "--data-workers"),
+                              "type": int,
+                              "dest": "data_workers",
+                              "default": 0,
+                              "help": "The number of processes building the "
+                                      "training batches for each of the A "
+                                      "and B sides. 0 splits one less than "
+                                      "the number of CPU cores between the "
+                                      "sides. 1 builds the batches in a "
+                                      "background thread of the training "
+                                      "process. Default is 0"})
+        argument_list.append({"opts": ("-pf", "--prefetch"),
+                              "type": int,
+                              "dest": "prefetch",
+                              "default": 2,
+                              "help": "The number of batches for each side "
+                                      "to build ahead of the trainer. Each "
+                                      "side builds its batches in place in "
+                                      "a ring of this many + 1 preallocated "
+                                      "batches. Higher values smooth out "
+                                      "slow image loads but use more "
+                                      "memory. Default is 2"})
+        argument_list.append({"opts": ("-cm", "--cache-memory"),
+                              "type": int,
+                              "dest": "cache_memory",
+                              "default": None,
+                              "help": "The memory in MB to use for holding "
+                                      "decoded training images, so that "
+                                      "later epochs do not read and decode "
+                                      "them again. Shared between the A and "
+                                      "B sides and their data workers. 0 "
+                                      "disables the cache. Defaults to a "
+                                      "quarter of the available RAM"})
+        argument_list.append({"opts": ("-pk", "--packed-faces"),
+                              "action": DirFullPaths,
+                              "dest": "packed_faces",
+                              "default": None,
+                              "help": "Pack the A and B faces, resized to "
+                                      "256px, into one file per side in "
+                                      "this folder and train from the "
+                                      "packed files. Training then reads "
+                                      "faces straight from memory mapped "
+                                      "pages instead of decoding and "
+                                      "resizing every image, and training "
+                                      "sessions using the same folder "
+                                      "share the pages. Only faces that "
+                                      "have been added or changed since the "
+                                      "last pack are packed again."})
+        argument_list.append({"opts": ("-tfd", "--tf-data"),
+                              "action": "store_true",
+                              "dest": "tf_data",
+                              "default": False,
+                              "help": "Build the training batches with a "
+                                      "tf.data pipeline instead of data "
+                                      "worker processes. The data workers "
+                                      "are then the number of batches for "
+                                      "each side that tensorflow builds at "
+                                      "once on its own threads"})
         argument_list.append({"opts": ("-it", "--iterations"),
                               "type": int,
                               "default": 1000000,
@@ -775,6 +955,41 @@ class TrainArgs(FaceSwapArgs):
         return argument_list
 
 
+class SwapArgs(FaceSwapArgs):
+    """ Class to parse the command line arguments for swapping faces in
+        frames streamed through stdin and stdout. The model, converter and
+        extractor options are shared with convert """
+
+    @staticmethod
+    def get_argument_list():
+        """ Put the arguments in a list so that they are accessible from both
+        argparse and gui """
+        shared = ("--model-dir", "--trainer", "--converter", "--blur-size",
+                  "--erosion-kernel-size", "--mask-type", "--sharpen", "--gpus",
+                  "--detector", "--aligner", "--swap-model", "--seamless",
+                  "--seamless-downscale", "--match-histogram", "--smooth-mask",
+                  "--avg-color-adjust")
+        argument_list = [option for option in ConvertArgs.get_optional_arguments()
+                         if option["opts"][-1] in shared]
+        argument_list.append({"opts": ("-fs", "--frame-size"),
+                              "dest": "frame_size",
+                              "required": True,
+                              "help": "The size of the frames read from "
+                                      "stdin, as WIDTHxHEIGHT. Frames are raw "
+                                      "BGR24, as written by ffmpeg with "
+                                      "'-f rawvideo -pix_fmt bgr24'"})
+        argument_list.append({"opts": ("-wu", "--warmup"),
+                              "type": int,
+                              "dest": "warmup",
+                              "default": 1,
+                              "help": "The number of blank frames to run "
+                                      "through the detector and model "
+                                      "before reading frames, so that the "
+                                      "first frames are not delayed. "
+                                      "Default is 1"})
+        return argument_list
+
+
 class GuiArgs(FaceSwapArgs):
     """ Class to parse the command line arguments for training """
 
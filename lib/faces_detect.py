@@ -2,6 +2,8 @@
 """ Face and landmarks detection for faceswap.py """
 import logging
 
+import numpy as np
+
 from dlib import rectangle as d_rectangle  # pylint: disable=no-name-in-module
 from lib.aligner import Extract as AlignerExtract, get_align_mat
 
@@ -9,7 +11,15 @@ logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 
 class DetectedFace():
-    """ Detected face and landmark information """
+    """ Detected face and landmark information
+
+        Slotted as one is created for every face of every frame in convert.
+        Landmarks are held as a single (68, 2) float32 array. The alignment
+        matrix and the matrices derived from it are calculated on first use
+        and cached until the landmarks change. """
+    __slots__ = ("image", "x", "w", "y", "h", "frame_dims", "hash", "aligned",
+                 "_landmarks", "_matrices")
+
     def __init__(  # pylint: disable=invalid-name
             self, image=None, x=None, w=None, y=None, h=None,
             frame_dims=None, landmarksXY=None):
@@ -20,16 +30,46 @@ class DetectedFace():
         self.y = y
         self.h = h
         self.frame_dims = frame_dims
+        self._landmarks = None
+        self._matrices = None
         self.landmarksXY = landmarksXY
         self.hash = None  # Hash must be set when the file is saved due to image compression
 
-        self.aligned = dict()
+        self.aligned = None
         logger.trace("Initialized %s", self.__class__.__name__)
 
+    @property
+    def landmarksXY(self):  # pylint: disable=invalid-name
+        """ Landmarks as a (68, 2) float32 array """
+        return self._landmarks
+
+    @landmarksXY.setter
+    def landmarksXY(self, landmarks):  # pylint: disable=invalid-name
+        """ Store landmarks as a float32 array and clear the cached matrices """
+        self._landmarks = None if landmarks is None else np.array(landmarks,
+                                                                  dtype="float32").reshape(-1, 2)
+        self._matrices = None
+
     @property
     def landmarks_as_xy(self):
         """ Landmarks as XY """
-        return self.landmarksXY
+        return self._landmarks
+
+    def get_align_mat(self, size=256, align_eyes=False):
+        """ Return the alignment matrix for these landmarks. The matrix is
+            calculated on first request and cached. Without eye alignment
+            the matrix does not depend on size """
+        key = ("align", size if align_eyes else None, align_eyes)
+        return self.cached_matrix(key, get_align_mat, self, size, align_eyes)
+
+    def cached_matrix(self, key, func, *args):
+        """ Return the matrix stored for key, calculating it with func(*args)
+            if it has not yet been cached """
+        if self._matrices is None:
+            self._matrices = dict()
+        if key not in self._matrices:
+            self._matrices[key] = func(*args)
+        return self._matrices[key]
 
     def to_dlib_rect(self):
         """ Return Bounding Box as Dlib Rectangle """
@@ -74,11 +114,18 @@ class DetectedFace():
         alignment["y"] = self.y
         alignment["h"] = self.h
         alignment["frame_dims"] = self.frame_dims
-        alignment["landmarksXY"] = self.landmarksXY
+        alignment["landmarksXY"] = self.landmarks_to_list()
         alignment["hash"] = self.hash
         logger.trace("Returning: %s", alignment)
         return alignment
 
+    def landmarks_to_list(self):
+        """ Return the landmarks as a list of integer [x, y] pairs for the
+            alignments file """
+        if self._landmarks is None:
+            return None
+        return np.rint(self._landmarks).astype("int32").tolist()
+
     def from_alignment(self, alignment, image=None):
         """ Convert a face alignment to detected face object """
         logger.trace("Creating from alignment: (alignment: %s, has_image: %s)",
@@ -104,10 +151,11 @@ class DetectedFace():
             reference to aligned properties for this face """
         logger.trace("Loading aligned face: (size: %s, padding: %s, align_eyes: %s)",
                      size, padding, align_eyes)
+        self.aligned = dict()
         self.aligned["size"] = size
         self.aligned["padding"] = padding
         self.aligned["align_eyes"] = align_eyes
-        self.aligned["matrix"] = get_align_mat(self, size, align_eyes)
+        self.aligned["matrix"] = self.get_align_mat(size, align_eyes)
         if image is None:
             self.aligned["face"] = None
         else:
@@ -124,16 +172,18 @@ class DetectedFace():
     def original_roi(self):
         """ Return the square aligned box location on the original
             image """
-        roi = AlignerExtract().get_original_roi(self.aligned["matrix"],
-                                                self.aligned["size"],
-                                                self.aligned["padding"])
+        roi = self.cached_matrix(("roi", ) + self.aligned_key,
+                                 AlignerExtract().get_original_roi,
+                                 self.aligned["matrix"],
+                                 self.aligned["size"],
+                                 self.aligned["padding"])
         logger.trace("Returning: %s", roi)
         return roi
 
     @property
     def aligned_landmarks(self):
         """ Return the landmarks location transposed to extracted face """
-        landmarks = AlignerExtract().transform_points(self.landmarksXY,
+        landmarks = AlignerExtract().transform_points(np.rint(self._landmarks).astype("int32"),
                                                       self.aligned["matrix"],
                                                       self.aligned["size"],
                                                       self.aligned["padding"])
@@ -148,8 +198,15 @@ class DetectedFace():
     @property
     def adjusted_matrix(self):
         """ Return adjusted matrix for size/padding combination """
-        mat = AlignerExtract().transform_matrix(self.aligned["matrix"],
-                                                self.aligned["size"],
-                                                self.aligned["padding"])
+        mat = self.cached_matrix(("adjusted", ) + self.aligned_key,
+                                 AlignerExtract().transform_matrix,
+                                 self.aligned["matrix"],
+                                 self.aligned["size"],
+                                 self.aligned["padding"])
         logger.trace("Returning: %s", mat)
         return mat
+
+    @property
+    def aligned_key(self):
+        """ Return the cache key for the currently loaded aligned face """
+        return (self.aligned["size"], self.aligned["padding"], self.aligned["align_eyes"])
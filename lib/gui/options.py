@@ -41,7 +41,8 @@ class CliOptions():
             if inspect.isclass(obj) and name.lower().endswith("args") \
                     and name.lower() not in (("faceswapargs",
                                               "extractconvertargs",
-                                              "guiargs")):
+                                              "guiargs",
+                                              "swapargs")):
                 mod_classes.append(name)
         logger.debug(mod_classes)
         return mod_classes
@@ -53,7 +53,8 @@ class CurrentSession():
                       "batchsize": None,    # Set and reset by wrapper
                       "timestamps": [],
                       "loss": [],
-                      "losskeys": []}
+                      "losskeys": [],
+                      "timing": dict()}
         self.timestats = {"start": None,
                           "elapsed": None}
         self.modeldir = None    # Set and reset by wrapper
@@ -85,6 +86,13 @@ class CurrentSession():
         for idx, item in enumerate(currentloss):
             self.stats["loss"][idx].append(float(item[1]))
 
+    def add_timing(self, timing):
+        """ Set the latest rolling step timings from the training process and
+            return them """
+        keys = ("rate", "data", "compute", "save", "preview")
+        self.stats["timing"] = dict(zip(keys, (float(value) for value in timing)))
+        return self.stats["timing"]
+
     def add_timestats(self):
         """ Add timestats to loss dict and timestats """
         now = time.time()
@@ -44,6 +44,7 @@ class FileHandler():
                           "alignments": (("JSON", "*.json"),
                                          ("Pickle", "*.p"),
                                          ("YAML", "*.yaml"),
+                                         ("Compressed", "*.gz", "*.xz"),
                                          all_files),
                           "config": (("Faceswap config files", "*.fsw"), all_files),
                           "csv": (("Comma separated values", "*.csv"), all_files),
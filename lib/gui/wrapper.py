@@ -143,6 +143,8 @@ class FaceswapControl():
         self.process = None
         self.consoleregex = {
             "loss": re.compile(r"([a-zA-Z_]+):.*?(\d+\.\d+)"),
+            "timing": re.compile(r"(\d+\.\d+) EGs/s data (\d+)% compute (\d+)% "
+                                 r"save (\d+\.\d+)s preview (\d+\.\d+)s"),
             "tqdm": re.compile(r"(\d+%|\d+/\d+|\d+:\d+|\d+\.\d+[a-zA-Z/]+)")}
 
     def execute_script(self, command, args):
@@ -227,6 +229,13 @@ class FaceswapControl():
         if not message:
             return False
 
+        timing = self.consoleregex["timing"].search(string)
+        if timing:
+            timing = self.wrapper.session.add_timing(timing.groups())
+            message += ("Rate: {rate:.1f} EGs/s  Data wait: {data:.0f}%  "
+                        "Compute: {compute:.0f}%  Save: {save:.2f}s  "
+                        "Preview: {preview:.2f}s  ".format(**timing))
+
         elapsed = self.wrapper.session.timestats["elapsed"]
         iterations = self.wrapper.session.stats["iterations"]
 
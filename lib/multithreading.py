@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 """ Multithreading/processing utils for faceswap """
 
+import ctypes
 import logging
 import multiprocessing as mp
 import queue as Queue
 import sys
 import threading
+
+import numpy as np
+
 from lib.logger import LOG_QUEUE, set_root_logger
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
@@ -103,6 +107,62 @@ class SpawnProcess(mp.context.SpawnProcess):
         logger.debug("Joined Process: (name: '%s', PID: %s)", self._name, self.pid)
 
 
+class SharedFrameBuffer():
+    """ A fixed number of shared memory slots for passing uint8 frames, or other
+        fixed size arrays, between processes without pickling them.
+
+        The slots must be created before the worker processes are spawned, and
+        this object passed to them at creation (e.g. as a Pool initarg), so
+        that the children inherit the shared memory. Slots are acquired and
+        released in the parent. Arrays that do not fit in a slot should be
+        passed by value instead """
+    def __init__(self, slots, slot_size):
+        logger.debug("Initializing %s: (slots: %s, slot_size: %s)",
+                     self.__class__.__name__, slots, slot_size)
+        ctx = mp.get_context("spawn")
+        self.slot_size = slot_size
+        self._arrays = [ctx.RawArray(ctypes.c_uint8, slot_size) for _ in range(slots)]
+        self._free = Queue.Queue()
+        for idx in range(slots):
+            self._free.put(idx)
+        logger.debug("Initialized %s", self.__class__.__name__)
+
+    def __getstate__(self):
+        """ The free slot queue only lives in the parent process """
+        state = self.__dict__.copy()
+        state["_free"] = None
+        return state
+
+    def fits(self, array):
+        """ Return whether the array can be held in a slot """
+        return array.dtype == np.uint8 and array.nbytes <= self.slot_size
+
+    def acquire(self, abort=None):
+        """ Return the index of a free slot, blocking until one is available.
+
+            abort: An optional event. If it is set while waiting, slots may
+                   never be released, so a RuntimeError is raised """
+        while True:
+            try:
+                return self._free.get(timeout=None if abort is None else 1)
+            except Queue.Empty:
+                if abort.is_set():
+                    raise RuntimeError("Stopped waiting for a free frame slot")
+
+    def release(self, idx):
+        """ Return a slot to the free pool """
+        self._free.put(idx)
+
+    def get(self, idx, shape, dtype=np.uint8):
+        """ Return a view of the given shape and dtype onto a slot """
+        count = int(np.prod(shape))
+        return np.frombuffer(self._arrays[idx], dtype=dtype, count=count).reshape(shape)
+
+    def put(self, idx, array):
+        """ Copy an array into a slot """
+        self.get(idx, array.shape, array.dtype)[...] = array
+
+
 class FSThread(threading.Thread):
     """ Subclass of thread that passes errors back to parent """
     def __init__(self, group=None, target=None, name=None,  # pylint: disable=too-many-arguments
@@ -155,6 +215,10 @@ class MultiThread():
             self._threads.append(thread)
         logger.debug("Started all threads '%s': %s", self._name, len(self._threads))
 
+    def is_alive(self):
+        """ Return whether any of the threads are still running """
+        return any(thread.is_alive() for thread in self._threads)
+
     def join(self):
         """ Join the running threads, catching and re-raising any errors """
         logger.debug("Joining Threads: '%s'", self._name)
@@ -176,6 +240,7 @@ class BackgroundGenerator(threading.Thread):
         threading.Thread.__init__(self)
         self.queue = Queue.Queue(maxsize=prefetch)
         self.generator = generator
+        self.err = None
         self.daemon = True
         self.start()
 
@@ -184,17 +249,25 @@ class BackgroundGenerator(threading.Thread):
             Note: put blocks only if put is called while queue has already
             reached max size => this makes 2 prefetched items! One in the
             queue, one waiting for insertion! """
-        for item in self.generator:
-            self.queue.put(item)
-        self.queue.put(None)
+        try:
+            for item in self.generator:
+                self.queue.put(item)
+        except Exception:  # pylint: disable=broad-except
+            self.err = sys.exc_info()
+        finally:
+            self.queue.put(None)
 
     def iterator(self):
-        """ Iterate items out of the queue """
+        """ Iterate items out of the queue, re-raising any error from the
+            generator """
         while True:
             next_item = self.queue.get()
             if next_item is None:
                 break
             yield next_item
+        if self.err:
+            logger.error("Caught exception in background generator")
+            raise self.err[1].with_traceback(self.err[2])
 
 
 def terminate_processes():
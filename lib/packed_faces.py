@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+""" Training faces packed into one memory mapped file """
+
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class PackedFaces():
+    """ A folder of training faces decoded, resized to 256px and packed into
+        one uint8 file that is memory mapped for reading. Training reads
+        faces straight from the mapped pages, and processes training from the
+        same file share them through the OS page cache.
+
+        The index lists the source image held in each record, by name, size
+        and modification time. Records of removed or changed images are
+        freed, and reused by new images, when the file is updated.
+
+        folder: The folder holding the packed faces and the index
+    """
+    face_shape = (256, 256, 3)
+
+    def __init__(self, folder):
+        logger.debug("Initializing %s: (folder: '%s')", self.__class__.__name__, folder)
+        self.folder = str(folder)
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self.data_file = os.path.join(self.folder, "faces.bin")
+        self.index_file = os.path.join(self.folder, "index.json")
+        self.index = self.load_index()
+        self.count = len(self.index)
+        self._data = None
+        logger.debug("Initialized %s: (records: %s)", self.__class__.__name__, self.count)
+
+    def __getstate__(self):
+        """ Only pass what is needed to read the faces to other processes.
+            They map the file themselves """
+        state = self.__dict__.copy()
+        state["index"] = None
+        state["_data"] = None
+        return state
+
+    @property
+    def record_size(self):
+        """ The size in bytes of one packed face """
+        return int(np.prod(self.face_shape))
+
+    @property
+    def data(self):
+        """ The packed faces, mapped read only on first access """
+        if self._data is None:
+            self._data = np.memmap(self.data_file, dtype="uint8", mode="r",
+                                   shape=(self.count, ) + self.face_shape)
+        return self._data
+
+    def load_index(self):
+        """ Return the index of packed faces """
+        if not os.path.exists(self.index_file):
+            return list()
+        with open(self.index_file, "r") as handle:
+            return json.load(handle)
+
+    def save_index(self):
+        """ Write the index to a temporary file then move it into place """
+        tmp_file = "{}.tmp".format(self.index_file)
+        with open(tmp_file, "w") as handle:
+            json.dump(self.index, handle)
+        os.replace(tmp_file, self.index_file)
+
+    def faces(self):
+        """ Return a reference to each packed face, for use in place of the
+            image filenames when training """
+        return [PackedFace(self, idx) for idx, entry in enumerate(self.index)
+                if entry is not None]
+
+    def get(self, idx):
+        """ Return a read only view of a packed face """
+        return self.data[idx]
+
+    def update(self, filenames):
+        """ Pack the images in filenames that are not already packed.
+
+            Records of changed and removed images are freed, and the index
+            saved, before any face is written, so an interrupted update
+            never leaves the index pointing at the wrong face """
+        images = dict()
+        for filename in filenames:
+            stat = os.stat(filename)
+            images[os.path.basename(filename)] = (filename, stat.st_size, stat.st_mtime_ns)
+
+        packed = set()
+        freed = list()
+        for idx, entry in enumerate(self.index):
+            source = None if entry is None else images.get(entry["name"], None)
+            if source is not None and source[1:] == (entry["size"], entry["mtime"]):
+                packed.add(entry["name"])
+                continue
+            self.index[idx] = None
+            freed.append(idx)
+        to_pack = [name for name in sorted(images) if name not in packed]
+        logger.info("Packing faces into '%s': %s packed, %s to pack",
+                    self.folder, len(packed), len(to_pack))
+        if not to_pack and not freed:
+            return
+        self.save_index()
+
+        slots = freed + list(range(len(self.index),
+                                   len(self.index) + max(len(to_pack) - len(freed), 0)))
+        self.index.extend([None] * (len(slots) - len(freed)))
+        self.count = len(self.index)
+        self._data = None
+        with open(self.data_file, "ab") as handle:
+            handle.truncate(self.count * self.record_size)
+        data = np.memmap(self.data_file, dtype="uint8", mode="r+",
+                         shape=(self.count, ) + self.face_shape)
+        for idx, name in tqdm(zip(slots, to_pack), desc="Packing", total=len(to_pack)):
+            filename, size, mtime = images[name]
+            image = cv2.imread(filename)  # pylint: disable=no-member
+            if image is None:
+                logger.warning("Unable to open image. Skipping: '%s'", filename)
+                continue
+            if image.shape != self.face_shape:
+                image = cv2.resize(image, self.face_shape[:2])  # pylint: disable=no-member
+            data[idx] = image
+            self.index[idx] = {"name": name, "size": size, "mtime": mtime}
+        data.flush()
+        del data
+        self.save_index()
+
+
+class PackedFace():
+    """ A reference to one face in PackedFaces """
+    __slots__ = ("packed", "idx")
+
+    def __init__(self, packed, idx):
+        self.packed = packed
+        self.idx = idx
+
+    def __repr__(self):
+        return "{}[{}]".format(self.packed.folder, self.idx)
+
+    def load(self):
+        """ Return the packed face """
+        return self.packed.get(self.idx)
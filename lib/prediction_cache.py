@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+""" On disk cache of model predictions for convert """
+
+import json
+import logging
+import os
+from hashlib import sha1
+
+import numpy as np
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def get_checkpoint_id(model_dir, trainer, swapped):
+    """ Return an id for the model weights in model_dir.
+
+        The id changes whenever a weights file is added, removed or
+        rewritten, taken from each file's name, size and modification time,
+        so the weights do not have to be read """
+    checkpoint = sha1("{}|{}".format(trainer, swapped).encode("utf-8"))
+    for entry in sorted(os.scandir(str(model_dir)), key=lambda entry: entry.name):
+        if not entry.is_file() or not entry.name.endswith(".h5"):
+            continue
+        stat = entry.stat()
+        checkpoint.update("|{}|{}|{}".format(entry.name,
+                                             stat.st_size,
+                                             stat.st_mtime_ns).encode("utf-8"))
+    retval = checkpoint.hexdigest()[:16]
+    logger.debug("Checkpoint id: %s", retval)
+    return retval
+
+
+class PredictionCache():
+    """ Model predictions for one model checkpoint, keyed by a hash of the
+        face fed to the model.
+
+        Predictions are stored as fixed size float32 records appended to a
+        single data file. The index lists the key of each record in order.
+        It is rewritten atomically every save_every new records and on close.
+        Records written after the last index save are dropped when the cache
+        is next opened.
+
+        folder:        The cache folder. Each checkpoint has its own sub-folder
+        checkpoint_id: The id of the model weights, from get_checkpoint_id
+    """
+    save_every = 1000
+
+    def __init__(self, folder, checkpoint_id):
+        logger.debug("Initializing %s: (folder: '%s', checkpoint_id: %s)",
+                     self.__class__.__name__, folder, checkpoint_id)
+        self.folder = os.path.join(str(folder), checkpoint_id)
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self.data_file = os.path.join(self.folder, "predictions.bin")
+        self.index_file = os.path.join(self.folder, "index.json")
+        self.shape = None
+        self.keys = list()
+        self.index = dict()
+        self.unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        self.load_index()
+        self.handle = open(self.data_file, "r+b" if os.path.exists(self.data_file) else "w+b")
+        self.handle.truncate(len(self.keys) * self.record_size)
+        logger.debug("Initialized %s: (records: %s)", self.__class__.__name__, len(self.keys))
+
+    @property
+    def record_size(self):
+        """ The size in bytes of one stored prediction """
+        return 0 if self.shape is None else int(np.prod(self.shape)) * 4
+
+    @staticmethod
+    def key(feed):
+        """ Return the cache key for a face fed to the model """
+        feed = np.ascontiguousarray(feed)
+        key = sha1(str(feed.shape).encode("utf-8"))
+        key.update(feed.data)
+        return key.hexdigest()
+
+    def load_index(self):
+        """ Load the index of stored predictions """
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, "r") as handle:
+                index = json.load(handle)
+        except (IOError, ValueError) as err:
+            logger.warning("Ignoring unreadable prediction cache index '%s': %s",
+                           self.index_file, err)
+            return
+        self.shape = tuple(index["shape"])
+        self.keys = index["keys"]
+        self.index = {key: idx for idx, key in enumerate(self.keys)}
+
+    def save_index(self):
+        """ Write the index to a temporary file then move it into place """
+        self.handle.flush()
+        tmp_file = "{}.tmp".format(self.index_file)
+        with open(tmp_file, "w") as handle:
+            json.dump({"shape": self.shape, "keys": self.keys}, handle)
+        os.replace(tmp_file, self.index_file)
+        self.unsaved = 0
+
+    def get(self, key):
+        """ Return the stored prediction for key, or None if it is not cached """
+        idx = self.index.get(key, None)
+        if idx is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.handle.seek(idx * self.record_size)
+        data = self.handle.read(self.record_size)
+        return np.frombuffer(data, dtype="float32").reshape(self.shape)
+
+    def put(self, key, prediction):
+        """ Store a prediction. Predictions of a different shape to those
+            already stored (from a different model size) are not cached """
+        if key in self.index:
+            return
+        prediction = np.asarray(prediction, dtype="float32")
+        if self.shape is None:
+            self.shape = prediction.shape
+        elif prediction.shape != self.shape:
+            logger.debug("Not caching prediction of shape %s. Cache holds shape %s",
+                         prediction.shape, self.shape)
+            return
+        self.handle.seek(len(self.keys) * self.record_size)
+        self.handle.write(np.ascontiguousarray(prediction).tobytes())
+        self.index[key] = len(self.keys)
+        self.keys.append(key)
+        self.unsaved += 1
+        if self.unsaved >= self.save_every:
+            self.save_index()
+
+    def close(self):
+        """ Save the index and close the data file """
+        if self.unsaved:
+            self.save_index()
+        self.handle.close()
+        logger.debug("Closed prediction cache: (hits: %s, misses: %s, records: %s)",
+                     self.hits, self.misses, len(self.keys))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+""" Rolling timings of the phases of each training step """
+
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class StepTimer():
+    """ Time the phases of the training steps and report rolling averages.
+
+        Steps are separated by calls to step. Waiting for data and computing
+        the update happen on every step, so they are reported as their share
+        of the step time over the last window steps. Saving and previewing
+        only happen on some steps, so they are reported as the mean time they
+        took over their last few runs.
+
+        batch_size: The number of faces trained on for each side per step
+        window:     The number of steps to average over
+    """
+    step_phases = ("data", "compute")
+    event_phases = ("save", "preview")
+    event_window = 10
+
+    def __init__(self, batch_size, window=100):
+        logger.debug("Initializing %s: (batch_size: %s, window: %s)",
+                     self.__class__.__name__, batch_size, window)
+        self.batch_size = batch_size
+        self.steps = deque(maxlen=window)
+        self.events = {phase: deque(maxlen=self.event_window) for phase in self.event_phases}
+        self.current = dict.fromkeys(self.step_phases, 0.0)
+        self.step_start = None
+        logger.debug("Initialized %s", self.__class__.__name__)
+
+    def step(self):
+        """ Close the timings of the previous step and start the next """
+        now = time.perf_counter()
+        if self.step_start is not None:
+            self.steps.append((now - self.step_start, self.current["data"],
+                               self.current["compute"]))
+        self.step_start = now
+        self.current = dict.fromkeys(self.step_phases, 0.0)
+
+    @contextmanager
+    def phase(self, name):
+        """ Time the enclosed block as part of the named phase """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if name in self.events:
+                self.events[name].append(elapsed)
+            else:
+                self.current[name] += elapsed
+
+    def stats(self):
+        """ Return the rolling averages: the training rate in faces per second
+            for each side, the data wait and compute percentages of the step
+            time, and the save and preview times in seconds. None if no step
+            has completed """
+        if not self.steps:
+            return None
+        total = sum(step[0] for step in self.steps)
+        retval = {"rate": self.batch_size * len(self.steps) / max(total, 1e-9)}
+        for idx, phase in enumerate(self.step_phases):
+            retval[phase] = sum(step[idx + 1] for step in self.steps) / max(total, 1e-9) * 100
+        for phase, times in self.events.items():
+            retval[phase] = sum(times) / len(times) if times else 0.0
+        return retval
+
+    def status(self):
+        """ Return the rolling averages to add to the loss line, or an empty
+            string before the first step completes. The GUI reads loss values
+            from text followed by a colon, so the status must not hold one """
+        stats = self.stats()
+        if stats is None:
+            return ""
+        return (" [{rate:.1f} EGs/s data {data:.0f}% compute {compute:.0f}% "
+                "save {save:.2f}s preview {preview:.2f}s]".format(**stats))
@@ -1,24 +1,77 @@
+import logging
+import multiprocessing as mp
+import os
+import queue
+from collections import OrderedDict, deque
 from random import shuffle
 import cv2
 import numpy
 
-from .multithreading import BackgroundGenerator
-from .umeyama import umeyama
+from .logger import LOG_QUEUE, set_root_logger
+from .multithreading import BackgroundGenerator, SharedFrameBuffer
+from .packed_faces import PackedFace
+from .umeyama import umeyama, umeyama_batch
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 class TrainingDataGenerator():
-    def __init__(self, random_transform_args, coverage, scale=5, zoom=1): #TODO thos default should stay in the warp function
+    """ Generate batches of warped and target faces for training.
+
+        training_opts holds the optional batch building settings passed in
+        from the train command:
+            workers:  The number of processes building each side's batches.
+                      1 builds them in a background thread instead
+            prefetch: The number of batches built ahead of the trainer. Each
+                      side holds a ring of prefetch + 1 preallocated batches
+            cache_size: The memory budget in bytes for each side's cache of
+                      decoded images, split between its workers. None or 0
+                      disables the cache
+            tf_data:  Build the batches with a tf.data pipeline, running
+                      workers batches at once on tensorflow's threads """
+    def __init__(self, random_transform_args, coverage, scale=5, zoom=1, training_opts=None): #TODO thos default should stay in the warp function
         self.random_transform_args = random_transform_args
         self.coverage = coverage
         self.scale = scale
         self.zoom = zoom
+        training_opts = dict() if training_opts is None else training_opts
+        self.workers = training_opts.get("workers", 1)
+        self.prefetch = training_opts.get("prefetch", 1)
+        self.cache_size = training_opts.get("cache_size", None)
+        self.tf_data = training_opts.get("tf_data", False)
+        self.cache_stats = dict()
+        self.warp_grid = None
 
     def minibatchAB(self, images, batchsize, doShuffle=True):
-        batch = BackgroundGenerator(self.minibatch(images, batchsize, doShuffle), 1)
-        for ep1, warped_img, target_img in batch.iterator():
-            yield ep1, warped_img, target_img
+        """ Yield the epoch and the warped and target faces of each batch.
+
+            Batches are built in place into a ring of prefetch + 1 preallocated
+            slots, by worker processes if there is more than one worker, or by
+            a background thread otherwise. The faces are yielded as views onto
+            their slot, which is only refilled once the trainer asks for the
+            next batch, so a batch must not be kept beyond then. If tf_data is
+            set the batches come from dataset_minibatch instead """
+        if self.tf_data:
+            yield from self.dataset_minibatch(images, batchsize, doShuffle)
+            return
+        size = 64 * self.zoom
+        shape = (batchsize, 2, size, size, 3)
+        slots = SharedFrameBuffer(self.prefetch + 1, int(numpy.prod(shape)) * 4)
+        if self.workers > 1:
+            batches = self.pooled_minibatch(images, batchsize, doShuffle, slots)
+        else:
+            batches = BackgroundGenerator(self.minibatch(images, batchsize, doShuffle, slots),
+                                          self.prefetch).iterator()
+        try:
+            for ep1, slot in batches:
+                rtn = slots.get(slot, shape, dtype=numpy.float32)
+                yield ep1, rtn[:,0,:,:,:], rtn[:,1,:,:,:]
+                slots.release(slot)
+        finally:
+            batches.close()
 
-    # A generator function that yields epoch, batchsize of warped_img and batchsize of target_img
-    def minibatch(self, data, batchsize, doShuffle=True):
+    def batch_filenames(self, data, batchsize, doShuffle=True):
+        """ Yield the epoch and the filenames of each batch. data is shuffled
+            in place at the start of every epoch """
         length = len(data)
         assert length >= batchsize, "Number of images is lower than batch-size (Note that too few images may lead to bad training). # images: {}, batch-size: {}".format(length, batchsize)
         epoch = i = 0
@@ -31,24 +84,164 @@ class TrainingDataGenerator():
                     shuffle(data)
                 i = 0
                 epoch+=1
-            rtn = numpy.float32([self.read_image(img) for img in data[i:i+size]])
+            yield epoch, data[i:i+size]
             i+=size
-            yield epoch, rtn[:,0,:,:,:], rtn[:,1,:,:,:]
 
-    def color_adjust(self, img):
-        return img / 255.0
+    def minibatch(self, data, batchsize, doShuffle=True, slots=None):
+        """ Build each batch into a free slot and yield its epoch and slot.
+            Blocks while every slot is in use """
+        cache = ImageCache(self.cache_size) if self.cache_size else None
+        size = 64 * self.zoom
+        for epoch, filenames in self.batch_filenames(data, batchsize, doShuffle):
+            slot = slots.acquire()
+            self.build_batch(filenames, cache, out=slots.get(slot,
+                                                             (batchsize, 2, size, size, 3),
+                                                             dtype=numpy.float32))
+            if cache is not None:
+                self.cache_stats[id(cache)] = (cache.hits, cache.misses)
+            yield epoch, slot
 
-    def read_image(self, fn):
+    def build_batch(self, filenames, cache=None, out=None):
+        """ Return the warped and target faces for filenames stacked in one
+            float32 array of shape (batch, 2, size, size, 3), written into out
+            if it is given. Faces are kept as uint8 while they are loaded and
+            augmented, and only colour adjusted to float32 here """
+        images = numpy.stack([self.load_face(img, cache) for img in filenames])
+        batch = self.augment_batch(images)
+        if out is None:
+            out = numpy.empty(batch.shape, dtype=numpy.float32)
+        return self.color_adjust(batch, out=out)
+
+    def cache_status(self):
+        """ Return the decoded image cache hit rate to add to the loss line,
+            or an empty string if the cache is disabled """
+        if not self.cache_size:
+            return ""
+        stats = list(self.cache_stats.values())
+        hits = sum(stat[0] for stat in stats)
+        lookups = hits + sum(stat[1] for stat in stats)
+        return " [cache hits {:.1f}%]".format(hits / max(lookups, 1) * 100)
+
+    def pooled_minibatch(self, data, batchsize, doShuffle=True, slots=None):
+        """ Yield the same epochs and slots as minibatch, with the batches
+            built by a pool of worker processes.
+
+            The workers write the batches straight into the shared memory
+            slots, and they are yielded in order. prefetch batches are built
+            while the trainer uses the current batch """
+        ctx = mp.get_context("spawn")
+        pool = ctx.Pool(processes=self.workers,
+                        initializer=init_data_worker,
+                        initargs=(self, slots, logging.getLogger().level, LOG_QUEUE))
+        logger.debug("Started %s training data workers: (batchsize: %s, prefetch: %s)",
+                     self.workers, batchsize, self.prefetch)
+        batches = self.batch_filenames(data, batchsize, doShuffle)
+        pending = deque()
         try:
-            image = self.color_adjust(cv2.imread(fn))
-        except TypeError:
-            raise Exception("Error while reading image", fn)
+            while True:
+                while len(pending) <= self.prefetch:
+                    epoch, filenames = next(batches)
+                    slot = slots.acquire()
+                    pending.append((epoch, slot, pool.apply_async(build_batch_in_slot,
+                                                                  (slot, filenames))))
+                epoch, slot, result = pending.popleft()
+                worker, hits, misses = result.get()
+                self.cache_stats[worker] = (hits, misses)
+                yield epoch, slot
+        finally:
+            pool.terminate()
+
+    def dataset_minibatch(self, data, batchsize, doShuffle=True):
+        """ Yield the same epochs and faces as minibatchAB, with the batches
+            built by a tf.data pipeline and read in the keras session.
+
+            The batch filenames come from batch_filenames, so packed faces
+            are read as well as image files. The pipeline's parallel map
+            builds workers batches at once with build_batch, so the batches
+            are the same as the other builders', and OpenCV releases the GIL
+            while it warps the faces. prefetch batches are built while the
+            trainer uses the current batch. The image cache is split into
+            workers caches, and each call takes one for the batch it builds,
+            whichever of tensorflow's threads it runs on. Each batch is a new
+            array """
+        import tensorflow as tf  # pylint: disable=import-error
+        from keras import backend as K  # pylint: disable=import-error
+        size = 64 * self.zoom
+        shape = (batchsize, 2, size, size, 3)
+        batches = self.batch_filenames(data, batchsize, doShuffle)
+        # Filenames may be packed faces, so only a key for them goes through the pipeline
+        pending = dict()
+        caches = queue.Queue()
+        for _ in range(self.workers):
+            caches.put(ImageCache(self.cache_size // self.workers) if self.cache_size else None)
+
+        def batch_keys():
+            """ Yield the epoch and a key to the filenames of each batch """
+            for key, (epoch, filenames) in enumerate(batches):
+                pending[key] = filenames
+                yield epoch, key
+
+        def build(key):
+            """ Build the batch for the key with a free share of the image cache """
+            cache = caches.get()
+            try:
+                batch = self.build_batch(pending.pop(int(key)), cache)
+                if cache is not None:
+                    self.cache_stats[id(cache)] = (cache.hits, cache.misses)
+            finally:
+                caches.put(cache)
+            return batch
+
+        def build_op(epoch, key):
+            """ Return the epoch and the batch built for the key """
+            batch = tf.py_func(build, [key], tf.float32, stateful=True)
+            batch.set_shape(shape)
+            return epoch, batch
+
+        session = K.get_session()
+        with session.graph.as_default():
+            dataset = tf.data.Dataset.from_generator(batch_keys, (tf.int64, tf.int64))
+            dataset = dataset.map(build_op, num_parallel_calls=self.workers)
+            dataset = dataset.prefetch(self.prefetch)
+            next_batch = dataset.make_one_shot_iterator().get_next()
+        logger.debug("Started tf.data training pipeline: (batchsize: %s, workers: %s, "
+                     "prefetch: %s)", batchsize, self.workers, self.prefetch)
+        while True:
+            epoch, batch = session.run(next_batch)
+            yield int(epoch), batch[:, 0, :, :, :], batch[:, 1, :, :, :]
+
+    def color_adjust(self, img, out=None):
+        """ Return the uint8 image scaled to 0 - 1, written into out if given """
+        return numpy.divide(img, 255.0, out=out)
+
+    @staticmethod
+    def load_image(fn, cache=None):
+        """ Return the decoded image, from the cache if it holds it. Packed
+            faces are read from their memory mapped file instead """
+        if isinstance(fn, PackedFace):
+            return fn.load()
+        image = None if cache is None else cache.get(fn)
+        if image is None:
+            image = cv2.imread(fn)
+            if image is None:
+                raise Exception("Error while reading image", fn)
+            if cache is not None:
+                cache.put(fn, image)
+        return image
+
+    def load_face(self, fn, cache=None):
+        """ Return the uint8 face resized to 256px """
+        image = self.load_image(fn, cache)
+        if image.shape[:2] != (256, 256):
+            image = cv2.resize(image, (256,256))
+        return image
 
-        image = cv2.resize(image, (256,256))
+    def read_image(self, fn, cache=None):
+        image = self.load_face(fn, cache)
         image = self.random_transform( image, **self.random_transform_args )
         warped_img, target_img = self.random_warp( image, self.coverage, self.scale, self.zoom )
 
-        return warped_img, target_img
+        return self.color_adjust(warped_img), self.color_adjust(target_img)
 
     def random_transform(self, image, rotation_range, zoom_range, shift_range, random_flip):
         h, w = image.shape[0:2]
@@ -87,6 +280,122 @@ class TrainingDataGenerator():
 
         return warped_image, target_image
 
+    def get_augment_params(self, count):
+        """ Return the random transform and warp parameters for a batch of
+            count faces, drawn for the whole batch at once:
+                rotation: Degrees of rotation (count, )
+                scale:    Zoom factor (count, )
+                shift:    x and y shift in pixels (count, 2)
+                flip:     Whether the face is flipped (count, )
+                noise:    Offsets of the x and y warp grid points (count, 2, 5, 5) """
+        args = self.random_transform_args
+        return {"rotation": numpy.random.uniform(-args["rotation_range"],
+                                                 args["rotation_range"],
+                                                 count),
+                "scale": numpy.random.uniform(1 - args["zoom_range"],
+                                              1 + args["zoom_range"],
+                                              count),
+                "shift": numpy.random.uniform(-args["shift_range"],
+                                              args["shift_range"],
+                                              (count, 2)) * 256,
+                "flip": numpy.random.random(count) < args["random_flip"],
+                "noise": numpy.random.normal(size=(count, 2, 5, 5), scale=self.scale)}
+
+    def augment_batch(self, images, params=None):
+        """ Return the random transform and random warp of a batch of 256px
+            faces as one array of shape (batch, 2, size, size, 3) holding the
+            warped and target faces.
+
+            Gives the same result as random_transform then random_warp on
+            each face with the same parameters, but the transform matrices,
+            interpolated warp maps and umeyama fits are computed for the whole
+            batch together, leaving one warpAffine and one remap per face """
+        count = len(images)
+        size = 64 * self.zoom
+        params = self.get_augment_params(count) if params is None else params
+        interp, src_grid, dst_points = self.get_warp_grid()
+
+        transformed = numpy.empty_like(images)
+        for image, mat, out in zip(images, self.transform_matrices(params), transformed):
+            cv2.warpAffine(image, mat, (256, 256), dst=out, borderMode=cv2.BORDER_REPLICATE)
+        transformed[params["flip"]] = transformed[params["flip"], :, ::-1]
+
+        maps = src_grid + params["noise"]
+        interp_maps = numpy.matmul(numpy.matmul(interp, maps), interp.T).astype("float32")
+        src_points = maps.reshape(count, 2, 25).transpose(0, 2, 1)
+        mats = umeyama_batch(src_points, dst_points, True)[:, 0:2]
+
+        retval = numpy.empty((count, 2, size, size, 3), dtype=images.dtype)
+        for idx, image in enumerate(transformed):
+            cv2.remap(image, interp_maps[idx, 0], interp_maps[idx, 1], cv2.INTER_LINEAR,
+                      dst=retval[idx, 0])
+            cv2.warpAffine(image, mats[idx], (size, size), dst=retval[idx, 1])
+        return retval
+
+    @staticmethod
+    def transform_matrices(params):
+        """ Return the random_transform affine matrix of each face in a batch.
+            Matches cv2.getRotationMatrix2D about the centre of a 256px face
+            plus the shift """
+        angle = params["rotation"] * numpy.pi / 180
+        alpha = numpy.cos(angle) * params["scale"]
+        beta = numpy.sin(angle) * params["scale"]
+        mats = numpy.empty((len(angle), 2, 3))
+        mats[:, 0, 0] = alpha
+        mats[:, 0, 1] = beta
+        mats[:, 0, 2] = (1 - alpha) * 128 - beta * 128 + params["shift"][:, 0]
+        mats[:, 1, 0] = -beta
+        mats[:, 1, 1] = alpha
+        mats[:, 1, 2] = beta * 128 + (1 - alpha) * 128 + params["shift"][:, 1]
+        return mats
+
+    def get_warp_grid(self):
+        """ Return the parts of random_warp that do not change between faces,
+            built on first use:
+                interp:     The bilinear weights that resize the 5x5 grid to
+                            the cropped warp map, so a map is interp.grid.interp.T
+                src_grid:   The x and y grid points before noise (2, 5, 5)
+                dst_points: The grid points in the target face (25, 2) """
+        if self.warp_grid is None:
+            zoom = self.zoom
+            range_ = numpy.linspace(128 - self.coverage//2, 128 + self.coverage//2, 5)
+            mapx = numpy.broadcast_to(range_, (5, 5))
+            interp = cv2.resize(numpy.eye(5), (5, 80*zoom))[8*zoom:72*zoom]
+            dst_points = numpy.mgrid[0:65*zoom:16*zoom,0:65*zoom:16*zoom].T.reshape(-1,2)
+            self.warp_grid = (interp, numpy.stack([mapx, mapx.T]), dst_points)
+        return self.warp_grid
+
+class ImageCache():
+    """ Least recently used cache of decoded training images, held within a
+        memory budget in bytes. hits and misses count the lookups """
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.images = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename):
+        """ Return the cached image, or None if it is not cached """
+        image = self.images.get(filename, None)
+        if image is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.images.move_to_end(filename)
+        return image
+
+    def put(self, filename, image):
+        """ Cache an image, evicting the least recently used images to keep
+            within the budget """
+        if image.nbytes > self.budget:
+            return
+        while self.used + image.nbytes > self.budget:
+            _, evicted = self.images.popitem(last=False)
+            self.used -= evicted.nbytes
+        self.images[filename] = image
+        self.used += image.nbytes
+
 def stack_images(images):
     def get_transpose_axes(n):
         if n % 2 == 0:
@@ -104,3 +413,29 @@ def stack_images(images):
         images,
         axes=numpy.concatenate(new_axes)
         ).reshape(new_shape)
+
+
+_DATA_WORKER = dict()  # pylint: disable=invalid-name
+
+
+def init_data_worker(generator, buffer, loglevel, log_queue):
+    """ Set up a training data worker process with its own copy of the
+        generator, its share of the image cache and the shared batch slots """
+    set_root_logger(loglevel, log_queue)
+    _DATA_WORKER["generator"] = generator
+    _DATA_WORKER["buffer"] = buffer
+    _DATA_WORKER["cache"] = ImageCache(generator.cache_size // generator.workers
+                                       if generator.cache_size else 0)
+
+
+def build_batch_in_slot(slot, filenames):
+    """ Build the batch for filenames straight into a shared memory slot.
+        Returns the worker's process id and its running image cache hits and
+        misses """
+    generator = _DATA_WORKER["generator"]
+    cache = _DATA_WORKER["cache"]
+    size = 64 * generator.zoom
+    out = _DATA_WORKER["buffer"].get(slot, (len(filenames), 2, size, size, 3),
+                                     dtype=numpy.float32)
+    generator.build_batch(filenames, cache if cache.budget else None, out=out)
+    return os.getpid(), cache.hits, cache.misses
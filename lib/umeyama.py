@@ -82,3 +82,67 @@ def umeyama(src, dst, estimate_scale):
     T[:dim, :dim] *= scale
 
     return T
+
+
+def umeyama_batch(src, dst, estimate_scale):
+    """Estimate the similarity transformation of each of a batch of point sets
+    together, giving the same result as umeyama on each set.
+    Parameters
+    ----------
+    src : (B, M, N) array
+        Source coordinates of each set.
+    dst : (M, N) or (B, M, N) array
+        Destination coordinates, shared by every set or one for each set.
+    estimate_scale : bool
+        Whether to estimate scaling factor.
+    Returns
+    -------
+    T : (B, N + 1, N + 1)
+        The homogeneous similarity transformation matrix of each set.
+    """
+
+    batch = src.shape[0]
+    num = src.shape[1]
+    dim = src.shape[2]
+
+    src_mean = src.mean(axis=-2)
+    dst_mean = np.broadcast_to(dst.mean(axis=-2), src_mean.shape)
+
+    src_demean = src - src_mean[:, None]
+    dst_demean = dst - dst_mean[:, None]
+
+    # Eq. (38).
+    A = np.matmul(np.swapaxes(dst_demean, 1, 2), src_demean) / num
+
+    # Eq. (39).
+    d = np.ones((batch, dim), dtype=np.double)
+    d[np.linalg.det(A) < 0, dim - 1] = -1
+
+    T = np.tile(np.eye(dim + 1, dtype=np.double), (batch, 1, 1))
+
+    U, S, V = np.linalg.svd(A)
+
+    # Eq. (40) and (43).
+    rank = np.linalg.matrix_rank(A)
+    full = rank == dim
+    T[full, :dim, :dim] = np.matmul(U[full], d[full, :, None] * np.swapaxes(V[full], 1, 2))
+    partial = rank == dim - 1
+    if partial.any():
+        flip = partial & (np.linalg.det(U) * np.linalg.det(V) <= 0)
+        T[partial & ~flip, :dim, :dim] = np.matmul(U[partial & ~flip], V[partial & ~flip])
+        d_flip = d[flip].copy()
+        d_flip[:, dim - 1] = -1
+        T[flip, :dim, :dim] = np.matmul(U[flip], d_flip[:, :, None] * V[flip])
+
+    if estimate_scale:
+        # Eq. (41) and (42).
+        scale = 1.0 / src_demean.var(axis=1).sum(axis=1) * (S * d).sum(axis=1)
+    else:
+        scale = np.ones((batch,), dtype=np.double)
+
+    T[:, :dim, dim] = dst_mean - scale[:, None] * np.matmul(T[:, :dim, :dim],
+                                                            src_mean[:, :, None])[:, :, 0]
+    T[:, :dim, :dim] *= scale[:, None, None]
+    T[rank == 0] = np.nan
+
+    return T
@@ -1,10 +1,12 @@
 #!/usr/bin python3
 """ Utilities available across all scripts """
 
+import json
 import logging
 import os
 import warnings
 
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha1
 from pathlib import Path
 from re import finditer
@@ -12,6 +14,7 @@ from time import time
 
 import cv2
 import numpy as np
+from tqdm import tqdm
 
 import dlib
 
@@ -27,6 +30,7 @@ _image_extensions = [  # pylint: disable=invalid-name
     ".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff"]
 _video_extensions = [  # pylint: disable=invalid-name
     ".avi", ".flv", ".mkv", ".mov", ".mp4", ".mpeg", ".webm"]
+_hash_cache_name = ".face_hashes.json"  # pylint: disable=invalid-name
 
 
 def get_folder(path):
@@ -69,6 +73,81 @@ def hash_image_file(filename):
     return img_hash
 
 
+def hash_image_files(filenames, thread_count=None, desc="Hashing Faces"):
+    """ Return a dict of filename to sha1 hash for the given image files.
+
+        Hashes are cached in a sidecar file in each image folder, keyed by
+        the file name, size and modification time, so unchanged files are
+        only read once across runs. Uncached files are hashed in a pool of
+        threads (image decoding and hashing release the GIL) and the cache
+        is updated """
+    folders = dict()
+    for filename in filenames:
+        folders.setdefault(os.path.dirname(filename), list()).append(filename)
+
+    hashes = dict()
+    to_hash = list()
+    caches = dict()
+    for folder, files in folders.items():
+        cache = load_hash_cache(folder)
+        caches[folder] = cache
+        for filename in files:
+            stat = os.stat(filename)
+            key = [stat.st_size, stat.st_mtime_ns]
+            cached = cache.get(os.path.basename(filename), None)
+            if cached is not None and cached[:2] == key:
+                hashes[filename] = cached[2]
+            else:
+                to_hash.append((filename, key))
+    logger.debug("Cached hashes: %s, files to hash: %s", len(hashes), len(to_hash))
+
+    if to_hash:
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            results = executor.map(hash_image_file, [item[0] for item in to_hash])
+            for (filename, key), img_hash in tqdm(zip(to_hash, results),
+                                                  desc=desc,
+                                                  total=len(to_hash)):
+                hashes[filename] = img_hash
+                cache = caches[os.path.dirname(filename)]
+                cache[os.path.basename(filename)] = key + [img_hash]
+        for folder, cache in caches.items():
+            save_hash_cache(folder, cache)
+    return hashes
+
+
+def load_hash_cache(folder):
+    """ Load the face hash cache for a folder """
+    cache_file = os.path.join(folder, _hash_cache_name)
+    if not os.path.exists(cache_file):
+        return dict()
+    try:
+        with open(cache_file, "r") as handle:
+            cache = json.load(handle)
+    except (IOError, ValueError) as err:
+        logger.warning("Ignoring unreadable hash cache '%s': %s", cache_file, err)
+        cache = dict()
+    logger.debug("Loaded hash cache '%s': %s items", cache_file, len(cache))
+    return cache
+
+
+def save_hash_cache(folder, cache):
+    """ Save the face hash cache for a folder, dropping files that no longer exist """
+    cache_file = os.path.join(folder, _hash_cache_name)
+    existing = set(os.listdir(folder))
+    cache = {key: val for key, val in cache.items() if key in existing}
+    tmp_file = cache_file + ".tmp"
+    try:
+        with open(tmp_file, "w") as handle:
+            json.dump(cache, handle, separators=(",", ":"))
+        os.replace(tmp_file, cache_file)
+    except IOError as err:
+        logger.warning("Unable to save hash cache '%s': %s", cache_file, err)
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return
+    logger.debug("Saved hash cache '%s': %s items", cache_file, len(cache))
+
+
 def hash_encode_image(image, extension):
     """ Encode the image, get the hash and return the hash with
         encoded image """
@@ -172,7 +251,7 @@ def rotate_landmarks(face, rotation_matrix):
         rotation_matrix)
     rotated = list()
     for item in (bounding_box, landmarks):
-        if not item:
+        if item is None or len(item) == 0:
             continue
         points = np.array(item, np.int32)
         points = np.expand_dims(points, axis=0)
@@ -192,9 +271,8 @@ def rotate_landmarks(face, rotation_matrix):
         face.y = int(pt_y)
         face.w = int(pt_x1 - pt_x)
         face.h = int(pt_y1 - pt_y)
-        face.r = 0
         if len(rotated) > 1:
-            rotated_landmarks = [tuple(point) for point in rotated[1].tolist()]
+            rotated_landmarks = rotated[1]
             face.landmarksXY = rotated_landmarks
     elif isinstance(face, dict):
         face["x"] = int(pt_x)
@@ -287,8 +365,10 @@ class Timelapse:
         generator = TrainingDataGenerator(random_transform_args, 160, zoom)
         batch = generator.minibatchAB(input_images, batch_size,
                                       doShuffle=False)
-
-        return next(batch)[2]
+        # Batches are views onto reused buffers, so keep a copy
+        images = next(batch)[2].copy()
+        batch.close()
+        return images
 
     def work(self):
         """ Write out timelapse image """
@@ -4,6 +4,8 @@
     Based on the original https://www.reddit.com/r/deepfakes/ code sample
     Adjust code made by https://github.com/yangchen8710 """
 
+from functools import lru_cache
+
 import cv2
 import numpy as np
 
@@ -22,6 +24,16 @@ class Convert():
 
     def patch_image(self, frame, detected_face, size):
         """ Patch swapped face onto original image """
+        feed, context = self.prepare_face(frame, detected_face, size)
+        prediction = self.predict(np.expand_dims(feed, 0))[0]
+        return self.patch_face(frame, prediction, context)
+
+    @staticmethod
+    def prepare_face(frame, detected_face, size):
+        """ Crop the aligned face and normalize it for the model.
+
+            Returns the model feed and the context that patch_face needs
+            to put the prediction back onto the frame """
         # pylint: disable=no-member
         # assert image.shape == (256, 256, 3)
         padding = 48
@@ -37,10 +49,30 @@ class Convert():
         process_face = cv2.resize(process_face,
                                   (size, size),
                                   interpolation=cv2.INTER_AREA)
-        process_face = np.expand_dims(process_face, 0)
 
-        new_face = self.encoder(process_face / 255.0)[0]
-        new_face = np.clip(new_face * 255, 0, 255).astype(src_face.dtype)
+        context = {"matrix": detected_face.adjusted_matrix,
+                   "frame_dims": detected_face.frame_dims,
+                   "src_face": src_face,
+                   "old_face": old_face,
+                   "crop": crop,
+                   "face_size": face_size,
+                   "padding": padding}
+        return process_face / 255.0, context
+
+    def predict(self, feed):
+        """ Return the model predictions for a batch of prepared faces """
+        return self.encoder(feed)
+
+    def patch_face(self, frame, prediction, context):
+        """ Patch the model's prediction for one face onto the frame """
+        # pylint: disable=no-member
+        src_face = context["src_face"]
+        old_face = context["old_face"]
+        frame_dims = context["frame_dims"]
+        face_size = context["face_size"]
+        padding = context["padding"]
+
+        new_face = np.clip(prediction * 255, 0, 255).astype(src_face.dtype)
         new_face = cv2.resize(
             new_face,
             (face_size - padding * 2, face_size - padding * 2),
@@ -51,7 +83,7 @@ class Convert():
         if self.use_smooth_mask:
             self.smooth_mask(old_face, new_face)
 
-        new_face = self.superpose(src_face, new_face, crop)
+        new_face = self.superpose(src_face, new_face, context["crop"])
         new_image = frame.copy()
 
         if self.draw_transparent:
@@ -60,8 +92,8 @@ class Convert():
 
         cv2.warpAffine(
             new_face,
-            detected_face.adjusted_matrix,
-            (detected_face.frame_dims[1], detected_face.frame_dims[0]),
+            context["matrix"],
+            (frame_dims[1], frame_dims[0]),
             new_image,
             flags=cv2.WARP_INVERSE_MAP | cv2.INTER_CUBIC,
             borderMode=cv2.BORDER_TRANSPARENT)
@@ -74,28 +106,14 @@ class Convert():
             old_avg = old_face[:, :, i].mean()
             new_avg = new_face[:, :, i].mean()
             diff_int = (int)(old_avg - new_avg)
-            for int_h in range(new_face.shape[0]):
-                for int_w in range(new_face.shape[1]):
-                    temp = (new_face[int_h, int_w, i] + diff_int)
-                    if temp < 0:
-                        new_face[int_h, int_w, i] = 0
-                    elif temp > 255:
-                        new_face[int_h, int_w, i] = 255
-                    else:
-                        new_face[int_h, int_w, i] = temp
+            channel = new_face[:, :, i].astype("int32") + diff_int
+            new_face[:, :, i] = np.clip(channel, 0, 255)
 
     @staticmethod
     def smooth_mask(old_face, new_face):
         """ Smooth the mask """
-        width, height, _ = new_face.shape
-        crop = slice(0, width)
-        mask = np.zeros_like(new_face)
-        mask[height // 15:-height // 15, width // 15:-width // 15, :] = 255
-        mask = cv2.GaussianBlur(mask,  # pylint: disable=no-member
-                                (15, 15),
-                                10)
-        new_face[crop, crop] = (mask / 255 * new_face +
-                                (1 - mask / 255) * old_face)
+        weight, inverse = get_smooth_mask_weights(new_face.shape)
+        new_face[...] = weight * new_face + inverse * old_face
 
     @staticmethod
     def superpose(src_face, new_face, crop):
@@ -112,3 +130,16 @@ class Convert():
         image = np.zeros((height, width, 4), dtype=np.uint8)
         new_face = add_alpha_channel(new_face, 100)
         return image, new_face
+
+
+@lru_cache(maxsize=4)
+def get_smooth_mask_weights(shape):
+    """ Return the blurred mask weights for the new face and the old face
+        for a face of the given shape """
+    # pylint: disable=no-member
+    width, height, _ = shape
+    mask = np.zeros(shape, dtype="uint8")
+    mask[height // 15:-height // 15, width // 15:-width // 15, :] = 255
+    mask = cv2.GaussianBlur(mask, (15, 15), 10)
+    weight = mask / 255
+    return weight, 1 - weight
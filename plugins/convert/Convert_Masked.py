@@ -7,7 +7,6 @@ import logging
 import cv2
 import numpy
 
-from lib.aligner import get_align_mat
 from lib.utils import add_alpha_channel
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
@@ -17,7 +16,7 @@ class Convert():
     def __init__(self, encoder, trainer,
                  blur_size=2, seamless_clone=False, mask_type="facehullandrect",
                  erosion_kernel_size=None, match_histogram=False, sharpen_image=None,
-                 draw_transparent=False, **kwargs):
+                 draw_transparent=False, seamless_downscale=0, **kwargs):
         self.encoder = encoder
         self.trainer = trainer
         self.erosion_kernel = None
@@ -33,18 +32,29 @@ class Convert():
                                                                  abs(erosion_kernel_size)))
         self.blur_size = blur_size
         self.seamless_clone = seamless_clone
+        self.seamless_downscale = seamless_downscale
         self.sharpen_image = sharpen_image
         self.match_histogram = match_histogram
         self.mask_type = mask_type.lower()  # Choose in 'FaceHullAndRect', 'FaceHull', 'Rect'
         self.draw_transparent = draw_transparent
 
     def patch_image(self, image, face_detected, size):
-
+        """ Swap a single face onto the image """
+        feed, context = self.prepare_face(image, face_detected, size)
+        prediction = self.predict(numpy.expand_dims(feed, 0))[0]
+        return self.patch_face(image, prediction, context)
+
+    def prepare_face(self, image, face_detected, size):
+        """ Warp the face out of the image and normalize it for the model.
+
+            Returns the model feed for this face and the context required
+            to patch the prediction back with patch_face. Split from
+            patch_image so that feeds from many faces can be predicted in
+            one batch """
         image_size = image.shape[1], image.shape[0]
 
-        mat = numpy.array(get_align_mat(face_detected,
-                                        size,
-                                        should_align_eyes=False)).reshape(2, 3)
+        mat = numpy.array(face_detected.get_align_mat(size,
+                                                      align_eyes=False)).reshape(2, 3)
 
         if "GAN" not in self.trainer:
             mat = mat * size
@@ -53,15 +63,98 @@ class Convert():
             mat = mat * (size - 2 * padding)
             mat[:, 2] += padding
 
-        new_face = self.get_new_face(image, mat, size)
+        face = cv2.warpAffine(image, mat, (size, size))
+        if "GAN" not in self.trainer:
+            normalized_face = face / 255.0
+        else:
+            normalized_face = face / 255.0 * 2 - 1
 
-        image_mask = self.get_image_mask(image,
+        context = {"image_size": image_size,
+                   "mat": mat,
+                   "size": size,
+                   "face": face,
+                   "normalized_face": normalized_face,
+                   "landmarks": face_detected.landmarks_as_xy}
+        return normalized_face, context
+
+    def predict(self, feed):
+        """ Return the model predictions for a batch of prepared faces """
+        prediction = self.encoder(feed)
+        if "GAN" in self.trainer and "128" in self.trainer:
+            # TODO: Another hack to switch between 64 and 128
+            prediction = prediction[0]
+        return prediction
+
+    def patch_face(self, image, prediction, context):
+        """ Patch the model's prediction for one face onto the image.
+
+            Masking, warping and blending are restricted to the region of the
+            frame that the face can affect. The image is updated in place
+            and returned """
+        new_face = self.get_new_face(prediction, context, image.dtype)
+
+        roi = self.get_roi(context)
+        if roi is None:
+            return image
+        left, top, right, bottom = roi
+        mat = self.get_roi_matrix(context["mat"], left, top)
+        roi_size = (right - left, bottom - top)
+        landmarks = context["landmarks"] - (left, top)
+
+        image_mask = self.get_image_mask(image[top:bottom, left:right],
                                          new_face,
-                                         face_detected.landmarks_as_xy,
+                                         landmarks,
                                          mat,
-                                         image_size)
+                                         roi_size)
+
+        return self.apply_new_face(image,
+                                   new_face,
+                                   image_mask,
+                                   mat,
+                                   context["image_size"],
+                                   roi)
+
+    def get_roi(self, context):
+        """ Return the (left, top, right, bottom) region of the frame that
+            the swapped face can change, or None if it is outside the frame.
+
+            This is the bounding box of the face crop warped back onto the
+            frame (and of the face hull), grown by the reach of the cubic
+            interpolation, erosion/dilation, blur and sharpening """
+        size = context["size"]
+        width, height = context["image_size"]
+        inverse = cv2.invertAffineTransform(context["mat"])
+        corners = numpy.array([[0, 0, 1], [size, 0, 1], [0, size, 1], [size, size, 1]],
+                              dtype="float64")
+        points = corners.dot(inverse.T)
+        if 'hull' in self.mask_type:
+            points = numpy.concatenate((points, context["landmarks"]))
 
-        return self.apply_new_face(image, new_face, image_mask, mat, image_size, size)
+        # Cubic interpolation reaches 2 face pixels beyond the crop
+        scale = numpy.abs(inverse[:, :2]).sum(axis=1).max()
+        margin = int(numpy.ceil(2 * scale)) + 1
+        margin += self.blur_size + abs(self.erosion_kernel_size or 0)
+        if self.sharpen_image == "bsharpen":
+            margin += 1
+        elif self.sharpen_image == "gsharpen":
+            margin += 12
+
+        left, top = numpy.floor(points.min(axis=0)).astype(int) - margin
+        right, bottom = numpy.ceil(points.max(axis=0)).astype(int) + margin + 1
+        # Align the columns to multiples of 8, so that OpenCV warps the row
+        # ends the same way as it does for the full frame
+        left, top = max(left - left % 8, 0), max(top, 0)
+        right, bottom = min(right + (-right) % 8, width), min(bottom, height)
+        if left >= right or top >= bottom:
+            return None
+        return left, top, right, bottom
+
+    @staticmethod
+    def get_roi_matrix(mat, left, top):
+        """ Adjust the frame to face matrix to map from the region of interest """
+        mat = mat.copy()
+        mat[:, 2] += mat[:, 0] * left + mat[:, 1] * top
+        return mat
 
     @staticmethod
     def convert_transparent(image, new_face, image_mask, image_size):
@@ -73,20 +166,21 @@ class Convert():
         new_face = add_alpha_channel(new_face, 100)
         return image, new_face, image_mask
 
-    def apply_new_face(self, image, new_face, image_mask, mat, image_size, size):
-
+    def apply_new_face(self, image, new_face, image_mask, mat, image_size, roi):
+        """ Blend the new face into the region of interest of the image """
         if self.draw_transparent:
             image, new_face, image_mask = self.convert_transparent(image,
                                                                    new_face,
                                                                    image_mask,
                                                                    image_size)
             self.seamless_clone = False  # Alpha channel not supported in seamless
-        base_image = numpy.copy(image)
-        new_image = numpy.copy(image)
+        left, top, right, bottom = roi
+        base_image = image[top:bottom, left:right]
+        new_image = base_image.copy()
 
         cv2.warpAffine(new_face,
                        mat,
-                       image_size,
+                       (right - left, bottom - top),
                        new_image,
                        cv2.WARP_INVERSE_MAP | cv2.INTER_CUBIC,
                        cv2.BORDER_TRANSPARENT)
@@ -105,9 +199,6 @@ class Convert():
         outimage = None
         if self.seamless_clone:
             unitMask = numpy.clip(image_mask * 365, 0, 255).astype(numpy.uint8)
-            logger.info(unitMask.shape)
-            logger.info(new_image.shape)
-            logger.info(base_image.shape)
             maxregion = numpy.argwhere(unitMask == 255)
 
             if maxregion.size > 0:
@@ -117,76 +208,120 @@ class Convert():
                 leny = maxy - miny
                 masky = int(minx + (lenx // 2))
                 maskx = int(miny + (leny // 2))
-                outimage = cv2.seamlessClone(new_image.astype(numpy.uint8),
-                                             base_image.astype(numpy.uint8),
-                                             unitMask,
-                                             (masky, maskx),
+                new_image = new_image.astype(numpy.uint8)
+                if self.clone_fits_roi(unitMask, (masky, maskx)):
+                    outimage = self.seamless_clone_roi(new_image,
+                                                       base_image,
+                                                       unitMask,
+                                                       (masky, maskx))
+                    image[top:bottom, left:right] = outimage
+                    return image
+                # The cloned region overhangs the ROI, so clone on the full frame
+                full_image = image.copy()
+                full_image[top:bottom, left:right] = new_image
+                full_mask = numpy.zeros(image.shape, dtype=numpy.uint8)
+                full_mask[top:bottom, left:right] = unitMask
+                outimage = cv2.seamlessClone(full_image,
+                                             image,
+                                             full_mask,
+                                             (masky + left, maskx + top),
                                              cv2.NORMAL_CLONE)
                 return outimage
 
-        foreground = cv2.multiply(image_mask, new_image.astype(float))
-        background = cv2.multiply(1.0 - image_mask, base_image.astype(float))
+        foreground = cv2.multiply(image_mask, new_image.astype("float32"))
+        background = cv2.multiply(1.0 - image_mask, base_image.astype("float32"))
         outimage = cv2.add(foreground, background)
+        image[top:bottom, left:right] = numpy.clip(numpy.rint(outimage), 0, 255)
 
-        return outimage
-
-    def hist_match(self, source, template, mask=None):
-        # Code borrowed from:
-        # https://stackoverflow.com/questions/32655686/histogram-matching-of-two-images-in-python-2-x
-        masked_source = source
-        masked_template = template
-
-        if mask is not None:
-            masked_source = source * mask
-            masked_template = template * mask
-
-        oldshape = source.shape
-        source = source.ravel()
-        template = template.ravel()
-        masked_source = masked_source.ravel()
-        masked_template = masked_template.ravel()
-        s_values, bin_idx, s_counts = numpy.unique(source, return_inverse=True,
-                                                   return_counts=True)
-        t_values, t_counts = numpy.unique(template, return_counts=True)
-        ms_values, mbin_idx, ms_counts = numpy.unique(source, return_inverse=True,
-                                                      return_counts=True)
-        mt_values, mt_counts = numpy.unique(template, return_counts=True)
+        return image
+
+    @staticmethod
+    def clone_fits_roi(mask, center):
+        """ Return whether the region that cv2.seamlessClone takes from the
+            destination for this mask and center lies within the mask's image.
+
+            OpenCV ignores the outer pixel border of the mask and places the
+            mask's bounding box centered on the given point """
+        inner = numpy.zeros(mask.shape[:2], dtype=numpy.uint8)
+        inner[1:-1, 1:-1] = mask[1:-1, 1:-1, 0]
+        _, _, width, height = cv2.boundingRect(inner)
+        left = center[0] - width // 2
+        top = center[1] - height // 2
+        return (left >= 0 and top >= 0 and
+                left + width <= mask.shape[1] and top + height <= mask.shape[0])
+
+    def seamless_clone_roi(self, new_image, base_image, mask, center):
+        """ Seamless clone the new face onto the base image.
+
+            If the region is larger than seamless_downscale, the Poisson
+            correction is solved at a reduced size, upscaled and applied to
+            the full size face """
+        height, width = base_image.shape[:2]
+        if not self.seamless_downscale or max(height, width) <= self.seamless_downscale:
+            return cv2.seamlessClone(new_image, base_image, mask, center, cv2.NORMAL_CLONE)
+
+        scale = self.seamless_downscale / max(height, width)
+        size = (max(int(round(width * scale)), 3), max(int(round(height * scale)), 3))
+        small_new = cv2.resize(new_image, size, interpolation=cv2.INTER_AREA)
+        small_base = cv2.resize(base_image, size, interpolation=cv2.INTER_AREA)
+        small_mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+        small_mask[[0, -1], :] = 0
+        small_mask[:, [0, -1]] = 0
+        x_pos, y_pos, box_w, box_h = cv2.boundingRect(small_mask[:, :, 0])
+        if box_w == 0 or box_h == 0:
+            return base_image
+        # Center on the bounding box so the clone is not shifted against small_new
+        small_center = (x_pos + box_w // 2, y_pos + box_h // 2)
+        cloned = cv2.seamlessClone(small_new, small_base, small_mask, small_center,
+                                   cv2.NORMAL_CLONE)
+        correction = cloned.astype("float32") - small_new.astype("float32")
+        correction = cv2.resize(correction, (width, height), interpolation=cv2.INTER_LINEAR)
+        result = numpy.clip(new_image.astype("float32") + correction, 0, 255)
+        return numpy.where(mask > 0, numpy.rint(result), base_image).astype(numpy.uint8)
+
+    @staticmethod
+    def hist_match(source, template, mask=None):
+        """ Return a 256 entry lookup table that matches the histogram of the
+            uint8 source channel to that of the template channel.
+
+            Based on:
+            https://stackoverflow.com/questions/32655686/histogram-matching-of-two-images-in-python-2-x
+            but counting the 256 possible values rather than sorting pixels.
+            The mask is accepted for compatibility but, as before, the
+            histograms are taken over all pixels """
+        # pylint: disable=unused-argument
+        s_counts = numpy.bincount(source.ravel(), minlength=256)
+        t_counts = numpy.bincount(template.ravel(), minlength=256)
+        t_values = numpy.flatnonzero(t_counts)
 
         s_quantiles = numpy.cumsum(s_counts).astype(numpy.float64)
         s_quantiles /= s_quantiles[-1]
-        t_quantiles = numpy.cumsum(t_counts).astype(numpy.float64)
+        t_quantiles = numpy.cumsum(t_counts[t_values]).astype(numpy.float64)
         t_quantiles /= t_quantiles[-1]
         interp_t_values = numpy.interp(s_quantiles, t_quantiles, t_values)
 
-        return interp_t_values[bin_idx].reshape(oldshape)
+        return interp_t_values.astype(numpy.uint8)
 
     def color_hist_match(self, src_im, tar_im, mask):
-        matched_R = self.hist_match(src_im[:, :, 0], tar_im[:, :, 0], mask)
-        matched_G = self.hist_match(src_im[:, :, 1], tar_im[:, :, 1], mask)
-        matched_B = self.hist_match(src_im[:, :, 2], tar_im[:, :, 2], mask)
-        matched = numpy.stack((matched_R, matched_G, matched_B), axis=2).astype(src_im.dtype)
+        """ Match the histogram of each channel of src_im to tar_im """
+        lut = numpy.stack([self.hist_match(src_im[:, :, idx], tar_im[:, :, idx], mask)
+                           for idx in range(3)], axis=1)
+        matched = cv2.LUT(src_im, lut.reshape(1, 256, 3))
         return matched
 
-    def get_new_face(self, image, mat, size):
-        face = cv2.warpAffine(image, mat, (size, size))
-        face = numpy.expand_dims(face, 0)
-        face_clipped = numpy.clip(face[0], 0, 255).astype(image.dtype)
+    def get_new_face(self, prediction, context, dtype):
+        """ Convert the model's prediction for one face to an image """
+        face_clipped = numpy.clip(context["face"], 0, 255).astype(dtype)
         new_face = None
         mask = None
 
         if "GAN" not in self.trainer:
-            normalized_face = face / 255.0
-            new_face = self.encoder(normalized_face)[0]
-            new_face = numpy.clip(new_face * 255, 0, 255).astype(image.dtype)
+            new_face = numpy.clip(prediction * 255, 0, 255).astype(dtype)
         else:
-            normalized_face = face / 255.0 * 2 - 1
-            fake_output = self.encoder(normalized_face)
-            if "128" in self.trainer:  # TODO: Another hack to switch between 64 and 128
-                fake_output = fake_output[0]
-            mask = fake_output[:, :, :, :1]
-            new_face = fake_output[:, :, :, 1:]
-            new_face = mask * new_face + (1 - mask) * normalized_face
-            new_face = numpy.clip((new_face[0] + 1) * 255 / 2, 0, 255).astype(image.dtype)
+            mask = prediction[:, :, :1]
+            new_face = prediction[:, :, 1:]
+            new_face = mask * new_face + (1 - mask) * context["normalized_face"]
+            new_face = numpy.clip((new_face + 1) * 255 / 2, 0, 255).astype(dtype)
 
         if self.match_histogram:
             new_face = self.color_hist_match(new_face, face_clipped, mask)
@@ -195,16 +330,16 @@ class Convert():
 
     def get_image_mask(self, image, new_face, landmarks, mat, image_size):
 
-        face_mask = numpy.zeros(image.shape, dtype=float)
+        face_mask = numpy.zeros(image.shape, dtype="float32")
         if 'rect' in self.mask_type:
-            face_src = numpy.ones(new_face.shape, dtype=float)
+            face_src = numpy.ones(new_face.shape, dtype="float32")
             cv2.warpAffine(face_src,
                            mat,
                            image_size,
                            face_mask,
                            cv2.WARP_INVERSE_MAP | cv2.INTER_CUBIC, cv2.BORDER_TRANSPARENT)
 
-        hull_mask = numpy.zeros(image.shape, dtype=float)
+        hull_mask = numpy.zeros(image.shape, dtype="float32")
         if 'hull' in self.mask_type:
             hull = cv2.convexHull(
                 numpy.array(landmarks).reshape((-1, 2)).astype(int)).flatten().reshape((-1, 2))
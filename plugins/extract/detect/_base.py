@@ -19,6 +19,7 @@ from io import StringIO
 import cv2
 import dlib
 from math import sqrt
+from queue import Empty as QueueEmpty
 
 from lib.gpu_stats import GPUStats
 from lib.utils import rotate_landmarks
@@ -57,6 +58,11 @@ class Detector():
         # will support. It is also used for holding the number of threads/
         # processes for parallel processing plugins
         self.batch_size = 1
+
+        # Whether get_batch returns a partial batch when the in queue is
+        # empty rather than waiting to fill it. Set by callers that limit
+        # the number of frames they put to the queue
+        self.partial_batches = False
         logger.debug("Initialized _base %s", self.__class__.__name__)
 
     # <<< OVERRIDE METHODS >>> #
@@ -77,6 +83,7 @@ class Detector():
         logger.debug("initialize %s (PID: %s, args: %s, kwargs: %s)",
                      self.__class__.__name__, os.getpid(), args, kwargs)
         self.init = kwargs.get("event", False)
+        self.partial_batches = kwargs.get("partial_batches", False)
         self.queues["in"] = kwargs["in_queue"]
         self.queues["out"] = kwargs["out_queue"]
 
@@ -243,9 +250,13 @@ class Detector():
                 rotation_matrix)
 
     # << QUEUE METHODS >> #
-    def get_item(self):
-        """ Yield one item from the queue """
-        item = self.queues["in"].get()
+    def get_item(self, block=True):
+        """ Yield one item from the queue. If block is False, return None
+            when the queue is empty """
+        try:
+            item = self.queues["in"].get(block)
+        except QueueEmpty:
+            return None
         if isinstance(item, dict):
             logger.trace("Item in: %s", item["filename"])
         else:
@@ -264,12 +275,19 @@ class Detector():
             queue is exhausted.
             Second item is the batch
 
+            If partial_batches is set, only the first item waits on the
+            queue, so a partial batch is returned rather than stalling
+            callers (such as convert) which limit the number of frames they
+            put to the queue.
+
             Remember to put "EOF" to the out queue after processing
             the final batch """
         exhausted = False
         batch = list()
-        for _ in range(self.batch_size):
-            item = self.get_item()
+        for idx in range(self.batch_size):
+            item = self.get_item(block=idx == 0 or not self.partial_batches)
+            if item is None:
+                break
             if item == "EOF":
                 exhausted = True
                 break
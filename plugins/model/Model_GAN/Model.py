@@ -12,7 +12,7 @@ from keras.optimizers import Adam
 
 from lib.PixelShuffler import PixelShuffler
 from .instance_normalization import InstanceNormalization
-from lib.utils import backup_file
+from lib.checkpoint import Checkpoint
 
 from keras.utils import multi_gpu_model
 
@@ -50,6 +50,7 @@ class GANModel():
     def __init__(self, model_dir, gpus):
         self.model_dir = model_dir
         self.gpus = gpus
+        self.checkpoint = Checkpoint(model_dir)
 
         optimizer = Adam(1e-4, 0.5)
 
@@ -173,15 +174,11 @@ class GANModel():
         return True
 
     def save_weights(self):
-        model_dir = str(self.model_dir)
-        for model in hdf.values():
-            backup_file(model_dir, model)
         if self.gpus > 1:
-            self.netGA_sm.save_weights(str(self.model_dir / hdf['netGAH5']))
-            self.netGB_sm.save_weights(str(self.model_dir / hdf['netGBH5']))
+            netGA, netGB = self.netGA_sm, self.netGB_sm
         else:
-            self.netGA.save_weights(str(self.model_dir / hdf['netGAH5']))
-            self.netGB.save_weights(str(self.model_dir / hdf['netGBH5']))
-        self.netDA.save_weights(str(self.model_dir / hdf['netDAH5']))
-        self.netDB.save_weights(str(self.model_dir / hdf['netDBH5']))
-        logger.info("Models saved.")
+            netGA, netGB = self.netGA, self.netGB
+        self.checkpoint.save({hdf['netGAH5']: netGA,
+                              hdf['netGBH5']: netGB,
+                              hdf['netDAH5']: self.netDA,
+                              hdf['netDBH5']: self.netDB})
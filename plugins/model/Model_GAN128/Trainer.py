@@ -8,14 +8,17 @@ import tensorflow as tf
 from keras.optimizers import Adam
 from keras import backend as K
 
+from lib.step_timer import StepTimer
 from lib.training_data import TrainingDataGenerator, stack_images
 
 class GANTrainingDataGenerator(TrainingDataGenerator):
-    def __init__(self, random_transform_args, coverage, scale, zoom):
-        super().__init__(random_transform_args, coverage, scale, zoom)
+    def __init__(self, random_transform_args, coverage, scale, zoom, training_opts=None):
+        super().__init__(random_transform_args, coverage, scale, zoom, training_opts)
 
-    def color_adjust(self, img):
-        return img / 255.0 * 2 - 1
+    def color_adjust(self, img, out=None):
+        out = np.multiply(img, 2 / 255.0, out=out)
+        out -= 1
+        return out
 
 class Trainer():
     random_transform_args = {
@@ -25,7 +28,7 @@ class Trainer():
         'random_flip': 0.5,
         }
 
-    def __init__(self, model, fn_A, fn_B, batch_size, perceptual_loss):
+    def __init__(self, model, fn_A, fn_B, batch_size, perceptual_loss, training_opts=None):
         K.set_learning_phase(1)
 
         assert batch_size % 2 == 0, "batch_size must be an even number"
@@ -41,9 +44,11 @@ class Trainer():
         self.lrD = 1e-4 # Discriminator learning rate
         self.lrG = 1e-4 # Generator learning rate
 
-        generator = GANTrainingDataGenerator(self.random_transform_args, 220, 6, 2)
+        generator = GANTrainingDataGenerator(self.random_transform_args, 220, 6, 2, training_opts)
         self.train_batchA = generator.minibatchAB(fn_A, batch_size)
         self.train_batchB = generator.minibatchAB(fn_B, batch_size)
+        self.generator = generator
+        self.timer = StepTimer(batch_size)
 
         self.avg_counter = self.errDA_sum = self.errDB_sum = self.errGA_sum = self.errGB_sum = 0
 
@@ -122,16 +127,18 @@ class Trainer():
         # ---------------------
 
         # Select a random half batch of images
-        epoch, warped_A, target_A = next(self.train_batchA)
-        epoch, warped_B, target_B = next(self.train_batchB)
+        with self.timer.phase("data"):
+            epoch, warped_A, target_A = next(self.train_batchA)
+            epoch, warped_B, target_B = next(self.train_batchB)
 
-        # Train dicriminators for one batch
-        errDA  = self.netDA_train([warped_A, target_A])
-        errDB  = self.netDB_train([warped_B, target_B])
+        with self.timer.phase("compute"):
+            # Train dicriminators for one batch
+            errDA  = self.netDA_train([warped_A, target_A])
+            errDB  = self.netDB_train([warped_B, target_B])
 
-        # Train generators for one batch
-        errGA = self.netGA_train([warped_A, target_A])
-        errGB = self.netGB_train([warped_B, target_B])
+            # Train generators for one batch
+            errGA = self.netGA_train([warped_A, target_A])
+            errGB = self.netGB_train([warped_B, target_B])
 
         # For calculating average losses
         self.errDA_sum += errDA[0]
@@ -141,7 +148,8 @@ class Trainer():
         self.avg_counter += 1
 
         print('[%s] [%d/%s][%d] Loss_DA: %f Loss_DB: %f Loss_GA: %f Loss_GB: %f'
-              % (time.strftime("%H:%M:%S"), epoch, "num_epochs", iter, self.errDA_sum/self.avg_counter, self.errDB_sum/self.avg_counter, self.errGA_sum/self.avg_counter, self.errGB_sum/self.avg_counter),
+              % (time.strftime("%H:%M:%S"), epoch, "num_epochs", iter, self.errDA_sum/self.avg_counter, self.errDB_sum/self.avg_counter, self.errGA_sum/self.avg_counter, self.errGB_sum/self.avg_counter)
+              + self.generator.cache_status() + self.timer.status(),
               end='\r')
 
         if viewer is not None:
@@ -219,9 +227,9 @@ class Trainer():
     def show_sample(self, display_fn):
         _, wA, tA = next(self.train_batchA)
         _, wB, tB = next(self.train_batchB)
-        display_fn(self.showG(tA, tB, self.path_A, self.path_B), "masked")
-        display_fn(self.showG(tA, tB, self.path_bgr_A, self.path_bgr_B), "raw")
-        display_fn(self.showG_mask(tA, tB, self.path_mask_A, self.path_mask_B), "mask")
+        display_fn(self.showG, (tA, tB, self.path_A, self.path_B), "masked")
+        display_fn(self.showG, (tA, tB, self.path_bgr_A, self.path_bgr_B), "raw")
+        display_fn(self.showG_mask, (tA, tB, self.path_mask_A, self.path_mask_B), "mask")
         # Reset the averages
         self.errDA_sum = self.errDB_sum = self.errGA_sum = self.errGB_sum = 0
         self.avg_counter = 0
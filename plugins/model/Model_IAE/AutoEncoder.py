@@ -2,7 +2,7 @@
 
 import logging
 
-from lib.utils import backup_file
+from lib.checkpoint import Checkpoint
 
 hdf = {'encoderH5': 'IAE_encoder.h5',
        'decoderH5': 'IAE_decoder.h5',
@@ -17,6 +17,7 @@ class AutoEncoder:
     def __init__(self, model_dir, gpus):
         self.model_dir = model_dir
         self.gpus = gpus
+        self.checkpoint = Checkpoint(model_dir)
 
         self.encoder = self.Encoder()
         self.decoder = self.Decoder()
@@ -42,12 +43,8 @@ class AutoEncoder:
             return False
 
     def save_weights(self):
-        model_dir = str(self.model_dir)
-        for model in hdf.values():
-            backup_file(model_dir, model)
-        self.encoder.save_weights(str(self.model_dir / hdf['encoderH5']))
-        self.decoder.save_weights(str(self.model_dir / hdf['decoderH5']))
-        self.inter_both.save_weights(str(self.model_dir / hdf['inter_bothH5']))
-        self.inter_A.save_weights(str(self.model_dir / hdf['inter_AH5']))
-        self.inter_B.save_weights(str(self.model_dir / hdf['inter_BH5']))
-        logger.info('saved model weights')
+        self.checkpoint.save({hdf['encoderH5']: self.encoder,
+                              hdf['decoderH5']: self.decoder,
+                              hdf['inter_bothH5']: self.inter_both,
+                              hdf['inter_AH5']: self.inter_A,
+                              hdf['inter_BH5']: self.inter_B})
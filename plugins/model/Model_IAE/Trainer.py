@@ -1,6 +1,7 @@
 
 import time
 import numpy
+from lib.step_timer import StepTimer
 from lib.training_data import TrainingDataGenerator, stack_images
 
 
@@ -12,25 +13,29 @@ class Trainer():
         'random_flip': 0.4,
     }
 
-    def __init__(self, model, fn_A, fn_B, batch_size, *args):
+    def __init__(self, model, fn_A, fn_B, batch_size, *args, training_opts=None):
         self.batch_size = batch_size
         self.model = model
 
-        generator = TrainingDataGenerator(self.random_transform_args, 160)
+        generator = TrainingDataGenerator(self.random_transform_args, 160, training_opts=training_opts)
         self.images_A = generator.minibatchAB(fn_A, self.batch_size)
         self.images_B = generator.minibatchAB(fn_B, self.batch_size)
+        self.generator = generator
+        self.timer = StepTimer(self.batch_size)
 
     def train_one_step(self, iter, viewer):
-        epoch, warped_A, target_A = next(self.images_A)
-        epoch, warped_B, target_B = next(self.images_B)
-
-        loss_A = self.model.autoencoder_A.train_on_batch(warped_A, target_A)
-        loss_B = self.model.autoencoder_B.train_on_batch(warped_B, target_B)
-        print("[{0}] [#{1:05d}] loss_A: {2:.5f}, loss_B: {3:.5f}".format(time.strftime("%H:%M:%S"), iter, loss_A, loss_B),
+        with self.timer.phase("data"):
+            epoch, warped_A, target_A = next(self.images_A)
+            epoch, warped_B, target_B = next(self.images_B)
+
+        with self.timer.phase("compute"):
+            loss_A = self.model.autoencoder_A.train_on_batch(warped_A, target_A)
+            loss_B = self.model.autoencoder_B.train_on_batch(warped_B, target_B)
+        print("[{0}] [#{1:05d}] loss_A: {2:.5f}, loss_B: {3:.5f}".format(time.strftime("%H:%M:%S"), iter, loss_A, loss_B) + self.generator.cache_status() + self.timer.status(),
             end='\r')
 
         if viewer is not None:
-            viewer(self.show_sample(target_A[0:14], target_B[0:14]), "training")
+            viewer(self.show_sample, (target_A[0:14], target_B[0:14]), "training")
 
     def show_sample(self, test_A, test_B):
         figure_A = numpy.stack([
@@ -1,7 +1,7 @@
 # AutoEncoder base classes
 import logging
 
-from lib.utils import backup_file
+from lib.checkpoint import Checkpoint
 
 hdf = {'encoderH5': 'lowmem_encoder.h5',
        'decoder_AH5': 'lowmem_decoder_A.h5',
@@ -20,6 +20,7 @@ class AutoEncoder:
     def __init__(self, model_dir, gpus):
         self.model_dir = model_dir
         self.gpus = gpus
+        self.checkpoint = Checkpoint(model_dir)
 
         self.encoder = self.Encoder()
         self.decoder_A = self.Decoder()
@@ -52,10 +53,6 @@ class AutoEncoder:
             return False
 
     def save_weights(self):
-        model_dir = str(self.model_dir)
-        for model in hdf.values():
-            backup_file(model_dir, model)
-        self.encoder.save_weights(str(self.model_dir / hdf['encoderH5']))
-        self.decoder_A.save_weights(str(self.model_dir / hdf['decoder_AH5']))
-        self.decoder_B.save_weights(str(self.model_dir / hdf['decoder_BH5']))
-        logger.info('saved model weights')
+        self.checkpoint.save({hdf['encoderH5']: self.encoder,
+                              hdf['decoder_AH5']: self.decoder_A,
+                              hdf['decoder_BH5']: self.decoder_B})
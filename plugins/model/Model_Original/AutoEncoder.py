@@ -1,7 +1,7 @@
 # AutoEncoder base classes
 import logging
 
-from lib.utils import backup_file
+from lib.checkpoint import Checkpoint
 from lib import Serializer
 from json import JSONDecodeError
 
@@ -16,6 +16,7 @@ class AutoEncoder:
     def __init__(self, model_dir, gpus):
         self.model_dir = model_dir
         self.gpus = gpus
+        self.checkpoint = Checkpoint(model_dir)
 
         self.encoder = self.Encoder()
         self.decoder_A = self.Decoder()
@@ -50,26 +51,15 @@ class AutoEncoder:
             return False
 
     def save_weights(self):
-        model_dir = str(self.model_dir)
-        for model in hdf.values():
-            backup_file(model_dir, model)
-        self.encoder.save_weights(str(self.model_dir / hdf['encoderH5']))
-        self.decoder_A.save_weights(str(self.model_dir / hdf['decoder_AH5']))
-        self.decoder_B.save_weights(str(self.model_dir / hdf['decoder_BH5']))
-
-        logger.info('saved model weights')
-
         serializer = Serializer.get_serializer('json')
         state_fn = ".".join([hdf['state'], serializer.ext])
-        state_dir = str(self.model_dir / state_fn)
-        try:
-            with open(state_dir, 'wb') as fp:
-                state_json = serializer.marshal({
-                    'epoch_no' : self.epoch_no
-                     })
-                fp.write(state_json.encode('utf-8'))
-        except IOError as e:
-            logger.error(e.strerror)
+        state_json = serializer.marshal({
+            'epoch_no' : self.epoch_no
+             })
+        self.checkpoint.save({hdf['encoderH5']: self.encoder,
+                              hdf['decoder_AH5']: self.decoder_A,
+                              hdf['decoder_BH5']: self.decoder_B,
+                              state_fn: state_json.encode('utf-8')})
 
     @property
     def epoch_no(self):
@@ -25,7 +25,7 @@ from keras.utils import multi_gpu_model
 
 from lib.PixelShuffler import PixelShuffler
 import lib.Serializer
-from lib.utils import backup_file
+from lib.checkpoint import Checkpoint
 
 from . import __version__
 from .instance_normalization import InstanceNormalization
@@ -81,6 +81,7 @@ class Model():
         self._encoder_type = encoder_type
 
         self.model_dir = model_dir
+        self.checkpoint = Checkpoint(model_dir)
 
         # can't chnage gpu's when the model is initialized no point in making it r/w
         self._gpus = gpus
@@ -259,36 +260,14 @@ class Model():
 
 
     def save_weights(self):
-        model_dir = str(self.model_dir)
-
-        try:
-            for model in hdf.values():
-                backup_file(model_dir, model)
-        except NameError:
-            logger.error('backup functionality not available\n')
-
-        state_dir = os.path.join(model_dir, 'state_{version_str}_{ENCODER.value}.json'.format(**globals()))
+        state_fn = 'state_{version_str}_{ENCODER.value}.json'.format(**globals())
         ser = lib.Serializer.get_serializer('json')
-        try:
-            with open(state_dir, 'wb') as fp:
-                state_json = ser.marshal({
-                    'epoch_no' : self._epoch_no
-                     })
-                fp.write(state_json.encode('utf-8'))
-        except IOError as e:
-            logger.error(e.strerror)
-
-        logger.info('saving model weights')
-
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [executor.submit(getattr(self, mdl_name.rstrip('H5')).save_weights, str(self.model_dir / mdl_H5_fn)) for mdl_name, mdl_H5_fn in hdf.items()]
-            for future in as_completed(futures):
-                future.result()
-                print('.', end='', flush=True)
-
-        logger.info('done')
+        state_json = ser.marshal({
+            'epoch_no' : self._epoch_no
+             })
+        files = {mdl_H5_fn: getattr(self, mdl_name.rstrip('H5')) for mdl_name, mdl_H5_fn in hdf.items()}
+        files[state_fn] = state_json.encode('utf-8')
+        self.checkpoint.save(files)
 
 
     @property
@@ -1,6 +1,7 @@
 import time
 import numpy
 
+from lib.step_timer import StepTimer
 from lib.training_data import TrainingDataGenerator, stack_images
 
 
@@ -16,41 +17,45 @@ class Trainer():
         'random_flip': 0.4 * (TRANSFORM_PRC * .01),
     }
     
-    def __init__(self, model, fn_A, fn_B, batch_size, *args):
+    def __init__(self, model, fn_A, fn_B, batch_size, *args, training_opts=None):
         self.batch_size = batch_size
         self.model = model
         from timeit import default_timer as clock
         self._clock = clock
         
-        generator = TrainingDataGenerator(self.random_transform_args, 160, 5, zoom=self.model.IMAGE_SHAPE[0]//64)        
+        generator = TrainingDataGenerator(self.random_transform_args, 160, 5, zoom=self.model.IMAGE_SHAPE[0]//64,
+                                          training_opts=training_opts)        
         
         self.images_A = generator.minibatchAB(fn_A, self.batch_size)
         self.images_B = generator.minibatchAB(fn_B, self.batch_size)
                 
         self.generator = generator        
+        self.timer = StepTimer(self.batch_size)
         
 
     def train_one_step(self, iter_no, viewer):
         when = self._clock()
-        _, warped_A, target_A = next(self.images_A)
-        _, warped_B, target_B = next(self.images_B)
+        with self.timer.phase("data"):
+            _, warped_A, target_A = next(self.images_A)
+            _, warped_B, target_B = next(self.images_B)
 
-        loss_A = self.model.autoencoder_A.train_on_batch(warped_A, target_A)
-        loss_B = self.model.autoencoder_B.train_on_batch(warped_B, target_B)
+        with self.timer.phase("compute"):
+            loss_A = self.model.autoencoder_A.train_on_batch(warped_A, target_A)
+            loss_B = self.model.autoencoder_B.train_on_batch(warped_B, target_B)
         
         self.model._epoch_no += 1        
                  
         if isinstance(loss_A, (list, tuple)):
             print("[{0}] [#{1:05d}] [{2:.3f}s] loss_A: {3:.5f}, loss_B: {4:.5f}".format(
-                time.strftime("%H:%M:%S"), self.model._epoch_no, self._clock()-when, loss_A[1], loss_B[1]),
+                time.strftime("%H:%M:%S"), self.model._epoch_no, self._clock()-when, loss_A[1], loss_B[1]) + self.generator.cache_status() + self.timer.status(),
                 end='\r')
         else:
             print("[{0}] [#{1:05d}] [{2:.3f}s] loss_A: {3:.5f}, loss_B: {4:.5f}".format(
-                time.strftime("%H:%M:%S"), self.model._epoch_no, self._clock()-when, loss_A, loss_B),
+                time.strftime("%H:%M:%S"), self.model._epoch_no, self._clock()-when, loss_A, loss_B) + self.generator.cache_status() + self.timer.status(),
                 end='\r')         
 
         if viewer is not None:
-            viewer(self.show_sample(target_A[0:8], target_B[0:8]), "training using {}, bs={}".format(self.model, self.batch_size))
+            viewer(self.show_sample, (target_A[0:8], target_B[0:8]), "training using {}, bs={}".format(self.model, self.batch_size))
             
 
     def show_sample(self, test_A, test_B):
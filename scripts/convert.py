@@ -2,21 +2,30 @@
 """ The script to run the convert process of faceswap """
 
 import logging
+import multiprocessing as mp
+import queue as Queue
 import re
 import os
+import shutil
+import subprocess
 import sys
+import threading
 from pathlib import Path
 
 import cv2
+import numpy as np
 from tqdm import tqdm
 
 from scripts.fsmedia import Alignments, Images, PostProcess, Utils
 from lib.faces_detect import DetectedFace
-from lib.multithreading import BackgroundGenerator, SpawnProcess
+from lib.logger import LOG_QUEUE, set_root_logger
+from lib.multithreading import BackgroundGenerator, MultiThread, SharedFrameBuffer
+from lib.prediction_cache import PredictionCache, get_checkpoint_id
 from lib.queue_manager import queue_manager
-from lib.utils import get_folder, get_image_paths, hash_image_file
+from lib.utils import get_folder, get_image_paths, hash_image_file, hash_image_files
 
 from plugins.plugin_loader import PluginLoader
+from scripts.extract import Plugins
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -28,7 +37,9 @@ class Convert():
         self.args = arguments
         self.output_dir = get_folder(self.args.output_dir)
         self.extract_faces = False
+        self.extractor = None
         self.faces_count = 0
+        self.prediction_cache = None
 
         self.images = Images(self.args)
         self.alignments = Alignments(self.args, False, self.images.is_video)
@@ -52,13 +63,40 @@ class Convert():
         if not self.alignments.have_alignments_file:
             self.load_extractor()
 
-        model = self.load_model()
-        converter = self.load_converter(model)
+        self.prediction_cache = self.load_prediction_cache()
+        converter = self.load_converter()
+        writer = self.get_writer()
+        blender = Blender(converter,
+                          self.args.converter,
+                          self.converter_kwargs(),
+                          self.args.jobs,
+                          self.args.batch_size * 2,
+                          self.args.loglevel,
+                          abort=writer.failed)
 
         batch = BackgroundGenerator(self.prepare_images(), 1)
 
-        for item in batch.iterator():
-            self.convert(converter, item)
+        try:
+            items = list()
+            for item in batch.iterator():
+                items.append(item)
+                if len(items) == self.args.batch_size:
+                    self.convert(converter, blender, writer, items)
+                    items = list()
+            if items:
+                self.convert(converter, blender, writer, items)
+            writer.join()
+        except Exception:
+            if writer.failed.is_set():
+                # Raise the error that stopped the writer
+                writer.join()
+            raise
+        finally:
+            blender.close()
+            if self.prediction_cache is not None:
+                logger.info("Prediction cache: %s faces reused, %s faces predicted",
+                            self.prediction_cache.hits, self.prediction_cache.misses)
+                self.prediction_cache.close()
 
         if self.extract_faces:
             queue_manager.terminate_queues()
@@ -67,37 +105,48 @@ class Convert():
                        self.faces_count,
                        self.verify_output)
 
+    def get_writer(self):
+        """ Return the video writer if a video output was requested,
+            otherwise the image writer """
+        if not self.args.video_output:
+            return Writer()
+        if self.args.draw_transparent:
+            raise ValueError("Transparent frames can not be written to video")
+        fps = self.args.video_fps
+        if fps is None and self.images.is_video:
+            cap = cv2.VideoCapture(self.args.input_dir)  # pylint: disable=no-member
+            fps = cap.get(cv2.CAP_PROP_FPS)  # pylint: disable=no-member
+            cap.release()
+        if not fps:
+            fps = 25
+            logger.warning("Could not get the frame rate of the input. Using %s fps", fps)
+        audio_source = None
+        if self.args.copy_audio:
+            if self.images.is_video:
+                audio_source = self.args.input_dir
+            else:
+                logger.warning("Audio can only be copied from a video input. "
+                               "Not copying audio")
+        return VideoWriter(self.args.video_output,
+                           self.args.video_codec,
+                           self.args.video_crf,
+                           fps,
+                           audio_source)
+
     def load_extractor(self):
         """ Set on the fly extraction """
         logger.warning("No Alignments file found. Extracting on the fly.")
-        logger.warning("NB: This will use the inferior dlib-hog for extraction "
-                       "and dlib pose predictor for landmarks. It is recommended "
-                       "to perfom Extract first for superior results")
-        for task in ("load", "detect", "align"):
-            queue_manager.add_queue(task, maxsize=0)
-
-        detector = PluginLoader.get_detector("dlib_hog")(loglevel=self.args.loglevel)
-        aligner = PluginLoader.get_aligner("dlib")(loglevel=self.args.loglevel)
-
-        d_kwargs = {"in_queue": queue_manager.get_queue("load"),
-                    "out_queue": queue_manager.get_queue("detect")}
-        a_kwargs = {"in_queue": queue_manager.get_queue("detect"),
-                    "out_queue": queue_manager.get_queue("align")}
-
-        d_process = SpawnProcess(detector.run, **d_kwargs)
-        d_event = d_process.event
-        d_process.start()
-
-        a_process = SpawnProcess(aligner.run, **a_kwargs)
-        a_event = a_process.event
-        a_process.start()
-
-        d_event.wait(10)
-        if not d_event.is_set():
-            raise ValueError("Error inititalizing Detector")
-        a_event.wait(10)
-        if not a_event.is_set():
-            raise ValueError("Error inititalizing Aligner")
+        logger.warning("NB: This will use the '%s' detector and '%s' aligner. It is "
+                       "recommended to perfom Extract first for superior results",
+                       self.args.detector, self.args.aligner)
+        self.extractor = Plugins(self.args)
+        if not self.extractor.is_parallel:
+            logger.error("Extracting on the fly needs the detector and aligner to run "
+                         "together, but there is not enough free VRAM. Run Extract first, "
+                         "or select a detector and aligner that run on the CPU")
+            exit(1)
+        self.extractor.launch_aligner()
+        self.extractor.launch_detector(partial_batches=True)
 
         self.extract_faces = True
 
@@ -116,43 +165,50 @@ class Convert():
 
         return model
 
-    def load_converter(self, model):
-        """ Load the requested converter for conversion """
+    def load_converter(self):
+        """ Load the requested converter for conversion. When predictions are
+            cached the model is only loaded once a face is not in the cache """
         args = self.args
         conv = args.converter
 
+        encoder = None if self.prediction_cache else self.load_model().converter(False)
         converter = PluginLoader.get_converter(conv)(
-            model.converter(False),
-            trainer=args.trainer,
-            blur_size=args.blur_size,
-            seamless_clone=args.seamless_clone,
-            sharpen_image=args.sharpen_image,
-            mask_type=args.mask_type,
-            erosion_kernel_size=args.erosion_kernel_size,
-            match_histogram=args.match_histogram,
-            smooth_mask=args.smooth_mask,
-            avg_color_adjust=args.avg_color_adjust,
-            draw_transparent=args.draw_transparent)
+            encoder,
+            **self.converter_kwargs())
 
         return converter
 
-    def prepare_images(self):
-        """ Prepare the images for conversion """
-        filename = ""
-        for filename, image in tqdm(self.images.load(),
-                                    total=self.images.images_found,
-                                    file=sys.stdout):
-
-            if (self.args.discard_frames and
-                    self.opts.check_skipframe(filename) == "discard"):
-                continue
+    def load_prediction_cache(self):
+        """ Open the prediction cache for the model's current weights if a
+            cache folder was requested """
+        if not self.args.prediction_cache:
+            return None
+        checkpoint_id = get_checkpoint_id(get_folder(self.args.model_dir),
+                                          self.args.trainer,
+                                          self.args.swap_model)
+        return PredictionCache(self.args.prediction_cache, checkpoint_id)
 
-            frame = os.path.basename(filename)
-            if self.extract_faces:
-                detected_faces = self.detect_faces(filename, image)
-            else:
-                detected_faces = self.alignments_faces(frame, image)
+    def converter_kwargs(self):
+        """ Return the keyword arguments for the converter plugin """
+        args = self.args
+        return dict(trainer=args.trainer,
+                    blur_size=args.blur_size,
+                    seamless_clone=args.seamless_clone,
+                    seamless_downscale=args.seamless_downscale,
+                    sharpen_image=args.sharpen_image,
+                    mask_type=args.mask_type,
+                    erosion_kernel_size=args.erosion_kernel_size,
+                    match_histogram=args.match_histogram,
+                    smooth_mask=args.smooth_mask,
+                    avg_color_adjust=args.avg_color_adjust,
+                    draw_transparent=args.draw_transparent)
 
+    def prepare_images(self):
+        """ Prepare the images for conversion """
+        loader = self.extract_frames() if self.extract_faces else self.load_frames()
+        for filename, image, detected_faces in tqdm(loader,
+                                                    total=self.images.images_found,
+                                                    file=sys.stdout):
             faces_count = len(detected_faces)
             if faces_count != 0:
                 # Post processing requires a dict with "detected_faces" key
@@ -163,24 +219,133 @@ class Convert():
             if faces_count > 1:
                 self.verify_output = True
                 logger.verbose("Found more than one face in "
-                               "an image! '%s'", frame)
+                               "an image! '%s'", os.path.basename(filename))
 
             yield filename, image, detected_faces
 
+    def is_discarded(self, filename):
+        """ Return whether the frame is outside of the frame ranges and is
+            to be discarded """
+        return (self.args.discard_frames and
+                self.opts.check_skipframe(filename) == "discard")
+
+    def load_frames(self):
+        """ Load the frames and get their faces from the alignments file """
+        for filename, image in self.images.load(skip_decode=self.is_unchanged):
+            if self.is_discarded(filename):
+                continue
+
+            if image is None:
+                # Frame is copied to the output unchanged
+                yield filename, image, list()
+                continue
+
+            frame = os.path.basename(filename)
+            yield filename, image, self.alignments_faces(frame, image)
+
+    def extract_frames(self):
+        """ Detect and align the faces in the frames on the fly.
+
+            Frames are fed to the detector from a background thread with up
+            to frames_in_flight frames in the detect/align pipeline at any
+            time. Results are joined back into input order. Frames outside of
+            the frame ranges bypass the pipeline """
+        load_queue = queue_manager.get_queue("load")
+        order = Queue.Queue()
+        in_flight = threading.BoundedSemaphore(self.args.frames_in_flight)
+        feeder = MultiThread(self.feed_extractor, load_queue, order, in_flight)
+        feeder.start()
+
+        extracted = self.extractor.detect_faces(extract_pass="align")
+        pending = dict()
+        while True:
+            item = order.get()
+            if item is None:
+                break
+            filename, image = item
+            if image is not None:
+                in_flight.release()
+                yield filename, image, list()
+                continue
+            while filename not in pending:
+                faces = next(extracted, None)
+                if faces is None:
+                    raise ValueError("Extraction finished without returning the faces for "
+                                     "'{}'".format(filename))
+                pending[faces["filename"]] = faces
+            faces = pending.pop(filename)
+            in_flight.release()
+            yield filename, faces["image"], self.get_detected_faces(faces)
+        # Re-raise any error from the feeder
+        feeder.join()
+
+    def feed_extractor(self, load_queue, order, in_flight):
+        """ Put frames to the detector, recording their order.
+
+            The end of the order queue is always marked, so that
+            extract_frames does not wait on frames that will never arrive if
+            loading fails """
+        logger.debug("Feed Extractor: Start")
+        try:
+            for filename, image in self.images.load():
+                if load_queue.shutdown.is_set():
+                    logger.debug("Load Queue: Stop signal received. Terminating")
+                    break
+                if self.is_discarded(filename):
+                    continue
+                if image is None or not image.any():
+                    logger.warning("Unable to open image. Skipping: '%s'", filename)
+                    continue
+                in_flight.acquire()
+                if self.opts.check_skipframe(filename):
+                    order.put((filename, image))
+                    continue
+                order.put((filename, None))
+                load_queue.put({"filename": filename, "image": image})
+        finally:
+            load_queue.put("EOF")
+            order.put(None)
+        logger.debug("Feed Extractor: Complete")
+
     @staticmethod
-    def detect_faces(filename, image):
-        """ Extract the face from a frame (If not alignments file found) """
-        queue_manager.get_queue("load").put((filename, image))
-        item = queue_manager.get_queue("align").get()
-        detected_faces = item["detected_faces"]
+    def get_detected_faces(faces):
+        """ Return DetectedFace objects for the aligner's output """
+        image = faces["image"]
+        detected_faces = list()
+        for idx, rect in enumerate(faces["detected_faces"]):
+            face = DetectedFace()
+            face.from_dlib_rect(rect, image)
+            face.landmarksXY = faces["landmarks"][idx]
+            face.frame_dims = image.shape[:2]
+            detected_faces.append(face)
         return detected_faces
 
+    def is_unchanged(self, filename):
+        """ Return True if the frame will be output exactly as it was input,
+            so it can be copied without being decoded and re-encoded.
+
+            This is the case when the frame is outside of the frame ranges,
+            or when it has no faces in the alignments file. Frames are never
+            copied when extracting on the fly, when writing to video, or when
+            the output would overwrite the input """
+        if self.extract_faces or self.args.video_output:
+            return False
+        output = self.output_dir / Path(filename).name
+        if output.exists() and os.path.samefile(filename, str(output)):
+            return False
+        if self.opts.check_skipframe(filename):
+            return True
+        frame = os.path.basename(filename)
+        if not self.check_alignments(frame):
+            return True
+        return not self.opts.get_faces_in_frame(frame)
+
     def alignments_faces(self, frame, image):
         """ Get the face from alignments file """
         if not self.check_alignments(frame):
             return list()
 
-        faces = self.alignments.get_faces_in_frame(frame)
+        faces = self.opts.get_faces_in_frame(frame)
         detected_faces = list()
 
         for rawface in faces:
@@ -197,32 +362,376 @@ class Convert():
                        "skipping".format(frame))
         return have_alignments
 
-    def convert(self, converter, item):
-        """ Apply the conversion transferring faces onto frames """
+    def convert(self, converter, blender, writer, items):
+        """ Apply the conversion transferring faces onto frames
+
+            Faces from all of the frames in items are fed through the model
+            together and blended back by the blender. Multiple faces in a
+            frame are swapped in successive passes so that each face is
+            warped from the frame with the previous faces already patched,
+            as when swapping one at a time. Frames are handed to the writer
+            in input order """
+        filename = ""
         try:
-            filename, image, faces = item
-            skip = self.opts.check_skipframe(filename)
-
-            if not skip:
-                for face in faces:
-                    image = self.convert_one_face(converter, image, face)
-                filename = str(self.output_dir / Path(filename).name)
-                cv2.imwrite(filename, image)  # pylint: disable=no-member
+            frames = list()
+            for filename, image, faces in items:
+                if self.opts.check_skipframe(filename):
+                    faces = list()
+                frames.append([filename, image, faces])
+
+            size = self.get_model_size()
+            max_faces = max([len(faces) for _, _, faces in frames] or [0])
+            for idx in range(max_faces):
+                in_pass = [frame for frame in frames if len(frame[2]) > idx]
+                contexts = list()
+                feeds = list()
+                for filename, image, faces in in_pass:
+                    feed, context = converter.prepare_face(image, faces[idx], size)
+                    feeds.append(feed)
+                    contexts.append(context)
+                predictions = self.predict_faces(converter, feeds)
+                for frame, prediction, context in zip(in_pass, predictions, contexts):
+                    filename = frame[0]
+                    final = len(frame[2]) == idx + 1
+                    frame[1] = blender.patch(frame[1], prediction, context, final)
+                for frame in in_pass:
+                    if len(frame[2]) != idx + 1:
+                        filename = frame[0]
+                        frame[1] = frame[1].get()
+
+            for filename, image, faces in frames:
+                output = str(self.output_dir / Path(filename).name)
+                if image is None:
+                    writer.copy(filename, output)
+                    continue
+                if not faces:
+                    image = BlendResult(image)
+                writer.put(output, image)
         except Exception as err:
             logger.error("Failed to convert image: '%s'. Reason: %s", filename, err)
             raise
 
-    def convert_one_face(self, converter, image, face):
-        """ Perform the conversion on the given frame for a single face """
+    def predict_faces(self, converter, feeds):
+        """ Return the predictions for the prepared faces in feed order.
+            Faces in the prediction cache are not fed to the model """
+        cache = self.prediction_cache
+        if cache is None:
+            return self.run_model(converter, feeds)
+        keys = [cache.key(feed) for feed in feeds]
+        predictions = [cache.get(key) for key in keys]
+        missing = [idx for idx, prediction in enumerate(predictions) if prediction is None]
+        if not missing:
+            return predictions
+        if converter.encoder is None:
+            converter.encoder = self.load_model().converter(False)
+        for idx, prediction in zip(missing,
+                                   self.run_model(converter, [feeds[idx] for idx in missing])):
+            cache.put(keys[idx], prediction)
+            predictions[idx] = prediction
+        return predictions
+
+    def run_model(self, converter, feeds):
+        """ Run the prepared faces through the model in batches of at most
+            batch_size faces and return the predictions in feed order """
+        predictions = list()
+        batch_size = self.args.batch_size
+        for start in range(0, len(feeds), batch_size):
+            batch = np.stack(feeds[start:start + batch_size])
+            predictions.extend(converter.predict(batch))
+        logger.trace("Predicted %s faces", len(predictions))
+        return predictions
+
+    def get_model_size(self):
+        """ Return the input size of the model """
         # TODO: This switch between 64 and 128 is a hack for now.
         # We should have a separate cli option for size
         size = 128 if (self.args.trainer.strip().lower()
                        in ('gan128', 'originalhighres')) else 64
+        return size
+
+
+class BlendResult():
+    """ A frame that is, or will be, patched with a swapped face.
+
+        Wraps either a finished image or the async result of a blend worker
+        holding the image in a shared memory slot. Call release once the
+        image returned by get is no longer required """
+    def __init__(self, image, async_result=None, buffer=None, slot=None):
+        self._image = image
+        self._async_result = async_result
+        self._buffer = buffer
+        self._slot = slot
+
+    def get(self):
+        """ Return the patched image, waiting for the blend worker if required """
+        if self._async_result is not None:
+            result = self._async_result.get()
+            self._async_result = None
+            if result is None:
+                result = self._buffer.get(self._slot, self._image)
+            self._image = result
+            self.release()
+        return self._image
+
+    def release(self):
+        """ Return the shared memory slot, if one was used, to the buffer once
+            the image is no longer being accessed """
+        if self._slot is not None and self._async_result is None and self._image is None:
+            self._buffer.release(self._slot)
+            self._slot = None
+
+    def done(self):
+        """ Drop the reference to the image and free its slot. A blend that
+            is still running is waited on first, as the worker may still be
+            writing to the slot """
+        if self._async_result is not None:
+            self._async_result.wait()
+            self._async_result = None
+        self._image = None
+        self.release()
+
+
+class Blender():
+    """ Blend swapped faces back onto their frames.
+
+        Blending (masks, warping, blur, sharpening, seamless clone and
+        histogram matching) runs in a pool of worker processes, with frames
+        passed through shared memory slots. With 1 job the converter is
+        run in the calling process.
+
+        abort: An event which, once set, stops waiting for a free slot. Slots
+               are returned by the writer, so pass the writer's failed event """
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 converter, converter_name, converter_kwargs, jobs, slots, loglevel, abort=None):
+        logger.debug("Initializing %s: (converter: %s, jobs: %s, slots: %s)",
+                     self.__class__.__name__, converter_name, jobs, slots)
+        self.converter = converter
+        self.converter_name = converter_name
+        self.converter_kwargs = converter_kwargs
+        self.jobs = jobs if jobs > 0 else max(mp.cpu_count() - 1, 1)
+        self.slots = slots
+        self.loglevel = loglevel
+        self.abort = abort
+        self.pool = None
+        self.buffer = None
+        logger.verbose("Blending faces in %s processes", self.jobs)
+        logger.debug("Initialized %s", self.__class__.__name__)
+
+    def start(self, image):
+        """ Start the worker pool, sizing the shared memory slots from the
+            first frame """
+        logger.debug("Starting blend pool: (jobs: %s, frame shape: %s)",
+                     self.jobs, image.shape)
+        self.buffer = SharedFrameBuffer(self.slots, image.nbytes)
+        ctx = mp.get_context("spawn")
+        self.pool = ctx.Pool(processes=self.jobs,
+                             initializer=init_blend_worker,
+                             initargs=(self.converter_name,
+                                       self.converter_kwargs,
+                                       self.buffer,
+                                       self.loglevel,
+                                       LOG_QUEUE))
+
+    def patch(self, image, prediction, context, final):
+        """ Patch a predicted face onto an image and return a BlendResult.
+
+            Final patches travel through shared memory and come back as
+            uint8. Intermediate patches of multi-face frames are passed by
+            value so that later faces see exactly the same frame as when
+            blending serially """
+        if self.jobs == 1:
+            return BlendResult(self.converter.patch_face(image, prediction, context))
+        if self.pool is None:
+            self.start(image)
+        slot = None
+        if final and self.buffer.fits(image):
+            slot = self.buffer.acquire(abort=self.abort)
+            self.buffer.put(slot, image)
+            image = image.shape
+        async_result = self.pool.apply_async(blend_face,
+                                             (slot, image, prediction, context))
+        return BlendResult(image, async_result, self.buffer, slot)
+
+    def close(self):
+        """ Shut down the worker pool """
+        if self.pool is None:
+            return
+        logger.debug("Closing blend pool")
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+
+
+_BLEND_WORKER = dict()  # pylint: disable=invalid-name
+
+
+def init_blend_worker(converter_name, converter_kwargs, buffer, loglevel, log_queue):
+    """ Set up a blend worker process with its own converter and the shared
+        frame buffer. The converter does not need the model to blend """
+    set_root_logger(loglevel, log_queue)
+    _BLEND_WORKER["converter"] = PluginLoader.get_converter(converter_name)(None,
+                                                                            **converter_kwargs)
+    _BLEND_WORKER["buffer"] = buffer
+
+
+def blend_face(slot, image, prediction, context):
+    """ Blend a face in a worker process.
+
+        If slot is given, image is the frame's shape and the frame is read
+        from, and the result written back to, the shared buffer as uint8
+        (rounded and saturated in the same way as cv2.imwrite). Otherwise
+        image is the frame and the result is returned by value """
+    converter = _BLEND_WORKER["converter"]
+    if slot is None:
+        return converter.patch_face(image, prediction, context)
+    frame = _BLEND_WORKER["buffer"].get(slot, image)
+    result = converter.patch_face(frame, prediction, context)
+    if result.shape != frame.shape:
+        return result
+    if result.dtype != np.uint8:
+        result = np.clip(np.rint(result), 0, 255)
+    frame[...] = result
+    return None
+
+
+class Writer():
+    """ Write converted frames from a pool of threads so that saving does
+        not hold up conversion.
+
+        Frames are queued in input order. The queue is bounded so that
+        conversion blocks if saving falls behind. Unchanged frames are
+        copied from their source file rather than encoded """
+    def __init__(self, thread_count=2, maxsize=32):
+        logger.debug("Initializing %s: (thread_count: %s, maxsize: %s)",
+                     self.__class__.__name__, thread_count, maxsize)
+        self.queue = Queue.Queue(maxsize=maxsize)
+        self.failed = threading.Event()
+        self.threads = MultiThread(self.write, thread_count=thread_count)
+        self.threads.start()
+        logger.debug("Initialized %s", self.__class__.__name__)
+
+    def put(self, filename, result):
+        """ Queue a BlendResult to be saved to filename """
+        if self.failed.is_set():
+            self.join()
+        self.queue.put((filename, result))
+
+    def copy(self, source, filename):
+        """ Queue a source file to be copied unchanged to filename """
+        if self.failed.is_set():
+            self.join()
+        self.queue.put((filename, source))
+
+    def write(self):
+        """ Save frames from the queue until the sentinel is received """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.put(None)
+                break
+            filename, result = item
+            try:
+                self.save(filename, result)
+            except Exception as err:
+                logger.error("Failed to convert image: '%s'. Reason: %s", filename, err)
+                self.failed.set()
+                self.drain()
+                raise
+            finally:
+                if not isinstance(result, str):
+                    result.done()
 
-        image = converter.patch_image(image,
-                                      face,
-                                      size)
-        return image
+    @staticmethod
+    def save(filename, result):
+        """ Save a BlendResult as an image, or copy a source file, to filename """
+        if isinstance(result, str):
+            shutil.copyfile(result, filename)
+        else:
+            cv2.imwrite(filename, result.get())  # pylint: disable=no-member
+
+    def drain(self):
+        """ Empty the queue so that the converter does not block on a failed
+            writer """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.put(None)
+                break
+            if not isinstance(item[1], str):
+                item[1].done()
+
+    def join(self):
+        """ Flush the queue and wait for the write threads """
+        self.queue.put(None)
+        self.threads.join()
+
+
+class VideoWriter(Writer):
+    """ Stream converted frames as raw BGR into an ffmpeg subprocess to
+        encode a video directly, rather than saving an image per frame.
+
+        Frames are written from a single thread so they stay in order. The
+        ffmpeg process is started on the first frame, once the frame size
+        is known """
+    def __init__(self, filename, codec, crf, fps, audio_source=None):
+        logger.debug("Initializing %s: (filename: '%s', codec: %s, crf: %s, fps: %s, "
+                     "audio_source: '%s')", self.__class__.__name__, filename, codec, crf,
+                     fps, audio_source)
+        if shutil.which("ffmpeg") is None:
+            raise ValueError("ffmpeg could not be found. It is required for video output")
+        self.filename = filename
+        self.codec = codec
+        self.crf = crf
+        self.fps = fps
+        self.audio_source = audio_source
+        self.process = None
+        self.shape = None
+        super().__init__(thread_count=1)
+
+    def start(self, image):
+        """ Launch ffmpeg reading raw frames of the given image's size from stdin """
+        self.shape = image.shape
+        height, width = image.shape[:2]
+        cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+               "-f", "rawvideo", "-pix_fmt", "bgr24",
+               "-s", "{}x{}".format(width, height),
+               "-r", str(self.fps),
+               "-i", "-"]
+        if self.audio_source is not None:
+            cmd.extend(["-i", self.audio_source,
+                        "-map", "0:v:0", "-map", "1:a?", "-c:a", "copy", "-shortest"])
+        cmd.extend(["-c:v", self.codec,
+                    "-crf", str(self.crf),
+                    "-pix_fmt", "yuv420p",
+                    self.filename])
+        logger.debug("Starting ffmpeg: %s", cmd)
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def save(self, filename, result):
+        """ Send a frame to ffmpeg """
+        if isinstance(result, str):
+            raise ValueError("Source frames can not be copied to a video")
+        image = result.get()
+        if self.process is None:
+            self.start(image)
+        if image.shape != self.shape:
+            raise ValueError("Frame size {} does not match the video size "
+                             "{}".format(image.shape, self.shape))
+        if image.dtype != np.uint8:
+            image = np.clip(np.rint(image), 0, 255).astype(np.uint8)
+        self.process.stdin.write(np.ascontiguousarray(image).tobytes())
+
+    def join(self):
+        """ Flush the queue and wait for ffmpeg to finish encoding """
+        try:
+            super().join()
+        finally:
+            if self.process is not None:
+                self.process.stdin.close()
+                retcode = self.process.wait()
+                if retcode != 0:
+                    raise ValueError("ffmpeg exited with error code {}".format(retcode))
+                logger.info("Video written to: '%s'", self.filename)
 
 
 class OptionalActions():
@@ -235,21 +744,35 @@ class OptionalActions():
         self.alignments = alignments
         self.frame_ranges = self.get_frame_ranges()
         self.imageidxre = re.compile(r"[^(mp4)](\d+)(?!.*\d)")
+        self.face_hashes = None
 
         self.remove_skipped_faces()
         logger.debug("Initialized %s", self.__class__.__name__)
 
     # SKIP FACES #
     def remove_skipped_faces(self):
-        """ Remove deleted faces from the loaded alignments """
+        """ Set the faces to skip for faces deleted from the aligned directory.
+
+            The alignments are not changed. Faces are filtered as they are
+            read, so sharded alignments are not all held in memory """
         logger.debug("Filtering Faces")
         face_hashes = self.get_face_hashes()
         if not face_hashes:
             logger.debug("No face hashes. Not skipping any faces")
             return
-        pre_face_count = self.alignments.faces_count
-        self.alignments.filter_hashes(face_hashes, filter_out=False)
-        logger.info("Faces filtered out: %s", pre_face_count - self.alignments.faces_count)
+        self.face_hashes = set(face_hashes)
+        filtered = sum(1 for faces in self.alignments.data.values()
+                       for face in faces
+                       if face.get("hash", None) not in self.face_hashes)
+        logger.info("Faces filtered out: %s", filtered)
+
+    def get_faces_in_frame(self, frame):
+        """ Return the alignments for the selected frame, without any faces
+            deleted from the aligned directory """
+        faces = self.alignments.get_faces_in_frame(frame)
+        if self.face_hashes is None:
+            return faces
+        return [face for face in faces if face.get("hash", None) in self.face_hashes]
 
     def get_face_hashes(self):
         """ Check for the existence of an aligned directory for identifying
@@ -267,8 +790,7 @@ class OptionalActions():
         else:
             file_list = [path for path in get_image_paths(input_aligned_dir)]
             logger.info("Getting Face Hashes for selected Aligned Images")
-            for face in tqdm(file_list, desc="Hashing Faces"):
-                face_hashes.append(hash_image_file(face))
+            face_hashes = list(hash_image_files(file_list).values())
             logger.debug("Face Hashes: %s", (len(face_hashes)))
             if not face_hashes:
                 logger.error("Aligned directory is empty, no faces will be converted!")
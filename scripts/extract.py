@@ -349,12 +349,15 @@ class Plugins():
 
         logger.debug("Launched Aligner")
 
-    def launch_detector(self):
-        """ Launch the face detector """
-        logger.debug("Launching Detector")
+    def launch_detector(self, partial_batches=False):
+        """ Launch the face detector. Set partial_batches if the caller limits
+            the number of frames it puts to the load queue, so that batching
+            detectors do not wait for a full batch """
+        logger.debug("Launching Detector: (partial_batches: %s)", partial_batches)
         out_queue = queue_manager.get_queue("detect")
         kwargs = {"in_queue": queue_manager.get_queue("load"),
-                  "out_queue": out_queue}
+                  "out_queue": out_queue,
+                  "partial_batches": partial_batches}
 
         if self.args.detector == "mtcnn":
             mtcnn_kwargs = self.detector.validate_kwargs(
@@ -386,11 +389,12 @@ class Plugins():
 
     def get_mtcnn_kwargs(self):
         """ Add the mtcnn arguments into a kwargs dictionary """
+        # Convert's on the fly extraction does not expose the mtcnn options
         mtcnn_threshold = [float(thr.strip())
-                           for thr in self.args.mtcnn_threshold]
-        return {"minsize": self.args.mtcnn_minsize,
+                           for thr in getattr(self.args, "mtcnn_threshold", ["0.6", "0.7", "0.7"])]
+        return {"minsize": getattr(self.args, "mtcnn_minsize", 20),
                 "threshold": mtcnn_threshold,
-                "factor": self.args.mtcnn_scalefactor}
+                "factor": getattr(self.args, "mtcnn_scalefactor", 0.709)}
 
     def detect_faces(self, extract_pass="detect"):
         """ Detect faces from in an image """
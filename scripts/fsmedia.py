@@ -56,9 +56,12 @@ class Alignments(AlignmentsBase):
         self.is_extract = is_extract
         folder, filename = self.set_folder_filename(input_is_video)
         serializer = self.set_serializer()
+        compact = bool(hasattr(self.args, "compact_alignments")
+                       and self.args.compact_alignments)
         super().__init__(folder,
                          filename=filename,
-                         serializer=serializer)
+                         serializer=serializer,
+                         compact=compact)
         logger.debug("Initialized %s", self.__class__.__name__)
 
     def set_folder_filename(self, input_is_video):
@@ -110,12 +113,7 @@ class Alignments(AlignmentsBase):
             logger.warning("Skip Existing/Skip Faces selected, but no alignments file found!")
             return data
 
-        try:
-            with open(self.file, self.serializer.roptions) as align:
-                data = self.serializer.unmarshal(align.read())
-        except IOError as err:
-            logger.error("Error: '%s' not read: %s", self.file, err.strerror)
-            exit(1)
+        data = self.read_file()
 
         if skip_faces:
             # Remove items from algnments that have no faces so they will
@@ -172,16 +170,27 @@ class Images():
 
         return input_images
 
-    def load(self):
-        """ Load an image and yield it with it's filename """
-        iterator = self.load_video_frames if self.is_video else self.load_disk_frames
-        for filename, image in iterator():
+    def load(self, skip_decode=None):
+        """ Load an image and yield it with it's filename
+
+            skip_decode is an optional function taking a filename. For
+            separate frames, if it returns True the image is not read from
+            disk and None is yielded in its place """
+        if self.is_video:
+            iterator = self.load_video_frames()
+        else:
+            iterator = self.load_disk_frames(skip_decode)
+        for filename, image in iterator:
             yield filename, image
 
-    def load_disk_frames(self):
+    def load_disk_frames(self, skip_decode=None):
         """ Load frames from disk """
         logger.debug("Input is Seperate Frames. Loading images")
         for filename in self.input_images:
+            if skip_decode is not None and skip_decode(filename):
+                logger.trace("Not decoding image: '%s'", filename)
+                yield filename, None
+                continue
             logger.trace("Loading image: '%s'", filename)
             try:
                 image = cv2.imread(filename)  # pylint: disable=no-member
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+""" Swap the faces in single frames with a model loaded once.
+
+    Swapper can be used from python. The swap command streams raw frames
+    through stdin and stdout """
+
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from lib.faces_detect import DetectedFace
+from lib.queue_manager import queue_manager
+from lib.utils import get_folder
+from plugins.plugin_loader import PluginLoader
+from scripts.extract import Plugins
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class Swapper():
+    """ Swap the faces in single frames.
+
+        The model, converter, detector and aligner are loaded once when the
+        Swapper is created and re-used for every call to swap. The latency of
+        the last call is held in last_timings and the running totals in
+        total_timings, both in milliseconds.
+
+        arguments: The swap command's arguments. See lib.cli.SwapArgs
+    """
+    phases = ("detect", "predict", "patch", "total")
+
+    def __init__(self, arguments):
+        logger.debug("Initializing %s: (args: %s)", self.__class__.__name__, arguments)
+        self.args = arguments
+        self.size = self.get_model_size()
+        self.converter = self.load_converter()
+        self.extractor = self.load_extractor()
+        self.detected = self.extractor.detect_faces(extract_pass="align")
+        self.frame_count = 0
+        self.last_timings = dict()
+        self.total_timings = {phase: 0.0 for phase in self.phases}
+        logger.debug("Initialized %s", self.__class__.__name__)
+
+    def load_converter(self):
+        """ Load the model and the converter """
+        model_dir = get_folder(self.args.model_dir)
+        model = PluginLoader.get_model(self.args.trainer)(model_dir, self.args.gpus)
+        if not model.load(self.args.swap_model):
+            raise ValueError("Model Not Found in '{}'! A valid model must be provided "
+                             "to continue!".format(model_dir))
+        args = self.args
+        return PluginLoader.get_converter(args.converter)(
+            model.converter(False),
+            trainer=args.trainer,
+            blur_size=args.blur_size,
+            seamless_clone=args.seamless_clone,
+            seamless_downscale=args.seamless_downscale,
+            sharpen_image=args.sharpen_image,
+            mask_type=args.mask_type,
+            erosion_kernel_size=args.erosion_kernel_size,
+            match_histogram=args.match_histogram,
+            smooth_mask=args.smooth_mask,
+            avg_color_adjust=args.avg_color_adjust,
+            draw_transparent=False)
+
+    def load_extractor(self):
+        """ Launch the detector and aligner """
+        extractor = Plugins(self.args)
+        if not extractor.is_parallel:
+            raise ValueError("Swapping needs the detector and aligner to run together, "
+                             "but there is not enough free VRAM. Select a detector and "
+                             "aligner that run on the CPU")
+        extractor.launch_aligner()
+        extractor.launch_detector(partial_batches=True)
+        return extractor
+
+    def get_model_size(self):
+        """ Return the input size of the model """
+        return 128 if self.args.trainer.strip().lower() in ("gan128", "originalhighres") else 64
+
+    def warmup(self, frame_shape, iterations=1):
+        """ Run a blank frame through the detector and aligner and a blank
+            face through the model, so that the first real frame is not slowed
+            by graph building and memory allocation """
+        logger.debug("Warming up: (frame_shape: %s, iterations: %s)", frame_shape, iterations)
+        frame = np.zeros(frame_shape, dtype="uint8")
+        feed = np.zeros((1, self.size, self.size, 3), dtype="float32")
+        for _ in range(iterations):
+            self.detect(frame)
+            self.converter.predict(feed)
+
+    def detect(self, frame):
+        """ Return the DetectedFaces found in the frame """
+        filename = "frame_{:08d}.png".format(self.frame_count)
+        queue_manager.get_queue("load").put({"filename": filename, "image": frame})
+        faces = next(self.detected)
+        image = faces["image"]
+        detected_faces = list()
+        for idx, rect in enumerate(faces["detected_faces"]):
+            face = DetectedFace()
+            face.from_dlib_rect(rect, image)
+            face.landmarksXY = faces["landmarks"][idx]
+            face.frame_dims = image.shape[:2]
+            detected_faces.append(face)
+        return detected_faces
+
+    def swap(self, frame):
+        """ Return a copy of the BGR frame with every detected face swapped.
+
+            Faces are swapped one at a time, each warped from the frame with
+            the previous faces already patched, as in convert """
+        start = time.perf_counter()
+        faces = self.detect(frame)
+        detected = time.perf_counter()
+        timings = {"predict": 0.0, "patch": 0.0}
+        frame = frame.copy()
+        for face in faces:
+            begin = time.perf_counter()
+            feed, context = self.converter.prepare_face(frame, face, self.size)
+            prediction = self.converter.predict(np.expand_dims(feed, 0))[0]
+            predicted = time.perf_counter()
+            frame = self.converter.patch_face(frame, prediction, context)
+            timings["predict"] += predicted - begin
+            timings["patch"] += time.perf_counter() - predicted
+        timings["detect"] = detected - start
+        timings["total"] = time.perf_counter() - start
+
+        self.frame_count += 1
+        self.last_timings = {phase: timings[phase] * 1000 for phase in self.phases}
+        for phase in self.phases:
+            self.total_timings[phase] += self.last_timings[phase]
+        logger.verbose("Frame %s: %s faces, %s", self.frame_count, len(faces),
+                       ", ".join("{}: {:.1f}ms".format(phase, self.last_timings[phase])
+                                 for phase in self.phases))
+        return frame
+
+    def average_timings(self):
+        """ Return the mean latency of each phase in milliseconds """
+        count = max(self.frame_count, 1)
+        return {phase: total / count for phase, total in self.total_timings.items()}
+
+    def close(self):
+        """ Shut down the detector and aligner """
+        logger.debug("Closing %s", self.__class__.__name__)
+        queue_manager.get_queue("load").put("EOF")
+        for _ in self.detected:
+            pass
+        queue_manager.terminate_queues()
+
+
+class Swap():
+    """ The swap command.
+
+        Reads raw BGR24 frames of frame_size from stdin, and writes the
+        swapped frames in the same format to stdout, one frame out for each
+        frame in. Logs are moved to stderr so that stdout only holds frames.
+        This matches ffmpeg's rawvideo format, for example:
+
+            ffmpeg -i in.mp4 -f rawvideo -pix_fmt bgr24 - |
+            python faceswap.py swap -m models -fs 1280x720 |
+            ffmpeg -f rawvideo -pix_fmt bgr24 -s 1280x720 -i - out.mp4
+    """
+    def __init__(self, arguments):
+        logger.debug("Initializing %s: (args: %s)", self.__class__.__name__, arguments)
+        self.args = arguments
+        self.width, self.height = self.get_frame_size()
+        self.output = self.redirect_stdout()
+        logger.debug("Initialized %s", self.__class__.__name__)
+
+    def get_frame_size(self):
+        """ Return the width and height of the frames """
+        try:
+            width, height = (int(size) for size in self.args.frame_size.lower().split("x"))
+        except ValueError:
+            raise ValueError("Frame size must be given as WIDTHxHEIGHT, "
+                             "not '{}'".format(self.args.frame_size))
+        return width, height
+
+    @staticmethod
+    def redirect_stdout():
+        """ Return a binary file for the original stdout and point stdout at
+            stderr, so that logging, and anything the plugins print, can not
+            corrupt the frames """
+        sys.stdout.flush()
+        output = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        return output
+
+    def read_frame(self, stream, frame_bytes):
+        """ Return the next frame from the stream or None at the end """
+        data = stream.read(frame_bytes)
+        if not data:
+            return None
+        while len(data) < frame_bytes:
+            more = stream.read(frame_bytes - len(data))
+            if not more:
+                raise ValueError("Input ended part way through a frame. Check that "
+                                 "the frame size is {}x{}".format(self.width, self.height))
+            data += more
+        return np.frombuffer(data, dtype="uint8").reshape(self.height, self.width, 3)
+
+    def process(self):
+        """ Swap the frames from stdin until it is closed """
+        swapper = Swapper(self.args)
+        try:
+            swapper.warmup((self.height, self.width, 3), self.args.warmup)
+            logger.info("Ready. Reading %sx%s BGR24 frames from stdin", self.width, self.height)
+            stream = sys.stdin.buffer
+            frame_bytes = self.width * self.height * 3
+            while True:
+                frame = self.read_frame(stream, frame_bytes)
+                if frame is None:
+                    break
+                self.output.write(swapper.swap(frame).tobytes())
+                self.output.flush()
+        finally:
+            self.output.close()
+            swapper.close()
+        logger.info("Swapped %s frames. Mean latency: %s", swapper.frame_count,
+                    ", ".join("{}: {:.1f}ms".format(phase, latency)
+                              for phase, latency in swapper.average_timings().items()))
@@ -2,14 +2,20 @@
 """ The script to run the training process of faceswap """
 
 import logging
+import multiprocessing as mp
 import os
+import queue
 import sys
 import threading
 
 import cv2
+import numpy as np
 import tensorflow as tf
 from keras.backend.tensorflow_backend import set_session
 
+from lib.multithreading import MultiThread
+from lib.packed_faces import PackedFaces
+from lib.sysinfo import sysinfo
 from lib.utils import (get_folder, get_image_paths, set_system_verbosity,
                        Timelapse)
 from plugins.plugin_loader import PluginLoader
@@ -19,12 +25,17 @@ logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 class Train():
     """ The training process.  """
+    # Previews and timelapses waiting to be rendered. Further requests are
+    # skipped while it is full, so training never waits for them
+    preview_queue_size = 8
+
     def __init__(self, arguments):
         self.args = arguments
         self.images = self.get_images()
         self.stop = False
         self.save_now = False
         self.preview_buffer = dict()
+        self.preview_queue = queue.Queue(maxsize=self.preview_queue_size)
         self.lock = threading.Lock()
 
         # this is so that you can enter case insensitive values for trainer
@@ -49,9 +60,10 @@ class Train():
 
     def get_images(self):
         """ Check the image dirs exist, contain images and return the image
-        objects """
+        objects. If packed faces are requested, new faces are packed and
+        references to the packed faces returned in place of the filenames """
         images = []
-        for image_dir in [self.args.input_A, self.args.input_B]:
+        for side, image_dir in (("A", self.args.input_A), ("B", self.args.input_B)):
             if not os.path.isdir(image_dir):
                 logger.error("Error: '%s' does not exist", image_dir)
                 exit(1)
@@ -60,7 +72,13 @@ class Train():
                 logger.error("Error: '%s' contains no images", image_dir)
                 exit(1)
 
-            images.append(get_image_paths(image_dir))
+            filenames = get_image_paths(image_dir)
+            if self.args.packed_faces:
+                packed = PackedFaces(os.path.join(self.args.packed_faces, side))
+                packed.update(filenames)
+                images.append(packed.faces())
+            else:
+                images.append(filenames)
         logger.info("Model A Directory: %s", self.args.input_A)
         logger.info("Model B Directory: %s", self.args.input_B)
         return images
@@ -98,10 +116,15 @@ class Train():
                 self.args.timelapse_output,
                 trainer)
 
-            self.run_training_cycle(model, trainer)
+            preview_thread = self.start_preview_thread(trainer)
+            try:
+                self.run_training_cycle(model, trainer)
+            finally:
+                self.end_preview_thread(preview_thread)
         except KeyboardInterrupt:
             try:
                 model.save_weights()
+                model.checkpoint.close()
             except KeyboardInterrupt:
                 logger.info("Saving model weights has been cancelled!")
             exit(0)
@@ -115,6 +138,7 @@ class Train():
                                                           self.args.gpus)
 
         model.load(swapped=False)
+        model.checkpoint.keep = self.args.keep_checkpoints
         return model
 
     def load_trainer(self, model):
@@ -126,27 +150,93 @@ class Train():
                           images_a,
                           images_b,
                           self.args.batch_size,
-                          self.args.perceptual_loss)
+                          self.args.perceptual_loss,
+                          training_opts=self.training_opts())
         return trainer
 
+    def training_opts(self):
+        """ Return the options for building the training batches """
+        workers = self.args.data_workers
+        if workers == 0:
+            # Leave a core for the trainer and split the rest between A and B
+            workers = max((mp.cpu_count() - 1) // 2, 1)
+        logger.debug("Training data workers per side: %s", workers)
+        return {"workers": workers,
+                "prefetch": self.args.prefetch,
+                "cache_size": None if self.args.packed_faces else self.get_cache_size(),
+                "tf_data": self.args.tf_data}
+
+    def get_cache_size(self):
+        """ Return the decoded image cache budget for each side in bytes.
+            By default the sides share a quarter of the available RAM. Packed
+            faces are not decoded, so are never cached """
+        if self.args.cache_memory is None:
+            cache_size = sysinfo.ram_available // 4
+        else:
+            cache_size = self.args.cache_memory * 1024 * 1024
+        logger.verbose("Decoded image cache: %sMB", cache_size // (1024 * 1024))
+        return cache_size // 2
+
     def run_training_cycle(self, model, trainer):
         """ Perform the training cycle """
+        timer = trainer.timer
         for iteration in range(0, self.args.iterations):
+            timer.step()
             save_iteration = iteration % self.args.save_interval == 0
             viewer = self.show if save_iteration or self.save_now else None
             if save_iteration and self.timelapse is not None:
-                self.timelapse.work()
+                self.queue_preview(self.timelapse.work)
             trainer.train_one_step(iteration, viewer)
             if self.stop:
                 break
             elif save_iteration:
-                model.save_weights()
+                with timer.phase("save"):
+                    model.save_weights()
             elif self.save_now:
-                model.save_weights()
+                with timer.phase("save"):
+                    model.save_weights()
                 self.save_now = False
         model.save_weights()
+        model.checkpoint.close()
         self.stop = True
 
+    def start_preview_thread(self, trainer):
+        """ Start the thread that renders the previews and timelapses """
+        thread = MultiThread(self.render_previews, tf.get_default_graph(), trainer.timer)
+        thread.start()
+        return thread
+
+    def end_preview_thread(self, thread):
+        """ Render the queued previews, then stop the preview thread. The
+            thread only stops early on an error, which join re-raises """
+        while thread.is_alive():
+            try:
+                self.preview_queue.put(None, timeout=1)
+                break
+            except queue.Full:
+                continue
+        thread.join()
+
+    def render_previews(self, graph, timer):
+        """ Run the queued renders with the model's graph as the default,
+            timing them as the preview phase of the training steps """
+        with graph.as_default():
+            while True:
+                task = self.preview_queue.get()
+                if task is None:
+                    break
+                render, args = task
+                with timer.phase("preview"):
+                    render(*args)
+
+    def queue_preview(self, render, *args):
+        """ Queue a render for the preview thread, skipping it if the thread
+            is too far behind """
+        try:
+            self.preview_queue.put_nowait((render, args))
+        except queue.Full:
+            logger.debug("Preview thread busy. Skipping: %s", render.__name__)
+
     def monitor_preview(self):
         """ Generate the preview window and wait for keyboard input """
         logger.info("Using live preview.\n"
@@ -193,8 +283,17 @@ class Train():
         config.gpu_options.visible_device_list = "0"
         set_session(tf.Session(config=config))
 
-    def show(self, image, name=""):
-        """ Generate the preview and write preview file output """
+    def show(self, render, samples, name=""):
+        """ Passed to the trainer to request a preview. The preview is
+            rendered on the preview thread by calling render with a copy of
+            the samples, as the trainer reuses the batch buffers """
+        samples = tuple(sample.copy() if isinstance(sample, np.ndarray) else sample
+                        for sample in samples)
+        self.queue_preview(self.write_preview, render, samples, name)
+
+    def write_preview(self, render, samples, name):
+        """ Render the preview and write preview file output """
+        image = render(*samples)
         try:
             scriptpath = os.path.realpath(os.path.dirname(sys.argv[0]))
             if self.args.write_image:
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+""" Micro-benchmark for the Adjust converter's colour adjustment and mask
+    smoothing against the per-pixel implementations they replaced
+
+    Run from the faceswap folder:
+        python -m tests.bench_convert_adjust [-r REPEATS]
+"""
+import argparse
+import timeit
+
+from plugins.convert.Convert_Adjust import Convert
+from tests.test_convert_adjust import (get_faces, reference_adjust_avg_color,
+                                       reference_smooth_mask)
+
+
+def measure(func, repeats):
+    """ Return the best time in milliseconds for func on a fresh face """
+    old_face, new_face = get_faces(0)
+
+    def run():
+        func(old_face, new_face.copy())
+    return min(timeit.repeat(run, number=repeats, repeat=3)) / repeats * 1e3
+
+
+def main():
+    """ Run the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-r", "--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    for name, reference, func in (
+            ("adjust_avg_color", reference_adjust_avg_color, Convert.adjust_avg_color),
+            ("smooth_mask", reference_smooth_mask, Convert.smooth_mask)):
+        before = measure(reference, max(args.repeats // 10, 1))
+        after = measure(func, args.repeats)
+        print("{:<17} {:>9.3f} ms -> {:>7.3f} ms ({:.0f}x)".format(name,
+                                                                   before,
+                                                                   after,
+                                                                   before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+""" Micro-benchmark for DetectedFace memory use and matrix caching
+
+    Compares the slotted DetectedFace, holding its landmarks as a float32
+    array, against the previous layout of an instance dictionary holding a
+    list of landmark tuples, with the alignment matrix recalculated on every
+    request.
+
+    Run from the faceswap folder:
+        python -m tests.bench_detected_face [-n FACES] [-r REPEATS]
+"""
+import argparse
+import timeit
+import tracemalloc
+
+import numpy as np
+
+import lib.logger  # noqa pylint: disable=unused-import  # Adds the trace log level
+from lib.aligner import get_align_mat
+from lib.faces_detect import DetectedFace
+
+
+class LegacyDetectedFace():
+    """ The parts of the previous DetectedFace that convert uses """
+    def __init__(self):
+        self.image = None
+        self.x = None
+        self.w = None
+        self.y = None
+        self.h = None
+        self.frame_dims = None
+        self.landmarksXY = None  # pylint: disable=invalid-name
+        self.hash = None
+        self.aligned = dict()
+
+    @property
+    def landmarks_as_xy(self):
+        """ Landmarks as XY """
+        return self.landmarksXY
+
+    def from_alignment(self, alignment):
+        """ Convert a face alignment to detected face object """
+        self.x = alignment["x"]
+        self.w = alignment["w"]
+        self.y = alignment["y"]
+        self.h = alignment["h"]
+        self.frame_dims = alignment["frame_dims"]
+        self.landmarksXY = [tuple(point) for point in alignment["landmarksXY"]]
+        self.hash = alignment.get("hash", None)
+
+    def get_align_mat(self):
+        """ Recalculate the alignment matrix """
+        return get_align_mat(self, 256, False)
+
+
+def get_alignments(count):
+    """ Return alignment dicts with random landmarks around a face """
+    rand = np.random.RandomState(0)
+    base = rand.uniform(200, 400, (68, 2))
+    return [{"x": 200, "w": 200, "y": 200, "h": 200,
+             "frame_dims": (720, 1280),
+             "landmarksXY": np.rint(base + rand.uniform(-5, 5, (68, 2))).astype("int32").tolist(),
+             "hash": "{:040x}".format(idx)}
+            for idx in range(count)]
+
+
+def measure_memory(face_class, alignments):
+    """ Return the bytes held per face after building faces from alignments """
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    faces = list()
+    for alignment in alignments:
+        face = face_class()
+        face.from_alignment(alignment)
+        faces.append(face)
+    held = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return held / len(faces)
+
+
+def measure_matrix(face_class, alignment, repeats):
+    """ Return the time in microseconds to request the alignment matrix
+        three times, as convert does for each face """
+    def run():
+        face = face_class()
+        face.from_alignment(alignment)
+        for _ in range(3):
+            face.get_align_mat()
+    return min(timeit.repeat(run, number=repeats, repeat=3)) / repeats * 1e6
+
+
+def main():
+    """ Run the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--faces", type=int, default=10000)
+    parser.add_argument("-r", "--repeats", type=int, default=500)
+    args = parser.parse_args()
+
+    alignments = get_alignments(args.faces)
+    for name, face_class in (("legacy", LegacyDetectedFace), ("slotted", DetectedFace)):
+        print("{:<8} {:>8.0f} bytes/face {:>8.1f} us/face (3 matrix requests)".format(
+            name,
+            measure_memory(face_class, alignments),
+            measure_matrix(face_class, alignments[0], args.repeats)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+""" Tests for saving model checkpoints in the background """
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip("h5py")
+pytest.importorskip("keras")
+
+from lib.checkpoint import Checkpoint  # noqa pylint:disable=wrong-import-position
+
+
+def read_files(folder):
+    """ Return the contents of each file in folder by name """
+    retval = dict()
+    for filename in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, filename), "rb") as handle:
+            retval[filename] = handle.read()
+    return retval
+
+
+def test_saves_keep_backups(tmpdir):
+    """ Each save replaces all of the files, keeping the previous saves as
+        backups up to the limit """
+    folder = str(tmpdir)
+    checkpoint = Checkpoint(folder, keep=2)
+    for save in range(4):
+        checkpoint.save({"a.h5": b"a%d" % save, "state.json": b"s%d" % save})
+    checkpoint.close()
+    assert read_files(folder) == {"a.h5": b"a3", "a.h5.bk": b"a2", "a.h5.bk2": b"a1",
+                                  "state.json": b"s3", "state.json.bk": b"s2",
+                                  "state.json.bk2": b"s1"}
+
+
+def test_interrupted_commit_completed(tmpdir):
+    """ A save that was interrupted while its files were being moved into
+        place is completed when the model is next loaded """
+    folder = str(tmpdir)
+    files = {"a.h5.bk": b"a0", "a.h5": b"a1", "b.h5": b"b0", "b.h5.tmp": b"b1",
+             Checkpoint.journal_name: json.dumps(["a.h5", "b.h5"]).encode("utf-8")}
+    for filename, content in files.items():
+        with open(os.path.join(folder, filename), "wb") as handle:
+            handle.write(content)
+    Checkpoint(folder)
+    assert read_files(folder) == {"a.h5": b"a1", "a.h5.bk": b"a0",
+                                  "b.h5": b"b1", "b.h5.bk": b"b0"}
+
+
+def test_unjournaled_save_ignored(tmpdir):
+    """ Files of a save that was interrupted before all of them were written
+        are not moved into place """
+    folder = str(tmpdir)
+    for filename, content in (("a.h5", b"a0"), ("a.h5.tmp", b"a1")):
+        with open(os.path.join(folder, filename), "wb") as handle:
+            handle.write(content)
+    Checkpoint(folder)
+    assert read_files(folder)["a.h5"] == b"a0"
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+""" Parity tests for the Adjust converter's colour adjustment and mask
+    smoothing against the per-pixel implementations they replaced """
+
+import cv2
+import numpy as np
+import pytest
+
+from plugins.convert.Convert_Adjust import Convert
+
+FACE_SHAPE = (160, 160, 3)
+
+
+def reference_adjust_avg_color(old_face, new_face):
+    """ The previous per-pixel average color adjustment. Pixel values are
+        taken as python ints, so the sum does not wrap as uint8 """
+    for i in range(new_face.shape[-1]):
+        old_avg = old_face[:, :, i].mean()
+        new_avg = new_face[:, :, i].mean()
+        diff_int = (int)(old_avg - new_avg)
+        for int_h in range(new_face.shape[0]):
+            for int_w in range(new_face.shape[1]):
+                temp = (int(new_face[int_h, int_w, i]) + diff_int)
+                if temp < 0:
+                    new_face[int_h, int_w, i] = 0
+                elif temp > 255:
+                    new_face[int_h, int_w, i] = 255
+                else:
+                    new_face[int_h, int_w, i] = temp
+
+
+def reference_smooth_mask(old_face, new_face):
+    """ The previous mask smoothing, blurring a new mask for every face """
+    width, height, _ = new_face.shape
+    crop = slice(0, width)
+    mask = np.zeros_like(new_face)
+    mask[height // 15:-height // 15, width // 15:-width // 15, :] = 255
+    mask = cv2.GaussianBlur(mask, (15, 15), 10)  # pylint: disable=no-member
+    new_face[crop, crop] = (mask / 255 * new_face +
+                            (1 - mask / 255) * old_face)
+
+
+def get_faces(seed, old_offset=0):
+    """ Return an old and a new uint8 face. old_offset shifts the old face's
+        brightness so that the colour adjustment saturates """
+    rand = np.random.RandomState(seed)
+    old_face = np.clip(rand.randint(0, 256, FACE_SHAPE) + old_offset, 0, 255).astype("uint8")
+    new_face = rand.randint(0, 256, FACE_SHAPE).astype("uint8")
+    return old_face, new_face
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("old_offset", (-200, 0, 200))
+def test_adjust_avg_color(seed, old_offset):
+    """ Vectorized colour adjustment matches the per-pixel loop exactly """
+    old_face, new_face = get_faces(seed, old_offset)
+    expected = new_face.copy()
+    reference_adjust_avg_color(old_face, expected)
+    Convert.adjust_avg_color(old_face, new_face)
+    np.testing.assert_array_equal(new_face, expected)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_smooth_mask(seed):
+    """ Mask smoothing with cached weights matches the previous blend exactly """
+    old_face, new_face = get_faces(seed)
+    expected = new_face.copy()
+    reference_smooth_mask(old_face, expected)
+    Convert.smooth_mask(old_face, new_face)
+    np.testing.assert_array_equal(new_face, expected)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+""" Parity tests for the Masked converter's region of interest blending
+    against the full frame blending it replaced """
+
+import cv2
+import numpy as np
+import pytest
+
+from plugins.convert.Convert_Masked import Convert
+
+FRAME_SIZES = ((720, 1280), (768, 1366), (480, 853))
+DEFAULTS = {"blur_size": 2, "seamless_clone": False, "mask_type": "facehullandrect",
+            "erosion_kernel_size": None, "match_histogram": False, "sharpen_image": None}
+# The largest difference in levels from the full frame result. The warp in
+# the region rounds its sub-pixel sample coordinates differently from the
+# full frame warp, by up to 1 level. Sharpening amplifies that, as does a
+# rect mask where its cubic warp overshoots 1. Measured as the worst case over
+# 8 seeds of these faces. A misaligned region reaches 16 with bsharpen
+TOLERANCES = {"default": ({}, 1),
+              "facehull": ({"mask_type": "facehull"}, 1),
+              "rect_blur": ({"mask_type": "rect", "blur_size": 5}, 2),
+              "erode": ({"erosion_kernel_size": 5}, 1),
+              "dilate": ({"erosion_kernel_size": -5}, 2),
+              "seamless": ({"seamless_clone": True}, 1),
+              "gsharpen": ({"sharpen_image": "gsharpen"}, 2),
+              "bsharpen": ({"sharpen_image": "bsharpen"}, 10),
+              "rect_bsharpen": ({"mask_type": "rect", "sharpen_image": "bsharpen"}, 10)}
+
+
+def reference_image_mask(converter, image, landmarks, mat, image_size, size):
+    """ The previous full frame float64 mask """
+    face_mask = np.zeros(image.shape, dtype=float)
+    if "rect" in converter.mask_type:
+        cv2.warpAffine(np.ones((size, size, 3), dtype=float), mat, image_size, face_mask,
+                       cv2.WARP_INVERSE_MAP | cv2.INTER_CUBIC, cv2.BORDER_TRANSPARENT)
+    hull_mask = np.zeros(image.shape, dtype=float)
+    if "hull" in converter.mask_type:
+        hull = cv2.convexHull(np.array(landmarks).reshape((-1, 2)).astype(int))
+        cv2.fillConvexPoly(hull_mask, hull.reshape((-1, 2)), (1, 1, 1))
+    if converter.mask_type == "rect":
+        image_mask = face_mask
+    elif converter.mask_type == "facehull":
+        image_mask = hull_mask
+    else:
+        image_mask = face_mask * hull_mask
+    if converter.erosion_kernel is not None:
+        if converter.erosion_kernel_size > 0:
+            image_mask = cv2.erode(image_mask, converter.erosion_kernel, iterations=1)
+        else:
+            image_mask = cv2.dilate(image_mask, abs(converter.erosion_kernel), iterations=1)
+    if converter.blur_size != 0:
+        image_mask = cv2.blur(image_mask, (converter.blur_size, converter.blur_size))
+    return image_mask
+
+
+def reference_patch_face(converter, image, new_face, context):
+    """ The previous full frame warp, sharpen and blend, rounded to uint8 as
+        cv2.imwrite rounds its float output """
+    mat, image_size = context["mat"], context["image_size"]
+    image_mask = reference_image_mask(converter, image, context["landmarks"], mat, image_size,
+                                      context["size"])
+    new_image = image.copy()
+    cv2.warpAffine(new_face, mat, image_size, new_image,
+                   cv2.WARP_INVERSE_MAP | cv2.INTER_CUBIC, cv2.BORDER_TRANSPARENT)
+    if converter.sharpen_image == "bsharpen":
+        kernel = np.ones((3, 3)) * (-1)
+        kernel[1, 1] = 9
+        new_image = cv2.filter2D(new_image, -1, kernel)
+    elif converter.sharpen_image == "gsharpen":
+        blurred = cv2.GaussianBlur(new_image, (0, 0), 3.0)
+        new_image = cv2.addWeighted(new_image, 1.5, blurred, -0.5, 0, new_image)
+    if converter.seamless_clone:
+        unit_mask = np.clip(image_mask * 365, 0, 255).astype(np.uint8)
+        region = np.argwhere(unit_mask == 255)
+        if region.size > 0:
+            min_y, min_x = region.min(axis=0)[:2]
+            max_y, max_x = region.max(axis=0)[:2]
+            center = (int(min_x + (max_x - min_x) // 2), int(min_y + (max_y - min_y) // 2))
+            return cv2.seamlessClone(new_image, image, unit_mask, center, cv2.NORMAL_CLONE)
+    outimage = image_mask * new_image + (1.0 - image_mask) * image
+    return np.clip(np.rint(outimage), 0, 255).astype(np.uint8)
+
+
+def get_frame(rand, height, width):
+    """ Return a smooth random frame """
+    frame = rand.randint(0, 256, (height, width, 3)).astype(np.uint8)
+    return cv2.GaussianBlur(frame, (0, 0), 3)
+
+
+def get_context(rand, frame, size, center=None):
+    """ Return the patch context for a random face in the frame, built the
+        way Convert.prepare_face builds it from a detected face. Faces at a
+        random center lie within the frame """
+    height, width = frame.shape[:2]
+    radius = rand.uniform(30, min(height, width) / 5)
+    if center is None:
+        reach = 2.5 * radius
+        center = rand.uniform(reach, width - reach), rand.uniform(reach, height - reach)
+    angle = rand.uniform(-0.5, 0.5)
+    scale = size / (2.5 * radius)
+    cos, sin = scale * np.cos(angle), scale * np.sin(angle)
+    mat = np.array([[cos, sin, 0], [-sin, cos, 0]])
+    mat[:, 2] = size / 2 - mat[:, :2].dot(center)
+    points = np.linspace(0, 6, 68)
+    landmarks = np.stack([center[0] + radius * np.cos(points + angle),
+                          center[1] + 1.2 * radius * np.sin(points)], axis=1).astype(int)
+    face = cv2.warpAffine(frame, mat, (size, size))
+    return {"image_size": (width, height), "mat": mat, "size": size, "face": face,
+            "normalized_face": face / 255.0, "landmarks": landmarks}
+
+
+def get_cases(seed, corners=True):
+    """ Yield a frame and the contexts of faces on it, for each frame size
+        and model size, with faces over the frame's corners as well as
+        within it if corners is set """
+    rand = np.random.RandomState(seed)
+    for height, width in FRAME_SIZES:
+        frame = get_frame(rand, height, width)
+        centers = [None, (0, 0), (width - 1, height - 1)] if corners else [None]
+        for size in (64, 128):
+            for center in centers:
+                yield frame, get_context(rand, frame, size, center)
+
+
+@pytest.mark.parametrize("name", sorted(TOLERANCES))
+def test_roi_matches_full_frame(name):
+    """ Blending only the face region gives the full frame result within the
+        measured tolerances, and leaves the rest of the frame untouched """
+    options, tolerance = TOLERANCES[name]
+    kwargs = dict(DEFAULTS, **options)
+    weights = np.random.RandomState(1).rand(3, 3)
+    converter = Convert(lambda feed: np.clip(feed.dot(weights) / 1.5, 0, 1), "Original", **kwargs)
+    # The full frame seamless clone fails on faces that overhang the frame
+    for frame, context in get_cases(0, corners=not converter.seamless_clone):
+        prediction = converter.predict(np.expand_dims(context["normalized_face"], 0))[0]
+        new_face = converter.get_new_face(prediction, context, frame.dtype)
+        expected = reference_patch_face(converter, frame, new_face, context)
+        result = converter.patch_face(frame.copy(), prediction, context)
+        diff = np.abs(result.astype(int) - expected)
+        assert diff.max() <= tolerance, (name, context["image_size"], context["size"])
+        roi = converter.get_roi(context)
+        if roi is not None and not converter.seamless_clone:
+            left, top, right, bottom = roi
+            outside = np.ones(frame.shape[:2], dtype=bool)
+            outside[top:bottom, left:right] = False
+            np.testing.assert_array_equal(result[outside], frame[outside])
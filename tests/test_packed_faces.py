@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+""" Tests for packing training faces into a memory mapped file """
+
+import os
+import pickle
+
+import cv2
+import numpy as np
+
+from lib.packed_faces import PackedFaces
+from lib.utils import get_image_paths
+
+
+def write_faces(folder, names, seed=0):
+    """ Write random 128px faces named names to folder """
+    rand = np.random.RandomState(seed)
+    for name in names:
+        cv2.imwrite(os.path.join(folder, name),
+                    rand.randint(0, 256, (128, 128, 3)).astype("uint8"))
+
+
+def expected_face(folder, name):
+    """ Return a face read and resized as when packed """
+    return cv2.resize(cv2.imread(os.path.join(folder, name)), (256, 256))
+
+
+def packed_faces(packed):
+    """ Return the packed faces by source name """
+    return {packed.index[face.idx]["name"]: face.load() for face in packed.faces()}
+
+
+def test_incremental_update(tmpdir):
+    """ Only added and changed faces are packed again, freed records are
+        reused and the packed faces match the source images """
+    source = str(tmpdir.mkdir("faces"))
+    folder = str(tmpdir.join("packed"))
+    write_faces(source, ("a.png", "b.png", "c.png"))
+    packed = PackedFaces(folder)
+    packed.update(get_image_paths(source))
+    assert packed.count == 3
+
+    os.remove(os.path.join(source, "b.png"))
+    write_faces(source, ("d.png", ), seed=1)
+    packed = PackedFaces(folder)
+    packed.update(get_image_paths(source))
+    assert packed.count == 3
+    assert packed.index[1]["name"] == "d.png"
+
+    packed = PackedFaces(folder)
+    faces = packed_faces(packed)
+    assert sorted(faces) == ["a.png", "c.png", "d.png"]
+    for name, face in faces.items():
+        np.testing.assert_array_equal(face, expected_face(source, name))
+
+
+def test_pickled_faces_read_the_file(tmpdir):
+    """ Faces passed to another process carry no index and map the file
+        themselves """
+    source = str(tmpdir.mkdir("faces"))
+    write_faces(source, ("a.png", ))
+    packed = PackedFaces(str(tmpdir.join("packed")))
+    packed.update(get_image_paths(source))
+    face = pickle.loads(pickle.dumps(packed.faces()[0]))
+    assert face.packed.index is None
+    np.testing.assert_array_equal(face.load(), expected_face(source, "a.png"))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+""" Tests for the convert prediction cache """
+
+import os
+
+import numpy as np
+
+from lib.prediction_cache import PredictionCache, get_checkpoint_id
+
+
+def get_predictions(count, seed=0):
+    """ Return feeds and predictions shaped as for a 64px GAN model """
+    rand = np.random.RandomState(seed)
+    feeds = rand.uniform(0, 1, (count, 64, 64, 3)).astype("float32")
+    predictions = rand.uniform(-1, 1, (count, 64, 64, 4)).astype("float32")
+    return feeds, predictions
+
+
+def test_round_trip(tmpdir):
+    """ Predictions are returned unchanged after the cache is reopened """
+    feeds, predictions = get_predictions(5)
+    cache = PredictionCache(str(tmpdir), "checkpoint")
+    for feed, prediction in zip(feeds, predictions):
+        cache.put(cache.key(feed), prediction)
+    cache.close()
+
+    cache = PredictionCache(str(tmpdir), "checkpoint")
+    for feed, prediction in zip(feeds, predictions):
+        np.testing.assert_array_equal(cache.get(cache.key(feed)), prediction)
+    assert cache.get(cache.key(feeds[0] + 1)) is None
+    assert (cache.hits, cache.misses) == (5, 1)
+    cache.close()
+
+
+def test_unindexed_records_dropped(tmpdir):
+    """ Records written after the last index save are dropped on reopening
+        and the data file is truncated so new records line up """
+    feeds, predictions = get_predictions(4)
+    cache = PredictionCache(str(tmpdir), "checkpoint")
+    cache.save_every = 2
+    for feed, prediction in zip(feeds[:3], predictions[:3]):
+        cache.put(cache.key(feed), prediction)
+    cache.handle.close()  # Simulate a crash before close saves the index
+
+    cache = PredictionCache(str(tmpdir), "checkpoint")
+    assert len(cache.keys) == 2
+    assert cache.get(cache.key(feeds[2])) is None
+    cache.put(cache.key(feeds[3]), predictions[3])
+    np.testing.assert_array_equal(cache.get(cache.key(feeds[3])), predictions[3])
+    np.testing.assert_array_equal(cache.get(cache.key(feeds[1])), predictions[1])
+    cache.close()
+
+
+def test_checkpoint_id_follows_weights(tmpdir):
+    """ The checkpoint id changes when the weights or the swap direction change """
+    weights = os.path.join(str(tmpdir), "encoder.h5")
+    with open(weights, "wb") as handle:
+        handle.write(b"weights")
+    checkpoint = get_checkpoint_id(str(tmpdir), "Original", False)
+    assert get_checkpoint_id(str(tmpdir), "Original", False) == checkpoint
+    assert get_checkpoint_id(str(tmpdir), "Original", True) != checkpoint
+    with open(weights, "ab") as handle:
+        handle.write(b" retrained")
+    assert get_checkpoint_id(str(tmpdir), "Original", False) != checkpoint
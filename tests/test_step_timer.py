@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+""" Tests for the training step timer """
+
+import re
+
+import pytest
+
+from lib.step_timer import StepTimer
+
+
+def test_status(monkeypatch):
+    """ Phases are averaged over the steps and the status can be read back
+        without being taken for a loss value """
+    clock = iter([0.0, 0.0, 1.0, 1.0, 4.0, 4.0, 4.5, 5.0, 5.0, 5.5, 6.0]).__next__
+    monkeypatch.setattr("lib.step_timer.time.perf_counter", clock)
+    timer = StepTimer(8)
+    assert timer.status() == ""
+    timer.step()                        # 0.0
+    with timer.phase("data"):           # 0.0 - 1.0
+        pass
+    with timer.phase("compute"):        # 1.0 - 4.0
+        pass
+    with timer.phase("save"):           # 4.0 - 4.5
+        pass
+    timer.step()                        # 5.0
+    with timer.phase("compute"):        # 5.0 - 5.5
+        pass
+    timer.step()                        # 6.0
+    stats = timer.stats()
+    assert stats["rate"] == pytest.approx(16 / 6)
+    assert stats["data"] == pytest.approx(100 / 6)
+    assert stats["compute"] == pytest.approx(350 / 6)
+    assert (stats["save"], stats["preview"]) == (0.5, 0.0)
+
+    line = "[12:00:00] [#00002] loss_A: 0.01000, loss_B: 0.02000" + timer.status()
+    assert re.findall(r"([a-zA-Z_]+):.*?(\d+\.\d+)", line) == [("loss_A", "0.01000"),
+                                                             ("loss_B", "0.02000")]
+    assert timer.status() == " [2.7 EGs/s data 17% compute 58% save 0.50s preview 0.00s]"
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+""" Tests for the training data generator """
+
+import os
+import random
+
+import cv2
+import numpy as np
+import pytest
+
+from lib.training_data import ImageCache, TrainingDataGenerator
+from lib.umeyama import umeyama
+
+# No random augmentation, so that batches only depend on the shuffled order
+STATIC_TRANSFORM = {"rotation_range": 0, "zoom_range": 0, "shift_range": 0, "random_flip": 0}
+RANDOM_TRANSFORM = {"rotation_range": 10, "zoom_range": 0.05, "shift_range": 0.05,
+                    "random_flip": 0.4}
+
+
+@pytest.fixture(name="faces")
+def get_faces(tmpdir):
+    """ Write random faces to a folder and return their filenames """
+    rand = np.random.RandomState(0)
+    filenames = list()
+    for idx in range(10):
+        filename = os.path.join(str(tmpdir), "face_{}.png".format(idx))
+        cv2.imwrite(filename, rand.randint(0, 256, (256, 256, 3)).astype("uint8"))
+        filenames.append(filename)
+    return filenames
+
+
+def get_batches(faces, count, **training_opts):
+    """ Return the first count batches with python's random seeded """
+    random.seed(0)
+    generator = TrainingDataGenerator(STATIC_TRANSFORM, 160, scale=0,
+                                      training_opts=training_opts)
+    batches = generator.minibatchAB(list(faces), 4)
+    retval = [(epoch, warped.copy(), target.copy())
+              for epoch, warped, target in (next(batches) for _ in range(count))]
+    batches.close()
+    return retval
+
+
+def test_pooled_batches_match_thread(faces):
+    """ Worker processes build the same batches, in the same order and
+        epochs, as the background thread """
+    # The background thread keeps shuffling ahead after the test stops
+    # reading, so it runs last to leave the pooled run's random state alone
+    result = get_batches(faces, 7, workers=2, prefetch=2)
+    expected = get_batches(faces, 7, workers=1, prefetch=1)
+    assert [batch[0] for batch in result] == [0, 0, 1, 1, 2, 2, 3]
+    for (epoch, warped, target), (exp_epoch, exp_warped, exp_target) in zip(result, expected):
+        assert epoch == exp_epoch
+        np.testing.assert_array_equal(warped, exp_warped)
+        np.testing.assert_array_equal(target, exp_target)
+
+
+def test_image_cache_evicts_least_recently_used():
+    """ The cache keeps within its budget by dropping the least recently
+        used images, and counts hits and misses """
+    image = np.zeros((16, 16, 3), dtype="uint8")
+    cache = ImageCache(image.nbytes * 2)
+    cache.put("a", image)
+    cache.put("b", image)
+    assert cache.get("a") is image
+    cache.put("c", image)
+    assert cache.get("b") is None
+    assert cache.get("a") is image and cache.get("c") is image
+    assert cache.used == image.nbytes * 2
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_cached_batches_match_uncached(faces):
+    """ Batches built from cached images are the same as those read from
+        disk, and the repeated reads are cache hits """
+    generator = TrainingDataGenerator(STATIC_TRANSFORM, 160, scale=0,
+                                      training_opts={"cache_size": 1 << 30})
+    cache = ImageCache(generator.cache_size)
+    expected = generator.build_batch(faces)
+    generator.build_batch(faces, cache)
+    np.testing.assert_array_equal(generator.build_batch(faces, cache), expected)
+    assert (cache.hits, cache.misses) == (len(faces), len(faces))
+
+
+def augment_face(image, params, idx, coverage, zoom):
+    """ random_transform then random_warp of one face using the batch's
+        parameters for face idx instead of drawing them """
+    mat = cv2.getRotationMatrix2D((128, 128), params["rotation"][idx], params["scale"][idx])
+    mat[:, 2] += params["shift"][idx]
+    image = cv2.warpAffine(image, mat, (256, 256), borderMode=cv2.BORDER_REPLICATE)
+    if params["flip"][idx]:
+        image = image[:, ::-1]
+
+    range_ = np.linspace(128 - coverage // 2, 128 + coverage // 2, 5)
+    mapx = np.broadcast_to(range_, (5, 5)) + params["noise"][idx, 0]
+    mapy = np.broadcast_to(range_, (5, 5)).T + params["noise"][idx, 1]
+    crop = slice(8 * zoom, 72 * zoom)
+    interp_mapx = cv2.resize(mapx, (80 * zoom, 80 * zoom))[crop, crop].astype("float32")
+    interp_mapy = cv2.resize(mapy, (80 * zoom, 80 * zoom))[crop, crop].astype("float32")
+    warped = cv2.remap(image, interp_mapx, interp_mapy, cv2.INTER_LINEAR)
+
+    src_points = np.stack([mapx.ravel(), mapy.ravel()], axis=-1)
+    dst_points = np.mgrid[0:65 * zoom:16 * zoom, 0:65 * zoom:16 * zoom].T.reshape(-1, 2)
+    mat = umeyama(src_points, dst_points, True)[0:2]
+    target = cv2.warpAffine(image, mat, (64 * zoom, 64 * zoom))
+    return warped, target
+
+
+@pytest.mark.parametrize("zoom", (1, 2))
+def test_batch_augment_matches_per_face(zoom):
+    """ The batched augmentation gives exactly the per face transform and
+        warp for the same random parameters """
+    np.random.seed(0)
+    images = np.random.randint(0, 256, (8, 256, 256, 3)).astype("uint8")
+    generator = TrainingDataGenerator(RANDOM_TRANSFORM, 160, 5, zoom)
+    params = generator.get_augment_params(len(images))
+    assert params["flip"].any() and not params["flip"].all()
+    result = generator.augment_batch(images, params)
+    for idx, image in enumerate(images):
+        warped, target = augment_face(image, params, idx, 160, zoom)
+        np.testing.assert_array_equal(result[idx, 0], warped)
+        np.testing.assert_array_equal(result[idx, 1], target)
+
+
+def test_batch_colour_adjusted_into_buffer(faces):
+    """ Faces are augmented as uint8 and colour adjusted into the given
+        float32 buffer """
+    generator = TrainingDataGenerator(RANDOM_TRANSFORM, 160)
+    images = np.stack([generator.load_face(face) for face in faces[:4]])
+    assert images.dtype == np.uint8
+    np.random.seed(0)
+    expected = generator.augment_batch(images) / 255.0
+    out = np.empty((4, 2, 64, 64, 3), dtype=np.float32)
+    np.random.seed(0)
+    assert generator.build_batch(faces[:4], out=out) is out
+    np.testing.assert_allclose(out, expected, rtol=1e-6)
+
+
+@pytest.mark.parametrize("workers", (1, 2))
+def test_batches_reuse_ring(faces, workers):
+    """ Batches are built into a ring of prefetch + 1 preallocated slots """
+    generator = TrainingDataGenerator(STATIC_TRANSFORM, 160, scale=0,
+                                      training_opts={"workers": workers, "prefetch": 2})
+    batches = generator.minibatchAB(list(faces), 4)
+    addresses = set()
+    for _ in range(9):
+        _, warped, target = next(batches)
+        assert warped.dtype == np.float32
+        assert np.may_share_memory(warped, target)
+        addresses.add(warped.__array_interface__["data"][0])
+    batches.close()
+    assert len(addresses) == 3
+
+
+def test_dataset_batches_match_build_batch(faces):
+    """ The tf.data pipeline yields the faces build_batch builds, in order
+        and with the same epochs, and splits the image cache between no more
+        than workers caches """
+    pytest.importorskip("tensorflow")
+    pytest.importorskip("keras")
+    generator = TrainingDataGenerator(STATIC_TRANSFORM, 160, scale=0,
+                                      training_opts={"tf_data": True, "workers": 2,
+                                                     "prefetch": 2, "cache_size": 1 << 30})
+    batches = generator.minibatchAB(list(faces), 4, doShuffle=False)
+    for expected_epoch, start in ((0, 0), (0, 4), (1, 0), (1, 4), (2, 0)):
+        epoch, warped, target = next(batches)
+        expected = generator.build_batch(faces[start:start + 4])
+        assert epoch == expected_epoch
+        np.testing.assert_array_equal(warped, expected[:, 0])
+        np.testing.assert_array_equal(target, expected[:, 1])
+        assert 0 < len(generator.cache_stats) <= 2
+    batches.close()
@@ -14,7 +14,9 @@ class Alignments():
         set_system_verbosity(self.args.loglevel)
 
         dest_format = self.get_dest_format()
-        self.alignments = AlignmentData(self.args.alignments_file, dest_format)
+        self.alignments = AlignmentData(self.args.alignments_file,
+                                        dest_format,
+                                        compact=self.args.compact_alignments)
 
     def get_dest_format(self):
         """ Set the destination format for Alignments """
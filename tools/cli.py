@@ -61,6 +61,8 @@ class AlignmentsArgs(FaceSwapArgs):
                     "\n\tAlignments can be converted from DeepFaceLab by specifing:"
                     "\n\t    -a dfl"
                     "\n\t    -fc <source faces folder>"
+                    "\n\tAlignments can be split into a sharded '.shards' folder by "
+                    "\n\tspecifying a shard size with the -ss option."
                     "\n'remove-faces': Remove deleted faces from an alignments file. The original"
                     "\n\talignments file will be backed up. A different file format for the"
                     "\n\talignments file can optionally be specified (-fmt)." + faces_dir +
@@ -111,6 +113,24 @@ class AlignmentsArgs(FaceSwapArgs):
                               "choices": ("json", "pickle", "yaml"),
                               "help": "The file format to save the alignment "
                                       "data in. Defaults to same as source."})
+        argument_list.append({"opts": ("-ss", "--shard-size"),
+                              "type": int,
+                              "dest": "shard_size",
+                              "default": None,
+                              "help": "Split the alignments into a sharded "
+                                      "'.shards' folder holding this many "
+                                      "frames per shard. Sharded alignments "
+                                      "are only loaded as they are needed, "
+                                      "which bounds memory use for very large "
+                                      "projects. (Reformat only)"})
+        argument_list.append({"opts": ("--compact-alignments", ),
+                              "action": "store_true",
+                              "dest": "compact_alignments",
+                              "default": False,
+                              "help": "Write json alignments without "
+                                      "indentation. Creates significantly "
+                                      "smaller files which are harder to read "
+                                      "by eye."})
         argument_list.append({
             "opts": ("-o", "--output"),
             "type": str,
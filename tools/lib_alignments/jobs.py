@@ -99,11 +99,13 @@ class Check():
             retval_key = "frame_fullname"
         logger.debug("frame_key: '%s', retval_key: '%s'", frame_key, retval_key)
 
+        if self.type == "faces":
+            hashes_to_frame = self.alignments.hashes_to_frame
         for item in tqdm(self.items, desc=self.output_message):
             frame = item[frame_key]
             if self.type == "faces":
                 frame_idx = [(frame, idx)
-                             for frame, idx in self.alignments.hashes_to_frame[frame].items()]
+                             for frame, idx in hashes_to_frame[frame].items()]
             retval = item[retval_key]
             for frame, idx in frame_idx:
                 if self.alignments.frame_has_multiple_faces(frame):
@@ -137,9 +139,10 @@ class Check():
     def get_leftover_faces(self):
         """yield each face that isn't in the alignments file."""
         self.output_message = "Faces missing from the alignments file"
+        hashes_to_frame = self.alignments.hashes_to_frame
         for face in tqdm(self.items, desc=self.output_message):
             f_hash = face["face_hash"]
-            if not self.alignments.hashes_to_frame.get(f_hash, None):
+            if not hashes_to_frame.get(f_hash, None):
                 logger.debug("Returning: '%s'", face["face_fullname"])
                 yield face["face_fullname"]
 
@@ -310,6 +313,10 @@ class Extract():
     def export_faces(self):
         """ Export the faces """
         extracted_faces = 0
+        if self.type != "large":
+            # Face hashes are updated as faces are saved, so sharded alignments
+            # can be written back as they are released
+            self.alignments.set_write_back()
 
         for frame in tqdm(self.frames.file_list_sorted, desc="Saving extracted faces"):
             frame_name = frame["frame_fullname"]
@@ -504,6 +511,7 @@ class Reformat():
     def __init__(self, alignments, arguments):
         logger.debug("Initializing %s: (arguments: %s)", self.__class__.__name__, arguments)
         self.alignments = alignments
+        self.shard_size = getattr(arguments, "shard_size", None)
         if self.alignments.file == "dfl.json":
             logger.debug("Loading DFL faces")
             self.faces = Faces(arguments.faces_dir)
@@ -515,6 +523,11 @@ class Reformat():
         if self.alignments.file == "dfl.json":
             self.alignments.data = self.load_dfl()
             self.alignments.file = self.alignments.get_location(self.faces.folder, "alignments")
+        if self.shard_size:
+            if self.alignments.is_sharded:
+                logger.error("Alignments are already sharded")
+                exit(0)
+            self.alignments.set_sharded(shard_size=self.shard_size)
         self.alignments.save()
 
     def load_dfl(self):
@@ -599,6 +612,7 @@ class RemoveAlignments():
             legacy.process()
 
         logger.info("[REMOVE ALIGNMENTS DATA]")  # Tidy up cli output
+        self.alignments.set_write_back()
         del_count = 0
         task = getattr(self, "remove_{}".format(self.type))
 
@@ -4,13 +4,13 @@
 
 import logging
 import os
-from tqdm import tqdm
 
 import cv2
 
-from lib.alignments import Alignments
+from lib import Serializer
+from lib.alignments import Alignments, SHARDS_EXT
 from lib.faces_detect import DetectedFace
-from lib.utils import _image_extensions, _video_extensions, hash_image_file, hash_encode_image
+from lib.utils import _image_extensions, _video_extensions, hash_image_files, hash_encode_image
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -18,15 +18,18 @@ logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 class AlignmentData(Alignments):
     """ Class to hold the alignment data """
 
-    def __init__(self, alignments_file, destination_format):
-        logger.debug("Initializing %s: (alignments file: '%s', destination_format: '%s')",
-                     self.__class__.__name__, alignments_file, destination_format)
+    def __init__(self, alignments_file, destination_format, compact=False):
+        logger.debug("Initializing %s: (alignments file: '%s', destination_format: '%s', "
+                     "compact: %s)", self.__class__.__name__, alignments_file,
+                     destination_format, compact)
         logger.info("[ALIGNMENT DATA]")  # Tidy up cli output
         folder, filename = self.check_file_exists(alignments_file)
+        self.backed_up = False
         if filename.lower() == "dfl":
+            self.compact = compact
             self.set_dfl(destination_format)
             return
-        super().__init__(folder, filename=filename)
+        super().__init__(folder, filename=filename, compact=compact)
         self.set_destination_format(destination_format)
         logger.verbose("%s items loaded", self.frames_count)
         logger.debug("Initialized %s", self.__class__.__name__)
@@ -39,7 +42,8 @@ class AlignmentData(Alignments):
             folder = None
             filename = "dfl"
             logger.info("Using extracted pngs for alignments")
-        elif not os.path.isfile(alignments_file):
+        elif not (os.path.isfile(alignments_file) or
+                  (os.path.isdir(alignments_file) and alignments_file.endswith(SHARDS_EXT))):
             logger.error("ERROR: alignments file not found at: '%s'", alignments_file)
             exit(0)
         if folder:
@@ -59,9 +63,15 @@ class AlignmentData(Alignments):
                       ".yml": "yaml",
                       ".yaml": "yaml"}
         dst_fmt = None
-        file_ext = os.path.splitext(self.file)[1].lower()
+        file_ext = Serializer.get_serializer_ext(self.file).lower()
+        compression_ext = Serializer.get_compression_ext(self.file)
         logger.debug("File extension: '%s'", file_ext)
 
+        if self.file != "dfl" and self.is_sharded:
+            if destination_format is not None:
+                logger.warning("The format of sharded alignments cannot be changed. Keeping "
+                               "'%s'", self.serializer.ext)
+            return
         if destination_format is not None:
             dst_fmt = destination_format
         elif self.file == "dfl":
@@ -75,13 +85,22 @@ class AlignmentData(Alignments):
         logger.verbose("Destination format set to '%s'", dst_fmt)
 
         self.serializer = self.get_serializer("", dst_fmt)
-        filename = os.path.splitext(self.file)[0]
-        self.file = "{}.{}".format(filename, self.serializer.ext)
+        filename = self.file[:len(self.file) - len(compression_ext)]
+        filename = os.path.splitext(filename)[0]
+        self.file = "{}.{}{}".format(filename, self.serializer.ext, compression_ext)
         logger.debug("Destination file: '%s'", self.file)
 
+    def set_write_back(self):
+        """ Backup the alignments before shards start being written in place """
+        if self.is_sharded and not self.backed_up:
+            self.backup()
+            self.backed_up = True
+        super().set_write_back()
+
     def save(self):
         """ Backup copy of old alignments and save new alignments """
-        self.backup()
+        if not self.backed_up:
+            self.backup()
         super().save()
 
 
@@ -186,12 +205,13 @@ class Faces(MediaLoader):
     def process_folder(self):
         """ Iterate through the faces dir pulling out various information """
         logger.info("Loading file list from %s", self.folder)
-        for face in tqdm(os.listdir(self.folder), desc="Reading Face Hashes"):
-            if not self.valid_extension(face):
-                continue
+        faces = [face for face in os.listdir(self.folder) if self.valid_extension(face)]
+        hashes = hash_image_files([os.path.join(self.folder, face) for face in faces],
+                                  desc="Reading Face Hashes")
+        for face in faces:
             filename = os.path.splitext(face)[0]
             file_extension = os.path.splitext(face)[1]
-            face_hash = hash_image_file(os.path.join(self.folder, face))
+            face_hash = hashes[os.path.join(self.folder, face)]
             retval = {"face_fullname": face,
                       "face_name": filename,
                       "face_extension": file_extension,